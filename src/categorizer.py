@@ -1,17 +1,19 @@
 import re
 import os
 import logging
-import json # Added for potential input formatting
-from typing import List, Dict, Any, Union, Optional
+import json # Added for the AI result cache file
+import msgspec # Fast typed JSON encoding for AI input
+import asyncio # Added for concurrent sub-batch processing
+import functools # Added for lazy Agent initialization
+import importlib.util # Added for checking the AI libraries without importing them
+from typing import List, Dict, Any, Union, Optional, Tuple
 # Removed: from enum import Enum
 from pydantic import BaseModel, Field, ValidationError
-from pydantic_ai import Agent
-from pydantic_ai.agent import AgentRunResult # Added import
-from pydantic_ai.models.gemini import GeminiModel
-from pydantic_ai.providers.google_gla import GoogleGLAProvider
+# pydantic_ai / httpx are imported lazily where they are used; _get_ai_setup only checks they are installed
 
 # Import Category and Transaction from models using absolute import
 from src.models import Transaction, Category, DEFAULT_CATEGORY_ENUM # Updated import
+from src.retries import MAX_RETRIES, retry_delay # Shared backoff policy
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -21,25 +23,45 @@ logger = logging.getLogger(__name__)
 # IMPORTANT: This prompt needs a complete rewrite for the new AI tasks:
 # It must instruct the AI to generate short_description, category_str, is_expense, and is_split
 # based on the raw transaction details provided in the input.
-FULL_PROMPT = "LOAD_PROMPT_FROM_FILE_OR_CONFIG" # Placeholder: Load actual prompt here
-try:
-    prompt_file_path = os.path.join(os.path.dirname(__file__), 'categorization_prompt.txt')
-    if os.path.exists(prompt_file_path):
-        with open(prompt_file_path, 'r') as f:
-            FULL_PROMPT = f.read()
-        logger.info("Successfully loaded categorization prompt from file.")
-    else:
-        logger.error(f"Categorization prompt file not found at: {prompt_file_path}")
-        FULL_PROMPT = "Error: Prompt file not found. AI processing will likely fail."
-except Exception as e:
-    logger.error(f"Failed to load categorization prompt: {e}")
-    FULL_PROMPT = "Error: Failed to load prompt. AI processing will likely fail."
-
-FULL_PROMPT += "\n\n" +  "Valid Categories: \n" + "\n  ".join([cat.name for cat in Category]) + "\n\n" # Append valid categories to the prompt
+def _load_full_prompt() -> str:
+    """
+    Reads the categorization prompt file and appends the invariant category list and input encoding note.
+    Called lazily (via _get_ai_setup) so importing this module does no file I/O.
+    """
+    full_prompt = "LOAD_PROMPT_FROM_FILE_OR_CONFIG" # Placeholder: Load actual prompt here
+    try:
+        prompt_file_path = os.path.join(os.path.dirname(__file__), 'categorization_prompt.txt')
+        if os.path.exists(prompt_file_path):
+            with open(prompt_file_path, 'r') as f:
+                full_prompt = f.read()
+            logger.info("Successfully loaded categorization prompt from file.")
+        else:
+            logger.error(f"Categorization prompt file not found at: {prompt_file_path}")
+            full_prompt = "Error: Prompt file not found. AI processing will likely fail."
+    except Exception as e:
+        logger.error(f"Failed to load categorization prompt: {e}")
+        full_prompt = "Error: Failed to load prompt. AI processing will likely fail."
+
+    # Append valid categories once, sorted by name so the system prompt (and the provider's prefix cache key) is stable
+    full_prompt += "\n\n" +  "Valid Categories: \n" + "\n  ".join(sorted(cat.name for cat in Category)) + "\n\n"
+    # Input rows are sent as compact positional arrays (see _AIInput), so describe that shape to the model
+    full_prompt += "Input Encoding: each transaction is sent as a JSON array [index, date, description, amount] instead of an object with those fields.\n\n"
+    return full_prompt
 
 # --- Category Enum moved to models.py ---
 
 
+# --- Wire Shape for AI Input ---
+
+# Encoded by msgspec's compiled encoder, so no intermediate dict is built per transaction.
+# array_like=True emits [index, date, description, amount] rather than objects, which cuts input tokens.
+class _AIInput(msgspec.Struct, array_like=True):
+    index: int # Global index so results can be merged back by 'original_index'
+    date: str
+    description: str
+    amount: float
+
+
 # --- Pydantic Models for AI Output ---
 
 # Model for a single processed transaction returned by AI
@@ -58,26 +80,52 @@ class AIProcessedBatch(BaseModel):
 # --- AI Processing Setup ---
 
 API_KEY = os.getenv("GEMINI_API_KEY")
-agent = None
-gemini_model = None
+prefix_cache_warmed = False # Set once the first request has populated the provider-side prompt cache
 
-if not API_KEY:
-    logger.error("GEMINI_API_KEY environment variable not set. AI Processing disabled.")
-else:
-    try:
-        gemini_model = GeminiModel('gemini-1.5-flash', provider=GoogleGLAProvider(api_key=API_KEY))
-        logger.info("GeminiModel initialized successfully.")
+# Sub-batches are sized by estimated input tokens (~4 JSON bytes per token) and sent concurrently.
+# AI_BATCH_SIZE still caps the rows per request, which bounds the length of the AI's response.
+AI_TARGET_TOKENS = 8000
+AI_BATCH_SIZE = 25
+AI_MIN_SPLIT_SIZE = 4 # Sub-batches larger than this are halved and retried on a rate-limit, length or validation error
+AI_MAX_CONCURRENT_REQUESTS = 8 # agent.run calls in flight at once, across all sub-batches
 
-        # Initialize the Agent with the BATCH output type
-        agent = Agent(model=gemini_model, result_type=AIProcessedBatch)
-        logger.info("PydanticAI Agent with Gemini initialized successfully for batch processing.")
+@functools.lru_cache(maxsize=1)
+def _get_ai_setup() -> tuple:
+    """
+    Loads the prompt and checks that AI processing is available on first use, so importing this
+    module stays cheap for callers that never categorize. Only results that outlive an event loop
+    are cached here; no HTTP client, provider or Agent, which _build_agent creates per run.
 
-    except ImportError as ie:
-        logger.error(f"Required libraries ('pydantic-ai', 'google-generativeai') not found or import error: {ie}. Please check installation.")
-        agent = None
-    except Exception as e:
-        logger.error(f"Error initializing PydanticAI Agent or GeminiModel: {e}")
-        agent = None
+    Returns:
+        tuple: (ai_available, full_prompt).
+    """
+    full_prompt = _load_full_prompt()
+    if not API_KEY:
+        logger.error("GEMINI_API_KEY environment variable not set. AI Processing disabled.")
+        return False, full_prompt
+
+    # Checks the packages are installed without importing them; the AI helpers import what they use
+    missing = [name for name in ('pydantic_ai', 'httpx') if importlib.util.find_spec(name) is None]
+    if missing:
+        logger.error(f"Required libraries ('pydantic-ai', 'httpx') not found: {', '.join(missing)}. Please check installation.")
+        return False, full_prompt
+    return True, full_prompt
+
+
+def _build_agent(http_client, full_prompt: str):
+    """Builds the Gemini-backed Agent for one run, sending its requests through http_client."""
+    from pydantic_ai import Agent
+    from pydantic_ai.models.gemini import GeminiModel
+    from pydantic_ai.providers.google_gla import GoogleGLAProvider
+
+    gemini_model = GeminiModel('gemini-1.5-flash', provider=GoogleGLAProvider(api_key=API_KEY, http_client=http_client))
+    logger.info("GeminiModel initialized successfully.")
+
+    # Initialize the Agent with the BATCH output type
+    # The invariant prompt is the system prompt; only the transaction JSON is sent as user input per call
+    agent = Agent(model=gemini_model, system_prompt=full_prompt, result_type=AIProcessedBatch)
+    logger.info("PydanticAI Agent with Gemini initialized successfully for batch processing.")
+    return agent
 
 
 # Helper function to safely get values (remains useful for preparing input)
@@ -107,18 +155,22 @@ def process_transactions_ai(raw_transactions: List[Transaction], config: Optiona
     - is_split (boolean)
 
     It modifies the original Transaction objects in the list by populating these fields.
+    Transactions are sent in sub-batches of up to AI_TARGET_TOKENS estimated input tokens
+    (and at most AI_BATCH_SIZE rows), all dispatched concurrently.
 
     Args:
         raw_transactions (List[Transaction]): A list of raw transaction objects from models.py.
                                               Expected attributes: 'date', 'description', 'amount'.
                                               'short_description', 'category', 'is_expense', 'is_split' are initially None.
-        config (dict, optional): Configuration dictionary (currently unused here).
+        config (dict, optional): Configuration dictionary. 'AI_CACHE_ENABLED' and 'AI_CACHE_FILE'
+                                 control the on-disk cache of previous AI results.
 
     Returns:
         List[Transaction]: The same list of Transaction objects, now enriched with AI-generated data.
                            Returns the original list with defaults if AI processing fails.
     """
-    if not agent:
+    ai_available, full_prompt = _get_ai_setup()
+    if not ai_available:
         logger.error("Cannot process transactions: AI Agent is not initialized (check API key and libraries). Assigning defaults.")
         for txn in raw_transactions:
             # txn.short_description = txn.short_description or "AI Processing Disabled" # Keep original description
@@ -127,8 +179,8 @@ def process_transactions_ai(raw_transactions: List[Transaction], config: Optiona
             txn.is_split = txn.is_split if txn.is_split is not None else False
         return raw_transactions
 
-    if "Error:" in FULL_PROMPT:
-         logger.error(f"Cannot process transactions: {FULL_PROMPT}. Assigning defaults.")
+    if "Error:" in full_prompt:
+         logger.error(f"Cannot process transactions: {full_prompt}. Assigning defaults.")
          for txn in raw_transactions:
              # txn.short_description = txn.short_description or "AI Prompt Error" # Keep original description
              txn.category = txn.category or DEFAULT_CATEGORY_ENUM # Use imported default
@@ -142,129 +194,312 @@ def process_transactions_ai(raw_transactions: List[Transaction], config: Optiona
 
     logger.info(f"Starting AI batch processing for {len(raw_transactions)} transactions...")
 
-    # Prepare input for the AI Agent - format the list of raw transactions
-    # Option 1: Simple list of descriptions (might lose context)
-    # input_texts = [f"Date: {t.date}, Desc: {t.description}, Amt: {t.amount}" for t in raw_transactions]
-    # input_for_ai = "\n---\n".join(input_texts)
+    # --- Apply cached results; only unseen transactions go to the AI ---
+    config = config or {}
+    cache_enabled = config.get('AI_CACHE_ENABLED', False)
+    cache_file = config.get('AI_CACHE_FILE', 'ai_category_cache.json')
+    ai_cache = _load_ai_cache(cache_file) if cache_enabled else {}
+
+    pending_indices = []
+    for i, txn in enumerate(raw_transactions):
+        cached = ai_cache.get(_ai_cache_key(txn))
+        if cached:
+            txn.category = Category.from_string(cached['category'])
+            txn.is_expense = cached['is_expense']
+            txn.is_split = cached['is_split']
+        else:
+            pending_indices.append(i)
+    if cache_enabled:
+        logger.info(f"AI cache: {len(raw_transactions) - len(pending_indices)} hits, {len(pending_indices)} misses.")
+    if not pending_indices:
+        logger.info(f"Finished AI processing for the batch.")
+        return raw_transactions
+
+    # Send one representative per group of duplicate transactions; results are copied to the rest
+    duplicate_groups = _group_duplicates(raw_transactions, pending_indices)
+    representatives = list(duplicate_groups)
+    if len(representatives) < len(pending_indices):
+        logger.info(f"Collapsed {len(pending_indices)} transactions into {len(representatives)} unique groups for the AI.")
+
+    # Split into sub-batches; indices stay global so results can be merged by 'original_index'
+    chunks = _chunk_by_tokens(raw_transactions, representatives)
+    logger.info(f"Sending {len(chunks)} sub-batch(es) of up to ~{AI_TARGET_TOKENS} tokens to the Agent concurrently...")
+
+    try:
+        chunk_results = asyncio.run(_run_ai_batches(full_prompt, raw_transactions, chunks))
+    except Exception as e:
+        logger.error(f"Error during AI Agent batch processing: {e}")
+        chunk_results = [(chunk_indices, e) for chunk_indices in chunks]
+
+    # Sub-batches that were halved after an error come back as several (indices, result) pairs
+    for chunk_num, (chunk_indices, result) in enumerate(chunk_results, 1):
+        # Each sub-batch falls back to defaults on its own so one failure doesn't poison the rest
+        error_message = None
+        if isinstance(result, ValidationError):
+            logger.error(f"Sub-batch {chunk_num}: AI output validation error: {result}. Could not parse AI response into AIProcessedBatch.")
+            error_message = "AI Validation Error"
+        elif isinstance(result, Exception):
+            logger.error(f"Sub-batch {chunk_num}: Error during AI Agent batch processing: {result}")
+            error_message = "AI Processing Error"
+        elif not isinstance(result, AIProcessedBatch):
+            logger.error(f"Sub-batch {chunk_num}: AI processing resulted in an unexpected data type: {type(result)}. Expected AIProcessedBatch. Data: {result}")
+            error_message = "AI Processing Error"
+        else:
+            updated_indices = _apply_ai_results(raw_transactions, chunk_indices, result)
+            for idx in updated_indices:
+                txn = raw_transactions[idx]
+                for member_idx in duplicate_groups[idx][1:]:
+                    member = raw_transactions[member_idx]
+                    member.category, member.is_expense, member.is_split = txn.category, txn.is_expense, txn.is_split
+                if cache_enabled:
+                    ai_cache[_ai_cache_key(txn)] = {'category': txn.category.value, 'is_expense': txn.is_expense, 'is_split': txn.is_split}
+
+        if error_message:
+            failed_indices = [member_idx for idx in chunk_indices for member_idx in duplicate_groups[idx]]
+            logger.warning(f"{error_message} occurred. Assigning default values to {len(failed_indices)} transactions in sub-batch {chunk_num}.")
+            for idx in failed_indices:
+                txn = raw_transactions[idx]
+                # Overwrite fields with error defaults
+                txn.category = DEFAULT_CATEGORY_ENUM # Use imported default
+                txn.is_expense = 1 # Default assumption on error: expense (1)
+                txn.is_split = 0 # Default assumption on error: not split (0)
+
+    if cache_enabled:
+        _save_ai_cache(cache_file, ai_cache)
+
+    logger.info(f"Finished AI processing for the batch.")
+    return raw_transactions # Return the original list, now potentially enriched or with defaults
+
+
+# --- Duplicate Grouping ---
+
+# Upper bound on transactions that share one AI result
+MAX_DUPLICATE_GROUP_SIZE = 50
+
+def _group_duplicates(raw_transactions: List[Transaction], indices: List[int]) -> Dict[int, List[int]]:
+    """
+    Groups transactions that would get the same AI answer: same normalized description, type
+    and order of magnitude of amount (see _ai_cache_key), so rent and a small fee
+    from the same payee are not collapsed.
+
+    Returns:
+        Dict[int, List[int]]: Representative index -> all member indices (representative first), in input order.
+    """
+    groups: Dict[int, List[int]] = {}
+    open_groups: Dict[tuple, int] = {} # Group key -> representative of the group still accepting members
+    for i in indices:
+        key = _ai_cache_key(raw_transactions[i])
+        representative = open_groups.get(key)
+        if representative is None or len(groups[representative]) >= MAX_DUPLICATE_GROUP_SIZE:
+            representative = open_groups[key] = i
+            groups[representative] = []
+        groups[representative].append(i)
+    return groups
 
+
+# --- AI Result Cache ---
+
+_DIGITS_PATTERN = re.compile(r'\d+')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def _ai_cache_key(txn: Transaction) -> str:
+    """
+    Builds the cache key for a transaction: its description with digit runs (dates, reference
+    numbers) collapsed, plus the transaction type and the order of magnitude (digit count) of
+    the amount, so recurring merchants share one entry but rent and a small fee with the same
+    description don't.
+    """
+    description = _DIGITS_PATTERN.sub('#', txn.description or '')
+    description = _WHITESPACE_PATTERN.sub(' ', description).strip().lower()
+    amount_magnitude = len(str(int(abs(txn.amount)))) if txn.amount else 0
+    return f"{txn.transaction_type}|{amount_magnitude}|{description}"
+
+
+def _load_ai_cache(cache_file: str) -> Dict[str, Dict[str, Any]]:
+    """Loads the AI result cache from disk. Returns an empty cache if missing or unreadable."""
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, 'r') as f:
+            ai_cache = json.load(f)
+        logger.info(f"Loaded {len(ai_cache)} cached AI results from {cache_file}")
+        return ai_cache
+    except (json.JSONDecodeError, IOError) as e:
+        logger.warning(f"Failed to load AI cache '{cache_file}': {e}. Starting with an empty cache.")
+        return {}
+
+
+def _save_ai_cache(cache_file: str, ai_cache: Dict[str, Dict[str, Any]]) -> None:
+    """Writes the AI result cache to disk via a temp file and os.replace, so an interrupted run can't truncate it."""
+    try:
+        tmp_file = f"{cache_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(ai_cache, f)
+        os.replace(tmp_file, cache_file) # Readers never see a half-written file
+        logger.info(f"Saved {len(ai_cache)} AI results to cache: {cache_file}")
+    except (IOError, TypeError) as e:
+        logger.error(f"Error saving AI cache '{cache_file}': {e}")
+
+
+def _to_ai_input(index: int, txn: Transaction) -> _AIInput:
+    """Selects the fields of a transaction that are sent to the AI."""
+    return _AIInput(index, txn.date or "Unknown", txn.description or "", txn.amount or 0.0)
+
+
+def _chunk_by_tokens(raw_transactions: List[Transaction], indices: List[int]) -> List[List[int]]:
+    """
+    Greedily partitions indices into sub-batches whose estimated input size stays under
+    AI_TARGET_TOKENS (JSON bytes // 4), with at most AI_BATCH_SIZE rows each.
+    """
+    chunks: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for i in indices:
+        row_tokens = len(msgspec.json.encode(_to_ai_input(i, raw_transactions[i]))) // 4 + 1 # +1 for the separator
+        if current and (current_tokens + row_tokens > AI_TARGET_TOKENS or len(current) >= AI_BATCH_SIZE):
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += row_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _build_ai_input(raw_transactions: List[Transaction], chunk_indices: List[int]) -> str:
+    """Serializes one sub-batch of transactions into the JSON input sent to the Agent."""
     # Option 2: JSON string representation (better structure for AI)
     try:
         # Select relevant fields for the AI prompt
-        input_data_for_ai = [
-            {
-                "index": i, # Include index for potential matching robustness
-                "date": str(t.date) if t.date else "Unknown",
-                "description": t.description or "",
-                "amount": t.amount if t.amount is not None else 0.0
-            }
-            for i, t in enumerate(raw_transactions)
-        ]
-        input_for_ai = json.dumps(input_data_for_ai, indent=2)
-        logger.debug(f"Prepared JSON input for AI:\n{input_for_ai[:500]}...") # Log snippet
+        input_data_for_ai = [_to_ai_input(i, raw_transactions[i]) for i in chunk_indices]
+        # Compact output: pretty-printing only adds input tokens
+        input_for_ai = msgspec.json.encode(input_data_for_ai).decode("utf-8")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Prepared JSON input for AI:\n{input_for_ai[:500]}...") # Log snippet
     except Exception as json_err:
         logger.error(f"Error creating JSON input for AI: {json_err}. Falling back.")
         # Fallback: simple string list
-        input_texts = [f"Index: {i}, Date: {t.date}, Desc: {t.description}, Amt: {t.amount}" for i, t in enumerate(raw_transactions)]
+        input_texts = [f"Index: {i}, Date: {raw_transactions[i].date}, Desc: {raw_transactions[i].description}, Amt: {raw_transactions[i].amount}" for i in chunk_indices]
         input_for_ai = "\n---\n".join(input_texts)
+    return input_for_ai
 
 
-    ai_processed_successfully = False # Flag to track success
-    result = None # Initialize result
-    validation_error_occurred = False
-    processing_error_occurred = False
+async def _run_ai_batch(agent, input_for_ai: str) -> AIProcessedBatch:
+    """Sends a single sub-batch to the Agent and unwraps the result."""
+    from pydantic_ai.agent import AgentRunResult # Already loaded by _build_agent
+    result = await agent.run(input_for_ai)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Raw AI output received (pre-validation):\n```\n{result}\n```")
+    if isinstance(result, AgentRunResult):
+        return result.data # Extract the actual data
+    return result
 
-    try:
-        # Call PydanticAI Agent for the entire batch
-        logger.debug(f"Sending batch of {len(raw_transactions)} transactions to Agent...")
-        # --- MODIFIED CALL ---
-        # Pass only input_text. Assumes prompt/output model are handled by Agent config.
-        # If this fails, may need to re-add prompt=FULL_PROMPT or adjust Agent init.
-        result = agent.run_sync(input_for_ai) # Removed type hint, check type below
-        # --- Log Raw AI Output (or validated/parsed output if raw isn't directly available) ---
-        logger.info(f"Raw AI output received (pre-validation):\n```\n{result}\n```")
-        # --- END MODIFIED CALL ---
-
-        # --- Check result type, unwrap if necessary, and update original transactions ---
-        processed_data = None
-        if isinstance(result, AgentRunResult):
-            logger.info("AI Agent returned AgentRunResult, extracting data.")
-            processed_data = result.data # Extract the actual data
-        else:
-            logger.info("AI Agent returned result directly.")
-            processed_data = result # Use the result as is
-
-        if isinstance(processed_data, AIProcessedBatch):
-            logger.info(f"Successfully obtained AIProcessedBatch with {len(processed_data.processed_transactions)} transactions.")
-
-            # --- Update original transactions using original_index from AI results ---
-            if len(processed_data.processed_transactions) != len(raw_transactions):
-                logger.warning(f"Mismatch in transaction count! Input: {len(raw_transactions)}, AI Output: {len(processed_data.processed_transactions)}. Will update based on 'original_index' provided by AI.")
-            
-            updated_count = 0
-            updated_indices = set() # Keep track of which original transactions were updated
-
-            for ai_txn in processed_data.processed_transactions:
-                try:
-                    original_idx = ai_txn.original_index
-                    if 0 <= original_idx < len(raw_transactions):
-                        original_txn = raw_transactions[original_idx]
-
-                        # Update fields in the original Transaction object
-                        original_txn.category = Category.from_string(ai_txn.category_str) # Use imported Category
-                        original_txn.is_expense = ai_txn.is_expense # Now an int (0 or 1)
-                        original_txn.is_split = ai_txn.is_split     # Now an int (0, 1, or 2)
-                        
-                        updated_indices.add(original_idx)
-                        updated_count += 1
-                    else:
-                        logger.warning(f"AI result provided an invalid original_index ({original_idx}) which is out of bounds for the input list (size {len(raw_transactions)}). Skipping this AI result.")
-                except AttributeError:
-                     logger.warning(f"AI result object missing 'original_index'. Skipping this AI result: {ai_txn}")
-                except Exception as update_err:
-                     logger.error(f"Error updating transaction at index {original_idx} with AI data ({ai_txn}): {update_err}")
-
-            logger.info(f"Successfully processed {len(processed_data.processed_transactions)} AI results and updated {updated_count} original transactions.")
-            
-            # Log which original transactions were NOT updated
-            not_updated_count = 0
-            for i, txn in enumerate(raw_transactions):
-                if i not in updated_indices:
-                    logger.warning(f"Original transaction at index {i} (Desc: '{txn.description}') was NOT updated by the AI results.")
-                    not_updated_count += 1
-            if not_updated_count > 0:
-                 logger.warning(f"Total {not_updated_count} original transactions were not updated.")
-
-            ai_processed_successfully = True # Mark as successful
-        else:
-            # Handle unexpected result type (after potential unwrapping)
-            logger.error(f"AI processing resulted in an unexpected data type: {type(processed_data)}. Expected AIProcessedBatch. Original result type was: {type(result)}. Data: {processed_data}")
-            ai_processed_successfully = False # Ensure failure handling is triggered
-    except ValidationError as ve:
-         logger.error(f"AI output validation error: {ve}. Could not parse AI response into AIProcessedBatch.")
-         validation_error_occurred = True # Mark validation error
 
+async def _run_ai_chunk(agent, semaphore: asyncio.Semaphore, raw_transactions: List[Transaction],
+                        chunk_indices: List[int], attempt: int = 0) -> List[Tuple[List[int], Any]]:
+    """
+    Sends one sub-batch, holding the semaphore only while the request is in flight. On a rate limit
+    (HTTP 429) it waits with exponential backoff before retrying; on a rate limit or a length/validation
+    error a sub-batch larger than AI_MIN_SPLIT_SIZE is retried as two halves, so only the smallest
+    failing pieces fall back to defaults. Other errors are returned straight away.
+    Returns (indices, result or exception) pairs.
+    """
+    from pydantic_ai.exceptions import ModelHTTPError, UnexpectedModelBehavior # Already loaded by _build_agent
+    try:
+        async with semaphore:
+            return [(chunk_indices, await _run_ai_batch(agent, _build_ai_input(raw_transactions, chunk_indices)))]
     except Exception as e:
-        logger.error(f"Error during AI Agent batch processing: {e}")
-        processing_error_occurred = True # Mark general processing error
-
-    # --- Handle AI Processing Failure (Assign Defaults) ---
-    if not ai_processed_successfully:
-        error_message = "AI Processing Error" # Default error message
-        if validation_error_occurred:
-            error_message = "AI Validation Error"
-        elif processing_error_occurred:
-             error_message = "AI Processing Error" # Could use the specific exception 'e' here if needed
-
-        logger.warning(f"{error_message} occurred. Assigning default values to all transactions in the batch.")
-        for txn in raw_transactions:
-            # Overwrite fields with error defaults
-            # txn.short_description = error_message # Keep original description
-            txn.category = DEFAULT_CATEGORY_ENUM # Use imported default
-            txn.is_expense = 1 # Default assumption on error: expense (1)
-            txn.is_split = 0 # Default assumption on error: not split (0)
+        rate_limited = isinstance(e, ModelHTTPError) and e.status_code == 429
+        if rate_limited:
+            if attempt >= MAX_RETRIES:
+                return [(chunk_indices, e)]
+            delay = retry_delay(attempt)
+            logger.warning(f"Sub-batch of {len(chunk_indices)} transactions was rate limited; retrying in {delay:.1f}s.")
+            await asyncio.sleep(delay)
+            attempt += 1
+        elif not isinstance(e, (ValidationError, UnexpectedModelBehavior)):
+            return [(chunk_indices, e)]
+        if len(chunk_indices) <= AI_MIN_SPLIT_SIZE:
+            if rate_limited:
+                return await _run_ai_chunk(agent, semaphore, raw_transactions, chunk_indices, attempt)
+            return [(chunk_indices, e)]
+        logger.warning(f"Sub-batch of {len(chunk_indices)} transactions failed ({e}); retrying as two halves.")
+        middle = len(chunk_indices) // 2
+        halves = await asyncio.gather(
+            _run_ai_chunk(agent, semaphore, raw_transactions, chunk_indices[:middle], attempt),
+            _run_ai_chunk(agent, semaphore, raw_transactions, chunk_indices[middle:], attempt),
+        )
+        return halves[0] + halves[1]
+
+
+async def _run_ai_batches(full_prompt: str, raw_transactions: List[Transaction], chunks: List[List[int]]) -> List[Tuple[List[int], Any]]:
+    """
+    Runs all sub-batches concurrently, with at most AI_MAX_CONCURRENT_REQUESTS requests in flight.
+    Failed sub-batches are returned as exceptions.
 
-    logger.info(f"Finished AI processing for the batch.")
-    return raw_transactions # Return the original list, now potentially enriched or with defaults
+    On the first call the first sub-batch is sent on its own, so that it warms the
+    provider's prefix cache for the shared system prompt before the rest fan out.
+    """
+    import httpx # Availability checked by _get_ai_setup
+    global prefix_cache_warmed
+    results = []
+    # The client (and the provider and Agent on top of it) is created per run: it is bound to the event
+    # loop of this asyncio.run, so a client kept from an earlier run would fail with a closed loop.
+    # Within the run, concurrent sub-batches share its pooled TCP/TLS connections.
+    async with httpx.AsyncClient(limits=httpx.Limits(max_keepalive_connections=10)) as http_client:
+        agent = _build_agent(http_client, full_prompt)
+        semaphore = asyncio.Semaphore(AI_MAX_CONCURRENT_REQUESTS)
+        if not prefix_cache_warmed and len(chunks) > 1:
+            results += await _run_ai_chunk(agent, semaphore, raw_transactions, chunks[0])
+            chunks = chunks[1:]
+        prefix_cache_warmed = True
+        for chunk_results in await asyncio.gather(*[_run_ai_chunk(agent, semaphore, raw_transactions, chunk_indices) for chunk_indices in chunks]):
+            results += chunk_results
+    return results
+
+
+def _apply_ai_results(raw_transactions: List[Transaction], chunk_indices: List[int], processed_data: AIProcessedBatch) -> set:
+    """
+    Updates the original transactions of one sub-batch using 'original_index' from the AI results.
+    Returns the set of indices that were updated.
+    """
+    logger.info(f"Successfully obtained AIProcessedBatch with {len(processed_data.processed_transactions)} transactions.")
+    if len(processed_data.processed_transactions) != len(chunk_indices):
+        logger.warning(f"Mismatch in transaction count! Input: {len(chunk_indices)}, AI Output: {len(processed_data.processed_transactions)}. Will update based on 'original_index' provided by AI.")
+
+    expected_indices = set(chunk_indices)
+    updated_indices = set() # Keep track of which original transactions were updated
+    invalid_indices = [] # AI results whose original_index is not part of this sub-batch
+
+    for ai_txn in processed_data.processed_transactions:
+        original_idx = None
+        try:
+            original_idx = ai_txn.original_index
+            if original_idx in expected_indices:
+                original_txn = raw_transactions[original_idx]
+
+                # Update fields in the original Transaction object
+                original_txn.category = Category.from_string(ai_txn.category_str) # One dict lookup, aliases included
+                original_txn.is_expense = ai_txn.is_expense # Now an int (0 or 1)
+                original_txn.is_split = ai_txn.is_split     # Now an int (0, 1, or 2)
+
+                updated_indices.add(original_idx)
+            else:
+                invalid_indices.append(original_idx)
+        except AttributeError:
+             logger.warning(f"AI result object missing 'original_index'. Skipping this AI result: {ai_txn}")
+        except Exception as update_err:
+             logger.error(f"Error updating transaction at index {original_idx} with AI data ({ai_txn}): {update_err}")
+
+    if invalid_indices:
+        logger.warning("Skipped %d AI results with an original_index not in this sub-batch: %s", len(invalid_indices), invalid_indices[:10])
+    logger.info(f"Successfully processed {len(processed_data.processed_transactions)} AI results and updated {len(updated_indices)} original transactions.")
+
+    # Log which original transactions were NOT updated (one summary line, first few indices only)
+    not_updated = [i for i in chunk_indices if i not in updated_indices]
+    if not_updated:
+         logger.warning("Total %d original transactions were not updated by the AI results. First few indices: %s", len(not_updated), not_updated[:10])
+    return updated_indices
 
 
 # Removed EXCLUDED_CATEGORIES set as filtering is now based on is_expense boolean
@@ -281,23 +516,24 @@ def filter_expenses(enriched_transactions: List[Transaction]) -> List[Transactio
     Returns:
         List[Transaction]: A new list containing only the transactions where `is_expense` is True.
     """
-    expense_transactions = []
     if not enriched_transactions:
         return []
 
     logger.info(f"Filtering expenses from {len(enriched_transactions)} enriched transactions based on 'is_expense' flag...")
+    # Check the is_expense flag populated by the AI
+    # Default to 1 (expense) if flag is missing (conservative approach for expenses)
+    # Keep if 1 (expense) or None (treated as expense); one pass, with a single aggregated warning for None
+    expense_transactions = []
+    none_count = 0
     for transaction in enriched_transactions:
-        # Check the is_expense flag populated by the AI
-        # Default to 1 (expense) if flag is missing (conservative approach for expenses)
-        is_expense_flag = getattr(transaction, 'is_expense', 1) # Safely access attribute, default to 1
-
-        if is_expense_flag is None:
-             # Use original description for logging now
-             logger.warning(f"Transaction description '{getattr(transaction, 'description', 'N/A')}' has is_expense=None. Assuming it IS an expense.")
-             is_expense_flag = 1 # Treat None as expense
-
-        if is_expense_flag == 1: # Keep if 1 (expense)
+        flag = getattr(transaction, 'is_expense', 1)
+        if flag is None:
+            none_count += 1
+            expense_transactions.append(transaction)
+        elif flag == 1:
             expense_transactions.append(transaction)
+    if none_count:
+        logger.warning(f"{none_count} transactions have is_expense=None. Assuming they ARE expenses.")
 
     logger.info(f"Filtered down to {len(expense_transactions)} expense transactions.")
     return expense_transactions
@@ -1,8 +1,12 @@
 import os
 import glob
+import datetime
 import pandas as pd
+import xlsxwriter
+from python_calamine import CalamineWorkbook
 import logging
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -10,11 +14,16 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Define constants
 INPUT_DIR = Path("/home/appunni/work/budgeauto/Budget/")
 OUTPUT_FILE = Path("/home/appunni/work/budgeauto/All.xlsx")
+# A typed, compressed Parquet copy is always written next to OUTPUT_FILE (same name, .parquet suffix).
+# The .xlsx is only for human inspection; set to False to skip the slow Excel write.
+WRITE_EXCEL_OUTPUT = True
 EXPECTED_COLUMNS = 9
 COLUMN_NAMES = [
     "Txn Date", "Expense", "Category", "Short Desc", "Txn Description",
     "Debit", "is Split", "Appu Expense", "Achu Expenses"
 ]
+# Columns padded with float NaN (rather than pd.NA) so they stay float64 and concat doesn't upcast to object
+NUMERIC_COLUMNS = {"Expense", "Debit", "is Split", "Appu Expense", "Achu Expenses"}
 
 def find_excel_files(directory: Path) -> list[Path]:
     """Recursively finds all .xlsx files in the given directory."""
@@ -24,61 +33,115 @@ def find_excel_files(directory: Path) -> list[Path]:
     logging.info(f"Found {len(files)} .xlsx files.")
     return files
 
+def _used_width(df: pd.DataFrame) -> int:
+    """Returns the number of columns up to and including the last column holding any value."""
+    non_empty = df.notna().any(axis=0).to_numpy().nonzero()[0]
+    return int(non_empty[-1]) + 1 if len(non_empty) else 0
+
+def _convert_cell(value):
+    """Normalizes a raw calamine cell the way pandas' calamine engine does."""
+    if value == '':
+        return None # Empty cell
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return datetime.datetime(value.year, value.month, value.day)
+    return value
+
+def _read_sheet_raw(workbook: CalamineWorkbook, sheet_name: str) -> pd.DataFrame:
+    """
+    Reads all cells of a sheet into a header-less DataFrame straight from calamine's native rows,
+    equivalent to pd.read_excel(..., header=None) (blank rows are skipped) without pandas' parser layer.
+    """
+    rows = workbook.get_sheet_by_name(sheet_name).to_python(skip_empty_area=False)
+    converted_rows = []
+    for row in rows:
+        converted = [_convert_cell(cell) for cell in row]
+        if any(cell is not None for cell in converted):
+            converted_rows.append(converted)
+    return pd.DataFrame(converted_rows)
+
+def _process_sheet(workbook: CalamineWorkbook, file_path: Path, sheet_name: str) -> pd.DataFrame | None:
+    """Extracts the transaction data of one sheet. Returns None if the sheet is not a transaction sheet."""
+    logging.info(f"  Checking sheet: {sheet_name}")
+    try:
+        # Parse the sheet once; header=None keeps the header row as row 0 so it can be inspected in memory
+        raw_df = _read_sheet_raw(workbook, sheet_name)
+        header_width = _used_width(raw_df.iloc[:1])
+        if header_width == EXPECTED_COLUMNS:
+            logging.info(f"    Found transaction sheet (9 columns): {sheet_name}")
+            # Data rows follow the header; drop trailing all-empty columns and re-infer dtypes without the header row
+            data_df = raw_df.iloc[1:]
+            sheet_df = data_df.iloc[:, :_used_width(data_df)].reset_index(drop=True).infer_objects()
+
+            # Assign standard column names only if data exists
+            if not sheet_df.empty:
+                # Ensure the number of columns read matches expected, handle discrepancies
+                if len(sheet_df.columns) == EXPECTED_COLUMNS:
+                    sheet_df.columns = COLUMN_NAMES
+                    return sheet_df
+                elif len(sheet_df.columns) > EXPECTED_COLUMNS:
+                     logging.warning(f"    Sheet '{sheet_name}' in {file_path} has more than {EXPECTED_COLUMNS} data columns ({len(sheet_df.columns)}). Taking first {EXPECTED_COLUMNS}.")
+                     sheet_df = sheet_df.iloc[:, :EXPECTED_COLUMNS]
+                     sheet_df.columns = COLUMN_NAMES
+                     return sheet_df
+                else: # len(sheet_df.columns) < EXPECTED_COLUMNS
+                     logging.warning(f"    Sheet '{sheet_name}' in {file_path} has fewer than {EXPECTED_COLUMNS} data columns ({len(sheet_df.columns)}). Padding with NA.")
+                     # Assign names to existing columns
+                     sheet_df.columns = COLUMN_NAMES[:len(sheet_df.columns)]
+                     # Add missing columns with NA values
+                     for i in range(len(sheet_df.columns), EXPECTED_COLUMNS):
+                         sheet_df[COLUMN_NAMES[i]] = float('nan') if COLUMN_NAMES[i] in NUMERIC_COLUMNS else pd.NA
+                     # Ensure correct order
+                     return sheet_df[COLUMN_NAMES]
+
+            else:
+                 logging.warning(f"    Sheet '{sheet_name}' in {file_path} has 9 header columns but no data rows.")
+        else:
+            logging.info(f"    Skipping sheet '{sheet_name}' (expected {EXPECTED_COLUMNS} header columns, found {header_width}).")
+    except Exception as e:
+        # Log error reading a specific sheet; the remaining sheets are still processed
+        logging.error(f"    Error reading sheet '{sheet_name}' in {file_path}: {e}")
+    return None
+
 def process_excel_file(file_path: Path) -> list[pd.DataFrame]:
     """Processes a single Excel file to extract data from transaction sheets."""
     dataframes = []
     logging.info(f"Processing file: {file_path}")
     try:
-        # Use openpyxl engine explicitly if needed, pandas usually detects automatically
-        excel_file = pd.ExcelFile(file_path, engine='openpyxl')
-        for sheet_name in excel_file.sheet_names:
-            logging.info(f"  Checking sheet: {sheet_name}")
-            try:
-                # Read only the header row to check column count
-                header_df = pd.read_excel(excel_file, sheet_name=sheet_name, nrows=0)
-                if len(header_df.columns) == EXPECTED_COLUMNS:
-                    logging.info(f"    Found transaction sheet (9 columns): {sheet_name}")
-                    # Read the actual data, skipping the header row (row 1), header is row 0
-                    # header=None ensures pandas doesn't infer headers from data
-                    sheet_df = pd.read_excel(excel_file, sheet_name=sheet_name, skiprows=1, header=None)
-
-                    # Assign standard column names only if data exists
-                    if not sheet_df.empty:
-                        # Ensure the number of columns read matches expected, handle discrepancies
-                        if len(sheet_df.columns) == EXPECTED_COLUMNS:
-                            sheet_df.columns = COLUMN_NAMES
-                            dataframes.append(sheet_df)
-                        elif len(sheet_df.columns) > EXPECTED_COLUMNS:
-                             logging.warning(f"    Sheet '{sheet_name}' in {file_path} has more than {EXPECTED_COLUMNS} data columns ({len(sheet_df.columns)}). Taking first {EXPECTED_COLUMNS}.")
-                             sheet_df = sheet_df.iloc[:, :EXPECTED_COLUMNS]
-                             sheet_df.columns = COLUMN_NAMES
-                             dataframes.append(sheet_df)
-                        else: # len(sheet_df.columns) < EXPECTED_COLUMNS
-                             logging.warning(f"    Sheet '{sheet_name}' in {file_path} has fewer than {EXPECTED_COLUMNS} data columns ({len(sheet_df.columns)}). Padding with NA.")
-                             # Assign names to existing columns
-                             sheet_df.columns = COLUMN_NAMES[:len(sheet_df.columns)]
-                             # Add missing columns with NA values
-                             for i in range(len(sheet_df.columns), EXPECTED_COLUMNS):
-                                 sheet_df[COLUMN_NAMES[i]] = pd.NA
-                             # Ensure correct order
-                             sheet_df = sheet_df[COLUMN_NAMES]
-                             dataframes.append(sheet_df)
-
-                    else:
-                         logging.warning(f"    Sheet '{sheet_name}' in {file_path} has 9 header columns but no data rows.")
-                else:
-                    logging.info(f"    Skipping sheet '{sheet_name}' (expected {EXPECTED_COLUMNS} header columns, found {len(header_df.columns)}).")
-            except Exception as e:
-                # Log error reading a specific sheet and continue with the next sheet
-                logging.error(f"    Error reading sheet '{sheet_name}' in {file_path}: {e}")
-                continue
+        # calamine (Rust) parses .xlsx much faster than openpyxl; the workbook is opened once per file
+        workbook = CalamineWorkbook.from_path(str(file_path))
+        # Sheets are parsed one after another: the workbook handle can't be shared across threads and
+        # cell conversion holds the GIL anyway. Files themselves are spread over processes in main().
+        for sheet_name in workbook.sheet_names:
+            sheet_df = _process_sheet(workbook, file_path, sheet_name)
+            if sheet_df is not None:
+                dataframes.append(sheet_df)
     except Exception as e:
         # Log error opening/processing the file and return empty list for this file
         logging.error(f"Error opening or processing file {file_path}: {e}")
     return dataframes
 
+def _write_excel_streaming(df: pd.DataFrame, output_path: Path):
+    """
+    Writes a DataFrame to .xlsx row by row with xlsxwriter in constant_memory mode.
+    pandas' to_excel emits cells column by column, which constant_memory mode cannot
+    handle (rows are flushed to disk once a later row is started), so rows are written directly.
+    """
+    # Missing values become None so xlsxwriter leaves those cells blank, as to_excel does
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    with xlsxwriter.Workbook(str(output_path), {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'}) as workbook:
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(0, 0, list(df.columns))
+        for row_idx, row in enumerate(rows, start=1):
+            worksheet.write_row(row_idx, 0, row)
+
 def combine_and_save(dataframes: list[pd.DataFrame], output_path: Path):
-    """Combines list of DataFrames and saves to an Excel file."""
+    """
+    Combines list of DataFrames and saves them to Parquet (output_path with a .parquet suffix)
+    and, if WRITE_EXCEL_OUTPUT is set, to the Excel file at output_path.
+    Downstream readers should prefer the Parquet file.
+    """
     if not dataframes:
         logging.warning("No transaction data found to combine. Creating an empty output file with standard headers.")
         # Create an empty DataFrame with the correct columns
@@ -86,21 +149,35 @@ def combine_and_save(dataframes: list[pd.DataFrame], output_path: Path):
     else:
         logging.info(f"Combining data from {len(dataframes)} transaction sheets...")
         try:
-            # Concatenate all collected dataframes
+            # Concatenate all collected dataframes. Every frame already carries exactly COLUMN_NAMES
+            # in order (see process_excel_file), so no reindexing copy is needed afterwards.
             combined_df = pd.concat(dataframes, ignore_index=True)
-            # Ensure final DataFrame has exactly the standard columns in the correct order,
-            # This handles cases where concat might alter order or if any df had issues
-            combined_df = combined_df[COLUMN_NAMES]
             logging.info(f"Combined DataFrame shape: {combined_df.shape}")
         except Exception as e:
             logging.error(f"Error during DataFrame concatenation: {e}")
             # Fallback to an empty DataFrame with headers if concatenation fails
             combined_df = pd.DataFrame(columns=COLUMN_NAMES)
 
+    parquet_path = output_path.with_suffix('.parquet')
+    logging.info(f"Saving combined data to {parquet_path}...")
+    try:
+        # Object columns can mix types across sheets (e.g. dates read as datetimes in one file and
+        # strings in another), which Arrow rejects, so store them as strings. Numeric columns keep their dtype.
+        object_columns = combined_df.select_dtypes(include='object').columns
+        parquet_df = combined_df.astype({col: 'string' for col in object_columns})
+        parquet_df.to_parquet(parquet_path, engine='pyarrow', compression='zstd', index=False)
+        logging.info(f"Successfully saved combined data to {parquet_path}.")
+    except Exception as e:
+        logging.error(f"Error saving data to {parquet_path}: {e}")
+
+    if not WRITE_EXCEL_OUTPUT:
+        logging.info("WRITE_EXCEL_OUTPUT is disabled. Skipping Excel output.")
+        return
+
     logging.info(f"Saving combined data to {output_path}...")
     try:
         # Save the combined data, overwriting if exists, without the index
-        combined_df.to_excel(output_path, index=False, engine='openpyxl')
+        _write_excel_streaming(combined_df, output_path)
         logging.info(f"Successfully saved combined data to {output_path}.")
     except Exception as e:
         logging.error(f"Error saving data to {output_path}: {e}")
@@ -113,15 +190,20 @@ def main():
         combine_and_save([], OUTPUT_FILE) # Ensure empty file is created
         return
 
-    all_dataframes = []
-    processed_files_count = 0
+    # Skip temporary Excel files (often start with ~$)
+    files_to_process = []
     for file_path in excel_files:
-        # Skip temporary Excel files (often start with ~$)
         if file_path.name.startswith("~$"):
             logging.info(f"Skipping temporary file: {file_path}")
             continue
-        processed_files_count += 1
-        all_dataframes.extend(process_excel_file(file_path))
+        files_to_process.append(file_path)
+    processed_files_count = len(files_to_process)
+
+    # Parsing .xlsx is CPU-bound and files are independent, so spread them across processes
+    all_dataframes = []
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for dataframes in executor.map(process_excel_file, files_to_process, chunksize=4):
+            all_dataframes.extend(dataframes)
 
     logging.info(f"Finished processing {processed_files_count} potential Excel files.")
     combine_and_save(all_dataframes, OUTPUT_FILE)
@@ -1,18 +1,37 @@
 import os
-from dotenv import load_dotenv
+import functools
+import types
+from dotenv import dotenv_values
+
+# Variables this module has put into os.environ from .env; a reload may update these, but never
+# a variable that was already set in the real environment
+_DOTENV_KEYS = set()
 
 def load_config():
     """
     Loads configuration from a .env file in the project root
-    and returns it as a dictionary.
+    and returns it as a read-only mapping.
+    The result is cached per .env modification time, so .env is parsed once per process unless
+    it changes; callers share the same mapping.
     """
     # Construct the path to the .env file relative to this script's directory
     # Assumes config.py is in 'src' and .env is in the parent directory
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     dotenv_path = os.path.join(project_root, '.env')
+    try:
+        mtime_ns = os.stat(dotenv_path).st_mtime_ns
+    except OSError:
+        mtime_ns = None # No .env file; configuration comes from the environment only
+    return _load_config(dotenv_path, mtime_ns)
 
-    # Load the .env file
-    load_dotenv(dotenv_path=dotenv_path)
+@functools.lru_cache(maxsize=1)
+def _load_config(dotenv_path, mtime_ns):
+    """Builds the configuration mapping; `mtime_ns` is only part of the cache key."""
+    # Load the .env file, without overriding variables set in the environment
+    for key, value in dotenv_values(dotenv_path).items():
+        if value is not None and (key not in os.environ or key in _DOTENV_KEYS):
+            os.environ[key] = value
+            _DOTENV_KEYS.add(key)
 
     # Load specific variables into a dictionary
     # Add more variables here as needed based on .env.example
@@ -27,6 +46,20 @@ def load_config():
         'OPENAI_API_KEY': os.getenv('OPENAI_API_KEY'), # Kept for potential future use
         'GEMINI_API_KEY': os.getenv('GEMINI_API_KEY'),
         'PDF_PASSWORDS': [p.strip() for p in os.getenv('PDF_PASSWORDS', '').split(',') if p.strip()],
+        # Statement PDFs parsed at the same time, in both normal and preview runs
+        'PDF_CONCURRENCY': int(os.getenv('PDF_CONCURRENCY', '4')),
+        # Pages of one statement sent to Gemini Vision at the same time
+        'PDF_PAGE_CONCURRENCY': int(os.getenv('PDF_PAGE_CONCURRENCY', '10')),
+        # Page images sent to Gemini Vision in a single request
+        'PDF_PAGES_PER_REQUEST': int(os.getenv('PDF_PAGES_PER_REQUEST', '4')),
+        # How pages reach Gemini: 'vision' (always image), 'auto' (text layer when usable, else image) or 'text'.
+        # Vision is the default because the text layer loses column positions (e.g. debit vs credit columns)
+        'PDF_HANDLING': os.getenv('PDF_HANDLING', 'vision').strip().lower(),
+        # Reuse AI categorization results for recurring transactions; set to false to force a full re-run
+        'AI_CACHE_ENABLED': os.getenv('AI_CACHE_ENABLED', 'True').lower() == 'true',
+        'AI_CACHE_FILE': os.getenv('AI_CACHE_FILE', 'ai_category_cache.json'),
+        # Filename -> account name mappings reused across runs (also controlled by AI_CACHE_ENABLED)
+        'ACCOUNT_MAP_CACHE_FILE': os.getenv('ACCOUNT_MAP_CACHE_FILE', 'account_map_cache.json'),
         # Add other potential config flags from strategy doc if needed
         # 'CLEANUP_DOWNLOADS': os.getenv('CLEANUP_DOWNLOADS', 'False').lower() == 'true',
         # 'TEMPLATE_ID': os.getenv('TEMPLATE_ID'),
@@ -52,7 +85,8 @@ def load_config():
         # Depending on severity, you might raise an exception here instead
         # raise ValueError(f"Missing required configuration: {', '.join(missing_vars)}")
 
-    return config
+    # Read-only view so the cached, shared config can't be mutated by a caller
+    return types.MappingProxyType(config)
 
 if __name__ == '__main__':
     # Example usage when running this script directly
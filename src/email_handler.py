@@ -11,8 +11,14 @@ will use the stored token ('gmail_token.json' by default).
 
 import os
 import base64
-import datetime
+import asyncio
+import calendar
+import time
+import logging
+from pathlib import Path
+import httpx # Async HTTP client for concurrent attachment downloads
 import re # Added for subject date parsing
+from email.utils import parsedate_to_datetime # Fast parser for RFC 2822 'Date' headers
 from dateutil import parser # Added for robust date parsing
 # from google.oauth2 import service_account # Removed: Using OAuth 2.0 InstalledAppFlow
 # from google.oauth2.credentials import Credentials # No longer needed here, handled in main.py
@@ -20,6 +26,11 @@ from dateutil import parser # Added for robust date parsing
 # from google.auth.transport.requests import Request # No longer needed here
 from googleapiclient.discovery import build # Still needed to build the service
 from googleapiclient.errors import HttpError # Still needed for error handling
+from google.auth.transport.requests import Request # Refreshes the token used for direct attachment downloads
+from retries import MAX_RETRIES, RETRYABLE_STATUSES, retry_delay # Shared backoff policy
+
+# Logging is configured in main.py; per-part diagnostics are DEBUG, progress is INFO
+logger = logging.getLogger(__name__)
 
 # SCOPES are now defined and handled in main.py
 
@@ -27,8 +38,262 @@ from googleapiclient.errors import HttpError # Still needed for error handling
 # and credentials object is passed to fetch_and_download_pdfs.
 
 
+# Gmail accepts up to 100 calls per batch request but recommends at most 50 to avoid rate limiting
+GMAIL_BATCH_SIZE = 50
+
+def _message_parts_fields(depth):
+    """Builds the partial-response selector for a MIME part and its nested parts, `depth` levels deep."""
+    fields = "mimeType,filename,body/attachmentId"
+    if depth > 0:
+        fields += f",parts({_message_parts_fields(depth - 1)})"
+    return fields
+
+# Only the headers and the part tree (no body data) are used, so inline HTML/images aren't downloaded.
+# Forwarded statements (message/rfc822 wrappers inside mixed -> alternative -> related) can nest deeply;
+# messages that go deeper than this are re-fetched in full (see _has_truncated_parts).
+MESSAGE_PARTS_DEPTH = 8
+MESSAGE_FIELDS = f"id,payload(headers(name,value),{_message_parts_fields(MESSAGE_PARTS_DEPTH)})"
+
+def _has_truncated_parts(payload):
+    """True if a container part sits at the deepest level MESSAGE_FIELDS selects, so its children weren't fetched."""
+    stack = [(payload, 0)]
+    while stack:
+        part, depth = stack.pop()
+        if depth == MESSAGE_PARTS_DEPTH:
+            if part.get('mimeType', '').lower().startswith(('multipart/', 'message/')):
+                return True
+            continue
+        stack.extend((nested, depth + 1) for nested in part.get('parts', []))
+    return False
+
+def _batch_get_messages(service, msg_ids):
+    """
+    Fetches the full details of the given messages using Gmail HTTP batch requests,
+    so each group of GMAIL_BATCH_SIZE messages costs one round-trip instead of one per message.
+
+    Returns:
+        dict: Message ID -> message resource. Messages that failed are logged and left out.
+    """
+    messages_by_id = {}
+    retryable_ids = [] # Messages rejected by rate limiting or a transient server error
+
+    def _on_message(request_id, response, exception):
+        # Per-message errors are reported here instead of raising, so one failure doesn't stop the batch
+        if exception is None:
+            messages_by_id[request_id] = response
+        elif isinstance(exception, HttpError) and exception.resp.status in RETRYABLE_STATUSES:
+            retryable_ids.append(request_id)
+        else:
+            logger.error(f"An HTTP error occurred fetching message ID {request_id}: {exception}")
+
+    pending_ids = list(msg_ids)
+    for attempt in range(MAX_RETRIES + 1):
+        for start in range(0, len(pending_ids), GMAIL_BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=_on_message)
+            for msg_id in pending_ids[start:start + GMAIL_BATCH_SIZE]:
+                batch.add(service.users().messages().get(userId='me', id=msg_id, format='full', fields=MESSAGE_FIELDS), request_id=msg_id)
+            batch.execute()
+        if not retryable_ids:
+            break
+        pending_ids, retryable_ids[:] = list(retryable_ids), []
+        if attempt < MAX_RETRIES:
+            delay = retry_delay(attempt)
+            logger.warning(f"{len(pending_ids)} message(s) were rate limited or hit a server error; retrying in {delay:.1f}s.")
+            time.sleep(delay)
+    else:
+        for msg_id in pending_ids:
+            logger.error(f"Giving up fetching message ID {msg_id} after {MAX_RETRIES} retries.")
+    return messages_by_id
+
+
+# Subject date patterns fused into one regex, so the subject is scanned once; the first date in the subject wins
+_MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+_MONTH_MAP = {name.lower(): f"{i:02d}" for i, name in enumerate(_MONTH_NAMES, 1)}
+_SUBJECT_DATE_RE = re.compile(
+    rf"(?P<month_name>{'|'.join(_MONTH_NAMES)})-(?P<year1>\d{{4}})" # Month-YYYY (e.g., March-2024)
+    r"|(?P<month2>\d{1,2})/(?P<year2>\d{4})" # MM/YYYY (e.g., 03/2024)
+    r"|(?P<year3>\d{4})/(?P<month3>\d{1,2})", # YYYY/MM (e.g., 2024/03)
+    re.IGNORECASE,
+)
+
+# Characters replaced with '_' when building download filenames; \w keeps (Unicode) letters, digits and '_'
+_UNSAFE_NAME_CHARS = re.compile(r'[^\w -]') # Sender and subject: also keep spaces and hyphens
+_UNSAFE_FILENAME_CHARS = re.compile(r'[^\w.-]') # Attachment filename: also keep dots and hyphens
+
+_MONTH_ABBREVIATIONS = {name[:3]: f"{i:02d}" for i, name in enumerate(_MONTH_NAMES, 1)}
+
+def _fast_rfc2822_date(date_str):
+    """
+    Extracts YYYY-MM-DD from a well-formed RFC 2822 date such as 'Wed, 05 Mar 2024 10:23:41 +0000'
+    by picking out the day/month/year tokens. Returns None if the value doesn't have that shape.
+    """
+    tokens = date_str.split()
+    if tokens and tokens[0].endswith(','):
+        tokens = tokens[1:] # Optional day-of-week
+    if len(tokens) < 3:
+        return None
+    day, month, year = tokens[:3]
+    month_num = _MONTH_ABBREVIATIONS.get(month.capitalize())
+    if not month_num or not day.isdigit() or not year.isdigit() or len(year) != 4:
+        return None
+    if not 1 <= int(day) <= calendar.monthrange(int(year), int(month_num))[1]:
+        return None # Not a real date; let the full parsers reject it
+    return f"{year}-{month_num}-{int(day):02d}"
+
+def _parse_date_header(date_str):
+    """
+    Parses an email 'Date' header into YYYY-MM-DD. Gmail's headers are RFC 2822, so the tokens are
+    read directly; the stdlib parser and then dateutil's format sniffing handle anything else.
+    """
+    msg_date = _fast_rfc2822_date(date_str)
+    if msg_date:
+        return msg_date
+    try:
+        return parsedate_to_datetime(date_str).date().isoformat()
+    except (TypeError, ValueError):
+        return parser.parse(date_str).date().isoformat()
+
+_WANTED_HEADERS = frozenset({'subject', 'from', 'date'})
+_PDF_MIME_TYPES = frozenset({'application/pdf', 'application/x-pdf'})
+
+def _find_pdf_parts(payload):
+    """
+    Searches a message payload and all its nested parts for downloadable PDF parts,
+    based on MIME type or filename. Walks the MIME tree with an explicit stack
+    (no recursion), returning the parts in document order.
+    """
+    found_parts = []
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        mime_type = part.get('mimeType', '').lower()
+        filename = part.get('filename', '')
+        attachment_id = part.get('body', {}).get('attachmentId')
+
+        is_potential_pdf = False
+        reason = ""
+
+        # Check 1: Standard PDF MIME types
+        if mime_type in _PDF_MIME_TYPES:
+            is_potential_pdf = True
+            reason = f"MIME type is {mime_type}"
+        # Check 2: Octet-stream with .pdf filename (case-insensitive)
+        elif mime_type == 'application/octet-stream' and filename and filename.lower().endswith('.pdf'):
+            is_potential_pdf = True
+            reason = "MIME type is application/octet-stream and filename ends with .pdf"
+
+        # Check if it's a downloadable attachment
+        if is_potential_pdf:
+            if filename and attachment_id:
+                # Log identification reason
+                logger.debug("    Identified potential PDF attachment: '%s' (Reason: %s).", filename, reason)
+                found_parts.append(part)
+            else:
+                # Log if it looked like a PDF but wasn't downloadable/named correctly by the API
+                logger.debug("    Skipping potential PDF part: Has PDF characteristics (%s) but missing filename ('%s') or attachmentId ('%s').", reason, filename, attachment_id)
+        elif filename and filename.lower().endswith('.pdf'):
+            # Log parts with .pdf filenames that were skipped due to non-matching MIME type
+            logger.debug("    Skipping part with filename '%s': MIME type '%s' is not a recognized PDF type or octet-stream.", filename, mime_type)
+
+        # Check nested parts next; pushed in reverse so they are visited in order
+        nested_parts = part.get('parts')
+        if nested_parts:
+            stack.extend(reversed(nested_parts))
+
+    return found_parts
+
+# Attachments are downloaded concurrently, bounded to stay within Gmail's per-user rate limits
+MAX_CONCURRENT_DOWNLOADS = 5
+GMAIL_ATTACHMENT_URL = "https://gmail.googleapis.com/gmail/v1/users/me/messages/{msg_id}/attachments/{attachment_id}"
+
+def _save_attachment(filepath, file_data):
+    """
+    Writes the attachment to filepath, adding a counter to the name if the file already exists.
+
+    Returns:
+        str | None: The path written, or None if no unique name was found or the write failed.
+    """
+    # Avoid overwriting - O_EXCL creates the file only if it doesn't exist, in one syscall and without a race
+    name, ext = os.path.splitext(filepath)
+    for counter in range(101):
+        candidate = f"{name}_{counter}{ext}" if counter else filepath
+        try:
+            fd = os.open(candidate, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            break
+        except FileExistsError:
+            continue
+        except OSError as e:
+            logger.error(f"    Error creating file '{candidate}': {e}")
+            return None
+    else: # Safety break
+        logger.warning(f"Warning: Could not find unique name for {filepath} after 100 attempts. Skipping.")
+        return None
+
+    logger.info(f"    Downloading to: {candidate}")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(file_data)
+        return candidate
+    except IOError as e:
+        logger.error(f"    Error writing file '{candidate}': {e}")
+    except Exception as e:
+        logger.error(f"    An unexpected error occurred during file write for '{candidate}': {e}")
+    return None
+
+
+async def _download_attachment(client, semaphore, job, on_pdf_downloaded=None):
+    """Downloads one attachment and saves it. Returns the downloaded file info, or None."""
+    async with semaphore:
+        url = GMAIL_ATTACHMENT_URL.format(msg_id=job['msg_id'], attachment_id=job['attachment_id'])
+        for attempt in range(MAX_RETRIES + 1):
+            response = await client.get(url)
+            if response.status_code not in RETRYABLE_STATUSES or attempt == MAX_RETRIES:
+                break
+            delay = retry_delay(attempt, response.headers.get('Retry-After'))
+            logger.warning(f"Attachment '{job['filename']}' download returned {response.status_code}; retrying in {delay:.1f}s.")
+            await asyncio.sleep(delay)
+        response.raise_for_status()
+        encoded_data = response.json()['data']
+        # Free the raw body and decode the base64 str directly, so no extra copies of the PDF are held
+        del response
+        file_data = base64.urlsafe_b64decode(encoded_data)
+        del encoded_data
+        # Written while holding the semaphore: at most MAX_CONCURRENT_DOWNLOADS PDFs are in memory at once
+        filepath = _save_attachment(job['filepath'], file_data)
+    if not filepath:
+        return None
+    pdf_info = {'path': filepath, 'subject': job['subject']}
+    if on_pdf_downloaded:
+        on_pdf_downloaded(pdf_info) # Lets the caller start processing this PDF while the rest download
+    return pdf_info
+
+
+async def _download_attachments(credentials, download_jobs, on_pdf_downloaded=None):
+    """
+    Downloads all attachments concurrently (at most MAX_CONCURRENT_DOWNLOADS at a time)
+    through the Gmail REST endpoint. A failed download is logged and skipped.
+    """
+    if not credentials.valid:
+        credentials.refresh(Request())
+    headers = {'Authorization': f'Bearer {credentials.token}'}
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+    # HTTP/2 multiplexes the concurrent downloads over a single TLS connection
+    async with httpx.AsyncClient(headers=headers, timeout=60.0, http2=True,
+                                 limits=httpx.Limits(max_connections=MAX_CONCURRENT_DOWNLOADS,
+                                                     max_keepalive_connections=MAX_CONCURRENT_DOWNLOADS)) as client:
+        results = await asyncio.gather(*[_download_attachment(client, semaphore, job, on_pdf_downloaded) for job in download_jobs], return_exceptions=True)
+
+    downloaded_files_info = []
+    for job, result in zip(download_jobs, results):
+        if isinstance(result, Exception):
+            logger.error(f"An error occurred downloading attachment '{job['filename']}' from message ID {job['msg_id']}: {result}")
+        elif result:
+            downloaded_files_info.append(result)
+    return downloaded_files_info
+
+
 # Removed _get_previous_month_range function. Date range is now calculated dynamically below.
-def fetch_and_download_pdfs(config, credentials):
+def fetch_and_download_pdfs(config, credentials, on_pdf_downloaded=None):
     """
     Fetches emails from the previous month based on config criteria
     and downloads any PDF attachments found, using the provided OAuth credentials.
@@ -42,6 +307,8 @@ def fetch_and_download_pdfs(config, credentials):
                         GMAIL_TOKEN_FILE are used in main.py, not directly here).
         credentials (google.oauth2.credentials.Credentials): Valid OAuth 2.0 credentials
                                                              obtained from main.py.
+        on_pdf_downloaded (callable, optional): Called with each PDF's info dict as soon as
+                                                that PDF is saved, before the other downloads finish.
 
     Returns:
         list: A list of dictionaries, where each dictionary contains the 'path'
@@ -50,7 +317,7 @@ def fetch_and_download_pdfs(config, credentials):
               Returns an empty list if no relevant emails with PDFs are found
               or if an error occurs.
     """
-    print("Attempting to fetch emails and download PDFs...")
+    logger.info("Attempting to fetch emails and download PDFs...")
 
     # Get configuration values needed by this function
     download_path = config.get('PDF_DOWNLOAD_PATH', './downloads')
@@ -59,51 +326,46 @@ def fetch_and_download_pdfs(config, credentials):
 
     # Validate download path config
     if not download_path:
-         print("Configuration Error: 'PDF_DOWNLOAD_PATH' is missing or empty.")
+         logger.error("Configuration Error: 'PDF_DOWNLOAD_PATH' is missing or empty.")
          return []
 
-    # Ensure download directory exists
+    # Ensure download directory exists; resolved to a Path once so attachment paths are a cheap join
+    download_dir = Path(download_path).expanduser()
     try:
-        os.makedirs(download_path, exist_ok=True)
+        download_dir.mkdir(parents=True, exist_ok=True)
     except OSError as e:
-        print(f"Error creating download directory '{download_path}': {e}")
+        logger.error(f"Error creating download directory '{download_path}': {e}")
         return []
 
     # Build the Gmail service using the provided credentials
     if not credentials:
-        print("Error: No valid credentials provided to fetch_and_download_pdfs. Aborting.")
+        logger.error("Error: No valid credentials provided to fetch_and_download_pdfs. Aborting.")
         return []
     try:
         service = build('gmail', 'v1', credentials=credentials)
-        print("Successfully built Gmail service using provided OAuth credentials.")
+        logger.info("Successfully built Gmail service using provided OAuth credentials.")
     except HttpError as error:
-        print(f'An HTTP error occurred building the Gmail service: {error}')
+        logger.error(f'An HTTP error occurred building the Gmail service: {error}')
         return []
     except Exception as e:
-        print(f'An unexpected error occurred building the Gmail service: {e}')
+        logger.error(f'An unexpected error occurred building the Gmail service: {e}')
         return []
 
     # Proceed with fetching emails if service build was successful
     try:
 
-        # Calculate date range for the last 30 days
-        today = datetime.date.today()
-        end_date_dt = today # Use today as the end date (exclusive in Gmail query)
-        start_date_dt = today - datetime.timedelta(days=30)
-
-        # Format for Gmail API search query (YYYY/MM/DD)
-        start_date = start_date_dt.strftime('%Y/%m/%d')
-        end_date = end_date_dt.strftime('%Y/%m/%d') # Gmail 'before' is exclusive
+        # Date range for the last 30 days, evaluated server-side against each message's internal date
+        # (after:/before: dates are interpreted in Gmail's own timezone and could skew the window by a day)
+        date_filter = "newer_than:30d"
 
-        print(f"Searching emails for the authorized user ('me') from the last 30 days (after:{start_date} before:{end_date})...")
+        logger.info(f"Searching emails for the authorized user ('me') from the last 30 days ({date_filter})...")
         # If you still want to log the configured email address for context:
         # if target_user_email_for_search:
         #     print(f"(Configured GMAIL_ADDRESS for context: {target_user_email_for_search})")
 
         # Construct search query
         query_parts = [
-            f"after:{start_date}",
-            f"before:{end_date}",
+            date_filter,
             "has:attachment", # Look for emails with attachments
             "filename:pdf",    # Specifically look for PDF attachments
             # Server-side subject filtering using OR logic
@@ -115,82 +377,82 @@ def fetch_and_download_pdfs(config, credentials):
         # Removed optional subject_filter from config - using specific hardcoded filter above
 
         query = " ".join(query_parts)
-        print(f"Using Gmail query: {query}")
-
-        # Search for messages
-        results = service.users().messages().list(userId='me', q=query).execute()
-        messages = results.get('messages', [])
-
-        if not messages:
-            print("No emails found matching the criteria.")
+        logger.info(f"Using Gmail query: {query}")
+
+        # Search for messages, following nextPageToken so results beyond the first page aren't dropped
+        msg_ids = []
+        page_token = None
+        while True:
+            results = service.users().messages().list(
+                userId='me', q=query, maxResults=500, pageToken=page_token, fields='messages/id,nextPageToken'
+            ).execute(num_retries=MAX_RETRIES)
+            msg_ids.extend(msg_summary['id'] for msg_summary in results.get('messages', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+        if not msg_ids:
+            logger.info("No emails found matching the criteria.")
             return []
 
-        print(f"Found {len(messages)} potential emails.")
-        downloaded_files_info = [] # Renamed to reflect new structure
+        logger.info(f"Found {len(msg_ids)} potential emails.")
+        download_jobs = [] # Attachments to download, collected from all emails first
+
+        # Get the full message details for all emails in batched requests
+        messages_by_id = _batch_get_messages(service, msg_ids)
 
-        for msg_summary in messages:
-            msg_id = msg_summary['id']
+        for msg_id in msg_ids:
+            message = messages_by_id.get(msg_id)
+            if message is None:
+                continue # Fetch error already logged by _batch_get_messages
             try:
-                # Get the full message details
-                message = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
                 payload = message.get('payload', {})
                 headers = payload.get('headers', [])
                 parts = payload.get('parts', [])
 
                 # Extract basic info for logging/naming
-                subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'NoSubject')
-                sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'UnknownSender')
-                date_str = next((h['value'] for h in headers if h['name'].lower() == 'date'), None)
+                # One pass over the headers; the first occurrence of each wanted header wins
+                wanted_headers = {}
+                for h in headers:
+                    name = h['name'].lower()
+                    if name in _WANTED_HEADERS and name not in wanted_headers:
+                        wanted_headers[name] = h['value']
+                subject = wanted_headers.get('subject', 'NoSubject')
+                sender = wanted_headers.get('from', 'UnknownSender')
+                date_str = wanted_headers.get('date')
                 msg_date = 'UnknownDate' # Default if all parsing fails
 
                 # 1. Try parsing the 'Date' header
                 if date_str:
                     try:
-                        # Use dateutil.parser for robust parsing of various formats
-                        parsed_dt = parser.parse(date_str)
-                        msg_date = parsed_dt.strftime('%Y-%m-%d')
-                        print(f"  Successfully parsed date header '{date_str}' to '{msg_date}' using dateutil.")
+                        # RFC 2822 tokens first, email.utils/dateutil.parser as fallbacks for other formats
+                        msg_date = _parse_date_header(date_str)
+                        logger.debug("  Successfully parsed date header '%s' to '%s'.", date_str, msg_date)
                     except (ValueError, OverflowError, TypeError, AttributeError) as e:
                         # Catch potential errors from parser.parse
-                        print(f"  Warning: Could not parse date header '{date_str}' using dateutil.parser: {e}. Trying subject.")
+                        logger.warning(f"  Warning: Could not parse date header '{date_str}': {e}. Trying subject.")
                         # Fall through to subject parsing (msg_date remains 'UnknownDate')
 
                 # 2. If header parsing failed or wasn't possible, try parsing the subject
                 if msg_date == 'UnknownDate':
-                    print(f"  Attempting to extract date from subject: '{subject}'")
-                    month_map = {name.lower(): f"{i:02d}" for i, name in enumerate(['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December'], 1)}
+                    logger.debug("  Attempting to extract date from subject: '%s'", subject)
                     subject_date_found = False
 
-                    # Pattern: Month-YYYY (e.g., March-2024)
-                    match = re.search(r'(January|February|March|April|May|June|July|August|September|October|November|December)-(\d{4})', subject, re.IGNORECASE)
+                    match = _SUBJECT_DATE_RE.search(subject)
                     if match:
-                        month_name, year = match.groups()
-                        month_num = month_map.get(month_name.lower())
-                        if month_num:
-                            msg_date = f"{year}-{month_num}-01" # Use 1st day of month
-                            subject_date_found = True
-                            print(f"    Found subject date (Month-YYYY): {msg_date}")
-
-                    # Pattern: MM/YYYY (e.g., 03/2024)
-                    if not subject_date_found:
-                        match = re.search(r'(\d{1,2})/(\d{4})', subject)
-                        if match:
-                            month, year = match.groups()
-                            msg_date = f"{year}-{int(month):02d}-01" # Use 1st day
-                            subject_date_found = True
-                            print(f"    Found subject date (MM/YYYY): {msg_date}")
-
-                    # Pattern: YYYY/MM (e.g., 2024/03)
-                    if not subject_date_found:
-                        match = re.search(r'(\d{4})/(\d{1,2})', subject)
-                        if match:
-                            year, month = match.groups()
-                            msg_date = f"{year}-{int(month):02d}-01" # Use 1st day
-                            subject_date_found = True
-                            print(f"    Found subject date (YYYY/MM): {msg_date}")
+                        subject_date_found = True
+                        if match['month_name']:
+                            msg_date = f"{match['year1']}-{_MONTH_MAP[match['month_name'].lower()]}-01" # Use 1st day of month
+                            logger.debug("    Found subject date (Month-YYYY): %s", msg_date)
+                        elif match['month2']:
+                            msg_date = f"{match['year2']}-{int(match['month2']):02d}-01" # Use 1st day
+                            logger.debug("    Found subject date (MM/YYYY): %s", msg_date)
+                        else:
+                            msg_date = f"{match['year3']}-{int(match['month3']):02d}-01" # Use 1st day
+                            logger.debug("    Found subject date (YYYY/MM): %s", msg_date)
 
                     if not subject_date_found:
-                        print("    Could not extract date from subject.")
+                        logger.debug("    Could not extract date from subject.")
                         # msg_date remains 'UnknownDate'
 
                 # msg_date is now either YYYY-MM-DD from header, YYYY-MM-01 from subject, or 'UnknownDate'
@@ -198,62 +460,21 @@ def fetch_and_download_pdfs(config, credentials):
                 # --- Client-side subject filtering removed - now handled by server-side query ---
 
 
-                # --- Recursive search for PDF parts with enhanced detection ---
-                def _find_pdf_parts(part):
-                    """
-                    Recursively search for downloadable PDF parts based on MIME type
-                    or filename.
-                    """
-                    found_parts = []
-                    mime_type = part.get('mimeType', '').lower()
-                    filename = part.get('filename', '')
-                    attachment_id = part.get('body', {}).get('attachmentId')
-
-                    is_potential_pdf = False
-                    reason = ""
-
-                    # Check 1: Standard PDF MIME types
-                    if mime_type in ['application/pdf', 'application/x-pdf']:
-                        is_potential_pdf = True
-                        reason = f"MIME type is {mime_type}"
-                    # Check 2: Octet-stream with .pdf filename (case-insensitive)
-                    elif mime_type == 'application/octet-stream' and filename and filename.lower().endswith('.pdf'):
-                        is_potential_pdf = True
-                        reason = "MIME type is application/octet-stream and filename ends with .pdf"
-
-                    # Check if it's a downloadable attachment
-                    if is_potential_pdf:
-                        if filename and attachment_id:
-                            # Log identification reason
-                            print(f"    Identified potential PDF attachment: '{filename}' (Reason: {reason}).")
-                            found_parts.append(part)
-                        else:
-                            # Log if it looked like a PDF but wasn't downloadable/named correctly by the API
-                            print(f"    Skipping potential PDF part: Has PDF characteristics ({reason}) but missing filename ('{filename}') or attachmentId ('{attachment_id}').")
-                    elif filename and filename.lower().endswith('.pdf'):
-                        # Log parts with .pdf filenames that were skipped due to non-matching MIME type
-                        print(f"    Skipping part with filename '{filename}': MIME type '{mime_type}' is not a recognized PDF type or octet-stream.")
-
-
-                    # Recursively check nested parts
-                    nested_parts = part.get('parts')
-                    if nested_parts:
-                        for nested_part in nested_parts:
-                            # Use extend to add all found parts from the recursive call
-                            found_parts.extend(_find_pdf_parts(nested_part))
-
-                    return found_parts
-
-                # Start search from the main payload
+                # Search the MIME tree starting from the main payload
                 pdf_parts_to_download = _find_pdf_parts(payload)
-                # --- End Recursive search ---
+
+                if not pdf_parts_to_download and _has_truncated_parts(payload):
+                    # The partial response cut the MIME tree short; fetch the whole message and search again
+                    logger.debug("  MIME tree of message ID %s is deeper than %d levels; re-fetching it in full.", msg_id, MESSAGE_PARTS_DEPTH)
+                    payload = service.users().messages().get(userId='me', id=msg_id, format='full').execute(num_retries=MAX_RETRIES).get('payload', {})
+                    pdf_parts_to_download = _find_pdf_parts(payload)
 
                 if not pdf_parts_to_download:
-                     print(f"  No PDF attachments found in email from '{sender}' with subject '{subject}' (ID: {msg_id}).")
+                     logger.debug("  No PDF attachments found in email from '%s' with subject '%s' (ID: %s).", sender, subject, msg_id)
                      continue # Skip to the next email message
 
                 # Process found PDF parts
-                print(f"  Found {len(pdf_parts_to_download)} PDF part(s) in email from '{sender}' subject '{subject}' (ID: {msg_id}). Processing...")
+                logger.info(f"  Found {len(pdf_parts_to_download)} PDF part(s) in email from '{sender}' subject '{subject}' (ID: {msg_id}). Processing...")
                 for part in pdf_parts_to_download: # Iterate through the parts found by the recursive search
                     filename = part.get('filename')
                     body = part.get('body', {}) # Already know it has body and attachmentId from _find_pdf_parts
@@ -261,18 +482,12 @@ def fetch_and_download_pdfs(config, credentials):
 
                     # The check 'mime_type == application/pdf' is implicitly done by _find_pdf_parts
                     if filename and attachment_id: # Simplified check as function guarantees PDF mime type and attachmentId
-                        print(f"  Found PDF attachment: '{filename}' in email from '{sender}' with subject '{subject}'")
-
-                        # Get the attachment data
-                        attachment = service.users().messages().attachments().get(
-                            userId='me', messageId=msg_id, id=attachment_id
-                        ).execute()
-                        file_data = base64.urlsafe_b64decode(attachment['data'].encode('UTF-8'))
+                        logger.debug("  Found PDF attachment: '%s' in email from '%s' with subject '%s'", filename, sender, subject)
 
                         # Sanitize filename components
-                        safe_sender = "".join(c if c.isalnum() or c in (' ', '_', '-') else '_' for c in sender.split('<')[0].strip())
-                        safe_subject = "".join(c if c.isalnum() or c in (' ', '_', '-') else '_' for c in subject)
-                        safe_filename = "".join(c if c.isalnum() or c in ('.', '_', '-') else '_' for c in filename)
+                        safe_sender = _UNSAFE_NAME_CHARS.sub('_', sender.split('<')[0].strip())
+                        safe_subject = _UNSAFE_NAME_CHARS.sub('_', subject)
+                        safe_filename = _UNSAFE_FILENAME_CHARS.sub('_', filename)
 
                         # Create a unique-ish filename
                         output_filename = f"{msg_date}_{safe_sender}_{safe_subject}_{safe_filename}"
@@ -286,58 +501,37 @@ def fetch_and_download_pdfs(config, credentials):
                              output_filename = output_filename[:max_len] # Final trim just in case
 
 
-                        filepath = os.path.join(download_path, output_filename)
-
-                        # Avoid overwriting - add a counter if file exists
-                        counter = 1
-                        original_filepath = filepath
-                        while os.path.exists(filepath):
-                            name, ext = os.path.splitext(original_filepath)
-                            filepath = f"{name}_{counter}{ext}"
-                            counter += 1
-                            if counter > 100: # Safety break
-                                print(f"Warning: Could not find unique name for {original_filepath} after 100 attempts. Skipping.")
-                                filepath = None
-                                break
-                        if filepath is None:
-                            continue
-
-
-                        print(f"    Downloading to: {filepath}")
-                        try:
-                            with open(filepath, 'wb') as f:
-                                f.write(file_data)
-                            downloaded_files_info.append({'path': filepath, 'subject': subject})
-                        except IOError as e:
-                            print(f"    Error writing file '{filepath}': {e}")
-                        except Exception as e:
-                            print(f"    An unexpected error occurred during file write for '{filepath}': {e}")
-                        # Removed the outer loop's responsibility for finding PDFs,
-                        # now just processes the ones found by _find_pdf_parts.
+                        filepath = str(download_dir / output_filename)
+                        # The attachment data is fetched later, concurrently with the other attachments
+                        download_jobs.append({'msg_id': msg_id, 'attachment_id': attachment_id, 'filename': filename,
+                                              'filepath': filepath, 'subject': subject})
 
             except HttpError as error:
-                print(f"An HTTP error occurred processing message ID {msg_id}: {error}")
+                logger.error(f"An HTTP error occurred processing message ID {msg_id}: {error}")
                 # Decide if you want to continue with other messages or stop
                 # continue
             except Exception as e:
-                print(f"An unexpected error occurred processing message ID {msg_id}: {e}")
+                logger.error(f"An unexpected error occurred processing message ID {msg_id}: {e}")
                 # continue
 
-        print(f"Finished processing emails. Downloaded {len(downloaded_files_info)} PDF files.")
+        logger.info(f"Downloading {len(download_jobs)} PDF attachment(s) concurrently...")
+        downloaded_files_info = asyncio.run(_download_attachments(credentials, download_jobs, on_pdf_downloaded))
+
+        logger.info(f"Finished processing emails. Downloaded {len(downloaded_files_info)} PDF files.")
         return downloaded_files_info
 
     except HttpError as error:
-        print(f'An HTTP error occurred during email fetching: {error}')
+        logger.error(f'An HTTP error occurred during email fetching: {error}')
         if error.resp.status == 403:
-             print("Error 403: Check if the Gmail API is enabled in your Google Cloud project.")
+             logger.error("Error 403: Check if the Gmail API is enabled in your Google Cloud project.")
         elif error.resp.status == 401:
-             print("Error 401: Authentication failed. The OAuth token might be invalid or revoked. Try deleting the token file and re-running.")
+             logger.error("Error 401: Authentication failed. The OAuth token might be invalid or revoked. Try deleting the token file and re-running.")
         return []
     except FileNotFoundError as e:
-        print(f"Configuration Error: {e}")
+        logger.error(f"Configuration Error: {e}")
         return []
     except Exception as e:
-        print(f'An unexpected error occurred in fetch_and_download_pdfs: {e}')
+        logger.error(f'An unexpected error occurred in fetch_and_download_pdfs: {e}')
         # Consider logging the traceback here for debugging
         # import traceback
         # traceback.print_exc()
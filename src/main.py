@@ -14,29 +14,20 @@ import datetime
 # import os # Removed duplicate import
 import shutil # Added for directory cleanup
 import json # Added for checkpointing
+import orjson # Fast JSON decoding for the checkpoint files
 import argparse # Added for command-line arguments
 import logging # Added for date parsing warnings
 from dateutil.relativedelta import relativedelta # Added for date calculations
 from dateutil import parser as date_parser # Added for flexible date parsing
-from typing import List # For type hinting
+import functools # For caching parsed date strings
+from concurrent.futures import ThreadPoolExecutor # For parallel downloads cleanup
+from typing import List, Optional, Tuple # For type hinting
+from pydantic import ValidationError # TypeAdapter for checkpoint validation is built lazily (_get_transaction_list_adapter)
 # Local Imports
 import config
-cfg = config.load_config()
-
-import email_handler
-import pdf_parser
-from pdf_parser import Transaction
-import categorizer
-from categorizer import Category, process_transactions_ai, filter_expenses
-from src.models import DEFAULT_CATEGORY_ENUM
-import sheets_handler
-
-# --- OAuth Imports ---
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.errors import HttpError # Keep for potential errors during auth
-from googleapiclient.discovery import build # Needed by handlers
+from src.models import Transaction, Category, DEFAULT_CATEGORY_ENUM
+# The handler modules and the Google OAuth libraries are slow to import, so they are imported
+# where they are first used; '--help' and resumed runs never pay for the ones they skip.
 
 # --- Define Scopes ---
 # Define all potentially required scopes upfront.
@@ -61,11 +52,39 @@ def get_previous_month():
     month_name = last_day_of_previous_month.strftime("%B")
     return year, month_num, month_name
 
+# Credentials already obtained in this process: (creds_file, token_file, scopes) -> (creds, token file mtime)
+_CREDS_CACHE = {}
+
+def _token_file_mtime(token_file):
+    """Returns the token file's modification time, or None if it doesn't exist."""
+    try:
+        return os.stat(token_file).st_mtime
+    except OSError:
+        return None
+
+# Tokens this close to expiry are refreshed up front instead of expiring mid-run
+TOKEN_REFRESH_SKEW_SECONDS = 300
+
+def _expires_soon(creds):
+    """True if the credentials' access token expires within TOKEN_REFRESH_SKEW_SECONDS."""
+    if not creds.expiry:
+        return False
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) # google-auth stores expiry as naive UTC
+    return (creds.expiry - now).total_seconds() < TOKEN_REFRESH_SKEW_SECONDS
+
+def _save_token(creds, token_file):
+    """Writes the token via a temp file and os.replace, so a crash mid-write can't corrupt the existing token."""
+    tmp_file = f"{token_file}.tmp"
+    with open(tmp_file, 'w') as token:
+        token.write(creds.to_json())
+    os.replace(tmp_file, token_file)
+
 def get_oauth_credentials(config_data, required_scopes):
     """
     Handles the OAuth 2.0 flow to obtain user credentials for the specified scopes.
     Checks existing token validity and scopes, refreshes if possible,
-    or runs the authorization flow if needed.
+    or runs the authorization flow if needed. Valid credentials are reused
+    within the process until they expire or the token file changes on disk.
 
     Args:
         config_data (dict): Loaded configuration containing file paths.
@@ -74,6 +93,10 @@ def get_oauth_credentials(config_data, required_scopes):
     Returns:
         google.oauth2.credentials.Credentials: Valid credentials object or None if failed.
     """
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.transport.requests import Request
+
     creds = None
     token_file = config_data.get('GMAIL_TOKEN_FILE', 'gmail_token.json') # Central token file
     creds_file = config_data.get('GMAIL_OAUTH_CREDENTIALS_FILE')
@@ -85,66 +108,81 @@ def get_oauth_credentials(config_data, required_scopes):
         logger.error(f"Configuration Error: OAuth credentials file not found at '{creds_file}'")
         return None
 
+    required_scope_set = frozenset(required_scopes) # Built once; used for the cache key and the scope check
+    cache_key = (creds_file, token_file, required_scope_set)
+    cached = _CREDS_CACHE.get(cache_key)
+    if cached:
+        cached_creds, cached_mtime = cached
+        if cached_creds.valid and not _expires_soon(cached_creds) and cached_mtime == _token_file_mtime(token_file):
+            logger.info("Reusing OAuth credentials already loaded in this process.")
+            return cached_creds
+
     # 1. Load existing token if available
-    if os.path.exists(token_file):
+    # Opened directly instead of probing with os.path.exists first; a missing file just means no token yet
+    try:
+        creds = Credentials.from_authorized_user_file(token_file, required_scopes)
+        logger.info(f"Loaded credentials from {token_file}")
+    except FileNotFoundError:
+        creds = None
+    except ValueError as e:
+        logger.warning(f"Warning loading token from '{token_file}': {e}. Checking scopes.")
         try:
-            creds = Credentials.from_authorized_user_file(token_file, required_scopes)
-            logger.info(f"Loaded credentials from {token_file}")
-        except ValueError as e:
-            logger.warning(f"Warning loading token from '{token_file}': {e}. Checking scopes.")
-            try:
-                 creds = Credentials.from_authorized_user_file(token_file) # Load without scope check
-                 logger.info("Loaded token initially, will verify scopes.")
-            except Exception as load_err:
-                 logger.error(f"Error loading token file '{token_file}' even without scope check: {load_err}. Will attempt re-authorization.")
-                 creds = None
-        except Exception as e:
-            logger.error(f"Error loading token file '{token_file}': {e}. Will attempt re-authorization.")
-            creds = None
+             creds = Credentials.from_authorized_user_file(token_file) # Load without scope check
+             logger.info("Loaded token initially, will verify scopes.")
+        except Exception as load_err:
+             logger.error(f"Error loading token file '{token_file}' even without scope check: {load_err}. Will attempt re-authorization.")
+             creds = None
+    except Exception as e:
+        logger.error(f"Error loading token file '{token_file}': {e}. Will attempt re-authorization.")
+        creds = None
 
     # 2. Check validity, refresh if expired, or run flow if missing/invalid/scopes insufficient
     needs_reauth = False
     if not creds:
         needs_reauth = True
         logger.info("No existing token found.")
-    elif not creds.valid:
-        if creds.expired and creds.refresh_token:
-            logger.info("Credentials expired. Attempting to refresh...")
+    elif not creds.valid or _expires_soon(creds):
+        if creds.refresh_token and (creds.expired or _expires_soon(creds)):
+            logger.info("Credentials expired or about to expire. Attempting to refresh...")
             try:
                 creds.refresh(Request())
                 logger.info("Token refreshed successfully.")
                 # After refresh, save the updated token
                 try:
-                    with open(token_file, 'w') as token:
-                        token.write(creds.to_json())
+                    _save_token(creds, token_file)
                     logger.info(f"Refreshed credentials saved to {token_file}")
                 except IOError as e:
                     logger.error(f"Error saving refreshed token file '{token_file}': {e}")
             except Exception as e:
-                logger.error(f"Error refreshing token: {e}. Need to re-authorize.")
-                needs_reauth = True
-        else:
+                if creds.valid: # Early refresh failed, but the current token still works for now
+                    logger.warning(f"Error refreshing token ahead of expiry: {e}. Continuing with the current token.")
+                else:
+                    logger.error(f"Error refreshing token: {e}. Need to re-authorize.")
+                    needs_reauth = True
+        elif not creds.valid:
             logger.warning("Credentials invalid and cannot be refreshed.")
             needs_reauth = True
 
     # 3. Check if all required scopes are present in the current (potentially refreshed) token
-    if creds and creds.valid and not set(required_scopes).issubset(set(creds.scopes)):
+    missing_scopes = required_scope_set - frozenset(creds.scopes or ()) if creds and creds.valid else frozenset()
+    if missing_scopes:
         logger.warning("Warning: Current token is valid but missing required scopes.")
         logger.warning(f"Required: {required_scopes}")
         logger.warning(f"Token has: {creds.scopes}")
-        logger.warning(f"Missing: {list(set(required_scopes) - set(creds.scopes))}")
+        logger.warning(f"Missing: {list(missing_scopes)}")
         needs_reauth = True
 
     # 4. Run authorization flow if needed
     if needs_reauth:
         logger.info(f"Need to obtain new authorization (or grant missing scopes).")
         # Attempt to remove old token file if re-authorization is needed
-        if os.path.exists(token_file):
-            try:
-                os.remove(token_file)
-                logger.info(f"Removed potentially invalid/incomplete token file: {token_file}")
-            except OSError as rm_err:
-                logger.warning(f"Warning: Could not remove old token file '{token_file}': {rm_err}")
+        try:
+            os.remove(token_file)
+            logger.info(f"Removed potentially invalid/incomplete token file: {token_file}")
+        except FileNotFoundError:
+            pass # No old token to remove
+        except OSError as rm_err:
+            logger.warning(f"Warning: Could not remove old token file '{token_file}': {rm_err}")
 
         # Run the installed app flow
         try:
@@ -162,8 +200,7 @@ def get_oauth_credentials(config_data, required_scopes):
         # 5. Save the newly obtained credentials
         if creds:
             try:
-                with open(token_file, 'w') as token:
-                    token.write(creds.to_json())
+                _save_token(creds, token_file)
                 logger.info(f"New credentials saved to {token_file}")
             except IOError as e:
                 logger.error(f"Error saving new token file '{token_file}': {e}")
@@ -178,6 +215,7 @@ def get_oauth_credentials(config_data, required_scopes):
         return None
 
     logger.info("Successfully obtained valid OAuth 2.0 credentials with required scopes.")
+    _CREDS_CACHE[cache_key] = (creds, _token_file_mtime(token_file))
     return creds
 
 
@@ -185,12 +223,110 @@ def get_oauth_credentials(config_data, required_scopes):
 processed_transactions_file = "processed_transactions.json"
 categorized_transactions_file = "categorized_transactions.json"
 
+@functools.lru_cache(maxsize=1)
+def _get_transaction_list_adapter():
+    """
+    Returns the TypeAdapter that validates a whole checkpoint in one call inside pydantic-core instead
+    of one Transaction(**d) per item. Built on first use, since only runs that load a checkpoint need it.
+    """
+    from pydantic import TypeAdapter
+    return TypeAdapter(List[Transaction])
+
+@functools.lru_cache(maxsize=8192)
+def _normalize_checkpoint_date(date_str: str) -> str:
+    """Normalizes a checkpoint date with sheets_handler's parser. Cached, since resumed checkpoints repeat the same posting dates on many rows."""
+    import sheets_handler
+    return sheets_handler.parse_date_flexible(date_str)
+
+
+def _write_checkpoint(file_path: str, transactions: List[Transaction], stage: str, pretty: bool = False) -> int:
+    """
+    Streams transactions to a JSON checkpoint file one object at a time, so no intermediate
+    list of dicts or full JSON document is held in memory. Each transaction is written compactly
+    on its own line unless `pretty` is set. The file is written via a temp file and os.replace,
+    so an interrupted write can't leave a truncated checkpoint for --resume. Returns the number of items written.
+    """
+    indent = 2 if pretty else None
+    saved_count = 0
+    tmp_file = f"{file_path}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(b'[')
+        for t in transactions:
+            if not hasattr(t, 'model_dump'):
+                logger.warning(f"  Skipping unknown type in {stage} save: {type(t)}")
+                continue
+            f.write(b',\n' if saved_count else b'\n')
+            f.write(t.model_dump_json(indent=indent).encode()) # Serialized in one pass by pydantic-core, no intermediate dict
+            saved_count += 1
+        f.write(b'\n]')
+    os.replace(tmp_file, file_path) # Readers never see a half-written file
+    return saved_count
+
+
+def _validate_checkpoint_items(numbered_items: List[Tuple[int, dict]]) -> List[Transaction]:
+    """
+    Turns (item number, dict) pairs loaded from a checkpoint into Transaction objects with one
+    batch validation. If any item is invalid, falls back to validating items one by one so only
+    the bad items are skipped.
+    """
+    try:
+        return _get_transaction_list_adapter().validate_python([item_dict for _, item_dict in numbered_items])
+    except ValidationError:
+        transactions = []
+        for item_num, item_dict in numbered_items:
+            try:
+                transactions.append(Transaction(**item_dict))
+            except Exception as deser_err:
+                logger.warning(f"  Warning: Failed to deserialize item {item_num}: {deser_err}. Data: {item_dict}")
+        return transactions
+
+
+# Date string formats accepted by the date filter, in order of preference
+DATE_FORMATS = [
+    "%Y-%m-%d", "%d/%m/%Y", "%d-%b-%Y", # Existing
+    "%b %d, %Y", "%d/%m/%Y %H:%M:%S", "%d-%b-%y" # New
+]
+# DATE_FORMATS grouped by the length of their zero-padded output, preference order kept within each length;
+# strings of any other length go to the dateutil fallback
+DATE_FORMATS_BY_LENGTH = {}
+for _fmt in DATE_FORMATS:
+    DATE_FORMATS_BY_LENGTH.setdefault(len(datetime.datetime(2000, 1, 1).strftime(_fmt)), []).append(_fmt)
+del _fmt
+
+@functools.lru_cache(maxsize=8192)
+def _parse_date_string(date_str: str) -> Optional[datetime.date]:
+    """
+    Parses a transaction date string with the DATE_FORMATS entry matching its length.
+    Cached, since statements repeat the same dates many times. Returns None if no format matches.
+    """
+    for fmt in DATE_FORMATS_BY_LENGTH.get(len(date_str), []):
+        try:
+            return datetime.datetime.strptime(date_str, fmt).date()
+        except ValueError:
+            continue # Try next format
+    return None
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_date_fallback(date_str: str, default: datetime.datetime) -> Optional[datetime.date]:
+    """
+    Last resort for date strings no fixed format matched: one dateutil parse, with missing
+    fields taken from `default` (the target month). Returns None if dateutil can't parse it either.
+    """
+    try:
+        # Statements write day before month, except for year-first (ISO-like) strings
+        dayfirst = not date_str[:4].isdigit()
+        return date_parser.parse(date_str, dayfirst=dayfirst, default=default).date()
+    except (ValueError, OverflowError):
+        return None
+
 
 def filter_transactions_by_date(transactions: List[Transaction], target_year: int, target_month: int) -> List[Transaction]:
     """
     Filters transactions to include the target month plus the first two days of the next month.
     Ignores transactions without a valid date.
     """
+    import numpy as np # Vectorized date range check; imported here so '--help' and startup don't load it
     try:
         start_date = datetime.date(target_year, target_month, 1)
         # Calculate the first day of the month *after* the target month
@@ -200,66 +336,42 @@ def filter_transactions_by_date(transactions: List[Transaction], target_year: in
 
         logger.info(f"Applying date filter: Keeping transactions from {start_date.isoformat()} to {end_date_inclusive.isoformat()} (inclusive).")
 
-        filtered_list = []
-        ignored_count = 0
+        fallback_default = datetime.datetime(target_year, target_month, 1) # Fills fields missing from loosely formatted dates
+        # Normalize each date first; the range check then runs once over all of them as a datetime64 array
+        dated_indices = []
+        transaction_dates = []
         no_date_count = 0
-        for t in transactions:
+        for i, t in enumerate(transactions):
             if t.date is None:
                 no_date_count += 1
                 continue # Ignore transactions with no date
 
-            transaction_date_obj = None # Initialize
-            if t.date is None:
-                no_date_count += 1
-                continue # Ignore transactions with no date
-
-            if isinstance(t.date, datetime.date):
-                transaction_date_obj = t.date
-            elif isinstance(t.date, datetime.datetime):
-                transaction_date_obj = t.date.date() # Convert datetime to date
-            elif isinstance(t.date, str):
-                parsed_date = None
-                # Define all formats to try
-                formats_to_try = [
-                    "%Y-%m-%d", "%d/%m/%Y", "%d-%b-%Y", # Existing
-                    "%b %d, %Y", "%d/%m/%Y %H:%M:%S", "%d-%b-%y" # New
-                ]
-                for fmt in formats_to_try:
-                    try:
-                        if fmt == "%d/%m/%Y %H:%M:%S":
-                            # Parse as datetime first, then get date
-                            parsed_datetime = datetime.datetime.strptime(t.date, fmt)
-                            parsed_date = parsed_datetime.date()
-                        else:
-                            # Parse directly to date
-                            parsed_date = datetime.datetime.strptime(t.date, fmt).date()
-                        
-                        # If parsing succeeded, break the loop
-                        if parsed_date:
-                            break
-                    except ValueError:
-                        continue # Try next format
-                
+            if isinstance(t.date, str): # The model stores dates as strings, so check this first
+                parsed_date = _parse_date_string(t.date) or _parse_date_fallback(t.date, fallback_default)
                 if parsed_date:
                     transaction_date_obj = parsed_date
                 else:
                     logger.warning(f"Could not parse date string '{t.date}' for transaction: {t.description}. Skipping.")
                     no_date_count += 1 # Count as skipped due to bad date format
                     continue # Skip this transaction
+            elif isinstance(t.date, datetime.datetime):
+                transaction_date_obj = t.date.date() # Convert datetime to date
+            elif isinstance(t.date, datetime.date):
+                transaction_date_obj = t.date
             else:
                 # Handle unexpected types
                 logger.warning(f"Unexpected date type '{type(t.date)}' for transaction: {t.description}. Skipping.")
                 no_date_count += 1
                 continue
 
-            # Now use transaction_date_obj in the comparison
-            if transaction_date_obj and start_date <= transaction_date_obj <= end_date_inclusive:
-                filtered_list.append(t)
-            else:
-                # This 'else' now covers out-of-range dates AND dates that failed parsing/had wrong type
-                # We already incremented no_date_count for parsing failures, so only increment ignored_count for out-of-range
-                if transaction_date_obj: # Only increment ignored_count if we had a valid date object to compare
-                     ignored_count += 1
+            dated_indices.append(i)
+            transaction_dates.append(transaction_date_obj)
+
+        # Vectorized range check; only out-of-range dates count as ignored (parse failures were counted above)
+        date_array = np.array(transaction_dates, dtype='datetime64[D]')
+        in_range = (date_array >= np.datetime64(start_date)) & (date_array <= np.datetime64(end_date_inclusive))
+        filtered_list = [transactions[dated_indices[j]] for j in np.flatnonzero(in_range)]
+        ignored_count = len(dated_indices) - len(filtered_list)
 
         logger.info(f"Date Filtering Results: Kept {len(filtered_list)}, Ignored {ignored_count} (out of range), Skipped {no_date_count} (no date).")
         return filtered_list
@@ -268,27 +380,53 @@ def filter_transactions_by_date(transactions: List[Transaction], target_year: in
         return transactions # Return original list on error to avoid losing data
 
 
+def _delete_download_entry(entry: os.DirEntry):
+    """Deletes one entry of the downloads directory (file, symlink or subdirectory)."""
+    try:
+        # DirEntry caches its type from the directory scan, so this needs no extra stat calls
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+    except Exception as e:
+        logger.error(f"Failed to delete {entry.path}. Reason: {e}")
+
+
+def _fetch_and_parse_pdfs(cfg, credentials, preview_mode: bool):
+    """
+    Downloads statement PDFs and parses them into transactions. Outside preview mode each PDF
+    is handed to one of PDF_CONCURRENCY parser threads as soon as it is saved, so parsing overlaps
+    the remaining downloads. Preview mode downloads everything first, so parse_pdfs can ask about each PDF
+    once they have all been parsed.
+
+    Returns:
+        tuple: (downloaded_pdf_info, parsed_transactions), in download order.
+    """
+    import email_handler
+    import pdf_parser
+
+    if preview_mode:
+        downloaded_pdf_info = email_handler.fetch_and_download_pdfs(cfg, credentials)
+        if not downloaded_pdf_info:
+            return downloaded_pdf_info, []
+        return downloaded_pdf_info, pdf_parser.parse_pdfs(downloaded_pdf_info, cfg, credentials, preview_mode)
+
+    # PDF_CONCURRENCY parser threads, so at most PDF_CONCURRENCY x PDF_PAGE_CONCURRENCY Gemini requests are in flight
+    with ThreadPoolExecutor(max_workers=max(1, cfg.get('PDF_CONCURRENCY', pdf_parser.DEFAULT_PDF_CONCURRENCY))) as executor:
+        parse_futures = {}
+        def _on_pdf_downloaded(pdf_info):
+            parse_futures[pdf_info['path']] = executor.submit(pdf_parser.parse_pdfs, [pdf_info], cfg, credentials, False)
+
+        downloaded_pdf_info = email_handler.fetch_and_download_pdfs(cfg, credentials, on_pdf_downloaded=_on_pdf_downloaded)
+        parsed_transactions = []
+        for pdf_info in downloaded_pdf_info or []:
+            parsed_transactions.extend(parse_futures[pdf_info['path']].result())
+    return downloaded_pdf_info, parsed_transactions
+
+
 def main():
     """Main execution function."""
 
-    # --- Clear Downloads Directory ---
-    downloads_dir = 'downloads'
-    logger.info(f"--- Attempting to clear contents of '{downloads_dir}' directory ---")
-    if os.path.isdir(downloads_dir):
-        for item_name in os.listdir(downloads_dir):
-            item_path = os.path.join(downloads_dir, item_name)
-            try:
-                if os.path.isfile(item_path) or os.path.islink(item_path):
-                    os.remove(item_path)
-                elif os.path.isdir(item_path):
-                    shutil.rmtree(item_path)
-            except Exception as e:
-                logger.error(f"Failed to delete {item_path}. Reason: {e}")
-        logger.info(f"--- Finished clearing '{downloads_dir}' directory ---")
-    else:
-        logger.warning(f"Directory '{downloads_dir}' not found. Skipping cleanup.")
-    # --- End Clear Downloads Directory ---
-
     # --- Argument Parsing ---
     parser = argparse.ArgumentParser(description="Automate budget processing from email/PDFs to Google Sheets.")
     parser.add_argument(
@@ -296,9 +434,15 @@ def main():
         action='store_true',
         help="Enable preview mode to review transactions from each PDF before processing."
     )
+    parser.add_argument(
+        '--pretty',
+        action='store_true',
+        help="Indent the checkpoint JSON files (slower and larger; for debugging)."
+    )
     args = parser.parse_args()
     # --- End Argument Parsing ---
 
+    cfg = config.load_config()
     if not cfg:
         logger.critical("Failed to load configuration. Exiting.")
         return
@@ -326,11 +470,11 @@ def main():
     if os.path.exists(categorized_transactions_file):
         logger.info(f"Found categorized file. Attempting to resume from: {categorized_transactions_file}")
         try:
-            with open(categorized_transactions_file, 'r') as f:
-                loaded_dicts = json.load(f)
+            with open(categorized_transactions_file, 'rb') as f:
+                loaded_dicts = orjson.loads(f.read())
                 if loaded_dicts:
                     logger.info(f"Raw data loaded. Deserializing {len(loaded_dicts)} items into Transaction objects...")
-                    deserialized_transactions = []
+                    numbered_items = []
                     for i, item_dict in enumerate(loaded_dicts):
                         try:
                             # Deserialize category
@@ -347,17 +491,16 @@ def main():
                             # Date string will be passed directly to Transaction model
                             # which expects Optional[str], no pre-parsing needed here.
 
-                            transaction_obj = Transaction(**item_dict)
-                            deserialized_transactions.append(transaction_obj)
+                            numbered_items.append((i + 1, item_dict))
                         except Exception as deser_err:
                             logger.warning(f"  Warning: Failed to deserialize item {i+1}: {deser_err}. Data: {item_dict}")
-                    final_transactions = deserialized_transactions # Load directly into final list
+                    final_transactions = _validate_checkpoint_items(numbered_items) # Load directly into final list
                     resume_stage = 'categorized'
                     logger.info(f"Successfully resumed from categorized stage with {len(final_transactions)} transactions.")
                 else:
                     logger.info(f"File {categorized_transactions_file} is empty. Will check for processed file.")
                     # Don't set resume_stage yet, proceed to check processed file
-        except (json.JSONDecodeError, IOError) as e:
+        except (json.JSONDecodeError, orjson.JSONDecodeError, IOError) as e:
             logger.warning(f"Warning: Failed to load/decode '{categorized_transactions_file}': {e}. Will check for processed file.")
         except Exception as e:
             logger.error(f"Warning: Unexpected error loading '{categorized_transactions_file}': {e}", exc_info=True)
@@ -368,17 +511,17 @@ def main():
         if os.path.exists(processed_transactions_file):
             logger.info(f"Found processed file. Attempting to resume from: {processed_transactions_file}")
             try:
-                with open(processed_transactions_file, 'r') as f:
-                    loaded_dicts = json.load(f)
+                with open(processed_transactions_file, 'rb') as f:
+                    loaded_dicts = orjson.loads(f.read())
                     if loaded_dicts:
                         logger.info(f"Raw data loaded. Deserializing {len(loaded_dicts)} items into Transaction objects...")
-                        deserialized_transactions = []
+                        numbered_items = []
                         for i, item_dict in enumerate(loaded_dicts):
                              try:
                                 # Deserialize date (assuming ISO string) - No category expected here yet
                                 if 'date' in item_dict and isinstance(item_dict['date'], str):
                                     try:
-                                        item_dict['date'] = sheets_handler.parse_date_flexible(item_dict['date'])
+                                        item_dict['date'] = _normalize_checkpoint_date(item_dict['date'])
                                     except ValueError:
                                         logger.warning(f"  Item {i+1}: Invalid date string '{item_dict['date']}'. Setting to None.")
                                         item_dict['date'] = None
@@ -387,17 +530,16 @@ def main():
                                     logger.warning(f"  Item {i+1}: Unexpected 'category' field found in processed file. Ignoring.")
                                     item_dict['category'] = None
 
-                                transaction_obj = Transaction(**item_dict)
-                                deserialized_transactions.append(transaction_obj)
+                                numbered_items.append((i + 1, item_dict))
                              except Exception as deser_err:
                                 logger.warning(f"  Warning: Failed to deserialize item {i+1}: {deser_err}. Data: {item_dict}")
-                        all_transactions = deserialized_transactions # Load into intermediate list
+                        all_transactions = _validate_checkpoint_items(numbered_items) # Load into intermediate list
                         resume_stage = 'processed'
                         logger.info(f"Successfully resumed from processed stage with {len(all_transactions)} transactions. Needs categorization.")
                     else:
                         logger.info(f"File {processed_transactions_file} is empty. Proceeding with fresh run.")
                         resume_stage = None
-            except (json.JSONDecodeError, IOError) as e:
+            except (json.JSONDecodeError, orjson.JSONDecodeError, IOError) as e:
                 logger.warning(f"Warning: Failed to load/decode '{processed_transactions_file}': {e}. Proceeding with fresh run.")
                 resume_stage = None
             except Exception as e:
@@ -412,15 +554,28 @@ def main():
     # --- Stage 1: Fetch, Parse, Combine, Filter, and Save Processed ---
     if resume_stage is None: # Only run if starting fresh
         logger.info("--- Stage 1: Fetching, Parsing, Combining, Filtering ---")
+        # --- Clear Downloads Directory (fresh runs only; resumed runs don't touch downloads) ---
+        downloads_dir = 'downloads'
+        logger.info(f"--- Attempting to clear contents of '{downloads_dir}' directory ---")
+        try:
+            with os.scandir(downloads_dir) as entries:
+                download_entries = list(entries)
+        except (FileNotFoundError, NotADirectoryError):
+            logger.warning(f"Directory '{downloads_dir}' not found. Skipping cleanup.")
+        else:
+            # Deletions are I/O-bound and independent, so they run in a thread pool
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                executor.map(_delete_download_entry, download_entries)
+            logger.info(f"--- Finished clearing '{downloads_dir}' directory ---")
+        # --- End Clear Downloads Directory ---
+
         try:
-            # Step 1 & 2: Fetch Emails and Download PDFs
-            downloaded_pdf_info = email_handler.fetch_and_download_pdfs(cfg, credentials)
+            # Step 1, 2 & 3: Fetch Emails, Download PDFs and Parse them (parsing starts as each PDF arrives)
+            downloaded_pdf_info, parsed_transactions = _fetch_and_parse_pdfs(cfg, credentials, args.preview)
             if not downloaded_pdf_info:
                 logger.info("No relevant PDFs found or downloaded via email.")
                 all_transactions = [] # Ensure it's an empty list
             else:
-                # Step 3: Parse PDFs
-                parsed_transactions = pdf_parser.parse_pdfs(downloaded_pdf_info, cfg, credentials, args.preview)
                 if parsed_transactions:
                     logger.info(f"Successfully parsed {len(parsed_transactions)} transactions from PDFs.")
                     all_transactions = parsed_transactions
@@ -441,20 +596,8 @@ def main():
             if all_transactions:
                 logger.info(f"Attempting to save {len(all_transactions)} processed transactions to checkpoint: {processed_transactions_file}")
                 try:
-                    data_to_save = []
-                    for t in all_transactions:
-                        if hasattr(t, 'model_dump'):
-                            dumped = t.model_dump(mode='json')
-                            # Ensure category is NOT saved here
-                            if 'category' in dumped:
-                                pass
-                            data_to_save.append(dumped)
-                        else:
-                            logger.warning(f"  Skipping unknown type in processed save: {type(t)}")
-
-                    with open(processed_transactions_file, 'w') as f:
-                        json.dump(data_to_save, f, indent=4)
-                    logger.info(f"Successfully saved {len(data_to_save)} processed transactions to checkpoint: {processed_transactions_file}")
+                    saved_count = _write_checkpoint(processed_transactions_file, all_transactions, 'processed', args.pretty)
+                    logger.info(f"Successfully saved {saved_count} processed transactions to checkpoint: {processed_transactions_file}")
                 except (IOError, TypeError) as e:
                     logger.error(f"Error saving processed transactions checkpoint: {e}")
                 except Exception as e:
@@ -476,6 +619,7 @@ def main():
         else:
             try:
                 logger.info(f"Starting AI enrichment for {len(all_transactions)} transactions...")
+                from categorizer import process_transactions_ai
                 enriched_transactions = process_transactions_ai(all_transactions, cfg)
 
                 if not enriched_transactions:
@@ -498,18 +642,8 @@ def main():
                     # Save to Categorized Checkpoint File
                     logger.info(f"Attempting to save {len(final_transactions)} categorized transactions to checkpoint: {categorized_transactions_file}")
                     try:
-                        data_to_save = []
-                        for t in final_transactions:
-                             if hasattr(t, 'model_dump'):
-                                 dumped = t.model_dump(mode='json')
-
-                                 data_to_save.append(dumped)
-                             else:
-                                 logger.warning(f"  Skipping unknown type in categorized save: {type(t)}")
-
-                        with open(categorized_transactions_file, 'w') as f:
-                            json.dump(data_to_save, f, indent=4)
-                        logger.info(f"Successfully saved {len(data_to_save)} categorized transactions to checkpoint: {categorized_transactions_file}")
+                        saved_count = _write_checkpoint(categorized_transactions_file, final_transactions, 'categorized', args.pretty)
+                        logger.info(f"Successfully saved {saved_count} categorized transactions to checkpoint: {categorized_transactions_file}")
                     except (IOError, TypeError) as e:
                         logger.error(f"Error saving categorized transactions checkpoint: {e}")
                     except Exception as e:
@@ -554,6 +688,7 @@ def main():
         logger.info("Updating Google Sheet...")
         try:
             # Pass final_transactions (contains all accounts) and credentials
+            import sheets_handler
             sheet_link = sheets_handler.update_google_sheet(
                 final_transactions,       # Pass the final list of transactions
                 cfg,                      # Pass config
@@ -2,7 +2,8 @@ import logging
 from enum import Enum
 # Added imports for Transaction model
 import re
-from pydantic import BaseModel, Field, ValidationError, validator
+import math
+from pydantic import BaseModel, Field, ValidationError, field_validator
 from typing import List, Optional, Literal
 
 # Setup logging consistent with other modules
@@ -75,27 +76,32 @@ class Category(str, Enum):
             return cls.UNCATEGORIZED
         search_value = value.upper().strip().replace(" ", "_") # Normalize for matching enum keys/values
 
-        # Handle specific known variations/typos first
-        if search_value == 'ENTERTAINTMENT': search_value = 'ENTERTAINMENT'
-        if search_value == 'BODY': search_value = 'GYM'
-        if search_value == 'HOUSE': search_value = 'HOUSEHOLD'
-        # Match against Enum keys (case-insensitive)
-        for member_name, member_obj in cls.__members__.items():
-            if member_name == search_value:
-                return member_obj
-        # Match against Enum values (case-insensitive, original string value)
-        for member_obj in cls:
-            if member_obj.value.upper() == value.upper().strip(): # Compare against original input string value
-                 return member_obj
+        # Match against Enum keys and values (case-insensitive), including known variations/typos
+        member_obj = _CATEGORY_LOOKUP.get(search_value)
+        if member_obj is not None:
+            return member_obj
 
         logger.warning(f"Could not map string '{value}' to Category enum. Falling back to UNCATEGORIZED.")
         return cls.UNCATEGORIZED
 
+# Lookup table for Category.from_string, built once instead of scanning the members per call.
+# Keys are normalized like from_string's input: upper case, spaces as underscores.
+_CATEGORY_LOOKUP = {member_obj.value.upper().replace(" ", "_"): member_obj for member_obj in Category}
+_CATEGORY_LOOKUP.update(Category.__members__) # Member names take precedence over values
+_CATEGORY_LOOKUP.update({
+    'ENTERTAINTMENT': Category.ENTERTAINMENT, # Known typo
+    'BODY': Category.GYM,
+    'HOUSE': Category.HOUSEHOLD,
+})
+
 # Default category Enum member
 DEFAULT_CATEGORY_ENUM = Category.UNCATEGORIZED
 
 # --- Moved Pydantic Models ---
 
+# Characters stripped from amount strings (commas, currency symbols, spaces, "Dr"/"Cr" markers)
+_AMOUNT_CLEAN_PATTERN = re.compile(r'[^\d.-]')
+
 class Transaction(BaseModel):
     """Represents a single financial transaction extracted from a PDF."""
     date: Optional[str] = Field(None, description="Transaction date (e.g., YYYY-MM-DD or DD/MM/YYYY)") # Made optional as AI might miss it
@@ -109,13 +115,24 @@ class Transaction(BaseModel):
     category: Optional['Category'] = Field(None, description="Category assigned by AI or default") # Added field
     transaction_type: Literal['credit', 'debit'] = Field(..., description="Type of transaction: credit or debit")
 
-    @validator('amount', pre=True, allow_reuse=True)
+    @field_validator('amount', mode='before')
+    @classmethod
     def clean_amount(cls, v):
         if v is None:
             return None
+        if isinstance(v, (int, float)):
+            return float(v) # Already numeric (the usual case for JSON from Gemini)
         if isinstance(v, str):
+            # Fast path for already-clean strings like "123.45". Exponents and nan/inf mean
+            # something else after cleaning, so those take the regex path as before.
+            try:
+                fast_v = float(v)
+                if math.isfinite(fast_v) and 'e' not in v and 'E' not in v:
+                    return fast_v
+            except ValueError:
+                pass
             # Remove commas and handle potential currency symbols or extra spaces
-            cleaned_v = re.sub(r'[^\d.-]', '', v)
+            cleaned_v = _AMOUNT_CLEAN_PATTERN.sub('', v)
             try:
                 return float(cleaned_v)
             except ValueError:
@@ -129,4 +146,12 @@ class Transaction(BaseModel):
 
 class TransactionList(BaseModel):
     """Represents a list of transactions extracted from a document page."""
-    transactions: List[Transaction]
\ No newline at end of file
+    transactions: List[Transaction]
+
+class PageTransactions(TransactionList):
+    """Represents the transactions extracted from one page of a multi-page request."""
+    page: int = Field(..., description="1-based page number, matching the 'PAGE N:' label sent with the image")
+
+class PageTransactionsList(BaseModel):
+    """Represents the per-page transaction lists extracted from a batch of document pages."""
+    pages: List[PageTransactions]
@@ -1,26 +1,57 @@
 import fitz  # PyMuPDF
 import re
 import os
-import io
-import json
 import sys # Added for exit() in preview mode
+import json # Added for the account name cache file
+import threading # Added for the shared account name cache
+import functools # Added for binding per-run arguments of _process_one_pdf
+import time
 import google.generativeai as genai
-from PIL import Image
-from typing import List # Modified import
-from src.models import Transaction, TransactionList # Added import
+from google.api_core import exceptions as google_exceptions
+from pydantic import ValidationError
+from rapidfuzz import fuzz, process, utils # Fuzzy account-name matching before asking the AI
+from concurrent.futures import ThreadPoolExecutor # For concurrent per-page Gemini calls
+from typing import Dict, List, Optional, Union # Modified import
+from src.models import Transaction, PageTransactionsList # Added import
+from src.retries import MAX_RETRIES, retry_delay # Shared backoff policy
+
+# Default number of PDFs processed at once (PDF_CONCURRENCY)
+DEFAULT_PDF_CONCURRENCY = 4
+# Default number of Gemini requests for one PDF in flight at once
+DEFAULT_PAGE_CONCURRENCY = 10
+# Default number of pages sent together in one Gemini request
+DEFAULT_PAGES_PER_REQUEST = 4
+# Candidates requested when retrying a page whose single answer couldn't be used
+HARD_PAGE_CANDIDATES = 3
+# Rate-limit (quota) and transient server errors from Gemini are retried with exponential backoff
+RETRYABLE_GEMINI_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests,
+                           google_exceptions.InternalServerError, google_exceptions.ServiceUnavailable,
+                           google_exceptions.DeadlineExceeded)
+# In 'auto' PDF handling, a page's text layer is used instead of an image when it has more than
+# this many characters and contains amount-like numbers
+MIN_TEXT_LAYER_CHARS = 200
+_AMOUNT_PATTERN = re.compile(r'\d+\.\d{2}')
+# HDFC Savings statements are recognised by filename and subject instead of the AI mapping
+HDFC_SAVINGS_ACCOUNT_NAME = "HDFC Savings" # From config.py
+# Pattern: Anything_DDMMYYYY_Anything.pdf (case-sensitive extension)
+_HDFC_SAVINGS_FILENAME_PATTERN = re.compile(r'^.+_\d{8}_.+\.pdf$')
+# Transactions whose description mentions Achu get is_split=2
+_ACHU_PATTERN = re.compile(r'achu', re.IGNORECASE)
 
 # --- Helper Functions ---
 
-def get_gemini_prompt(model_schema: str) -> str:
+def get_gemini_prompt() -> str:
     """Generates the prompt for the Gemini Vision API."""
     # Note: This prompt asks Gemini to extract date, description, amount, and transaction_type.
     # Other fields (short_description, is_expense, is_split) are added later.
-    # The model_schema passed in is generated from models.py
+    # The full Transaction schema isn't embedded: responses are validated locally with Pydantic,
+    # and the four extracted fields are spelled out below, so it only cost input tokens on every request.
     return f"""
-Analyze the provided image, which is a page from a bank or credit card statement PDF.
+Analyze the provided pages from a bank or credit card statement PDF. Each page is given either as an image
+or as the text extracted from the PDF's text layer, and is preceded by a label of the form "PAGE N:" giving its page number.
 
 **Instructions for Data Extraction:**
-1.  **Focus strictly on identifying and extracting data only from the main transaction table(s) present on the page.**
+1.  **Focus strictly on identifying and extracting data only from the main transaction table(s) present on each page.**
 2.  **The table typically contains columns like 'Date', 'Description', and 'Amount'.**
 3.  **Ignore all other text, summaries, headers, footers, account details, interest calculations, or totals that are not part of the row-by-row transaction entries.**
 4.  **Extract the transaction date, description, amount, and transaction_type for each row in the table.**
@@ -29,11 +60,12 @@ Analyze the provided image, which is a page from a bank or credit card statement
     *   Look for indicators like "CR", "Credit", or specific columns designated for credits. If found, set `transaction_type` to `"credit"`.
     *   Look for indicators like "DR", "Debit", or specific columns for debits. If found, set `transaction_type` to `"debit"`.
     *   **Default Assumption:** If no clear credit indicator ("CR", "Credit", credit column) is associated with the transaction row, assume it is a `"debit"`. This is common for credit card statements where most entries are purchases.
-7.  **If no transaction table is found on the page, return an empty list for the 'transactions' field (i.e., {{"transactions": []}}).**
+7.  **Keep each page's transactions separate, and include every labelled page in the output. If no transaction table is found on a page, return an empty list for that page's 'transactions' field (i.e., {{"page": N, "transactions": []}}).**
 
 **Output Format:**
-*   Format the extracted data as a single JSON object containing a key "transactions".
-*   The value of "transactions" should be a list of JSON objects, where each object represents a single transaction.
+*   Format the extracted data as a single JSON object containing a key "pages".
+*   The value of "pages" should be a list with one JSON object per page, of the form {{"page": N, "transactions": [...]}}, where N is the number from the page's label.
+*   The value of each "transactions" should be a list of JSON objects, where each object represents a single transaction.
 *   Each transaction object MUST conform to the following structure (extract only these fields):
 
 ```json
@@ -45,31 +77,50 @@ Analyze the provided image, which is a page from a bank or credit card statement
 }}
 ```
 
-*   Here is the Pydantic model schema for the *final* Transaction object for clarity (though you only extract date, description, amount, and transaction_type from the image):
-```python
-{model_schema}
-```
-
 *   Ensure the output is ONLY the JSON object, starting with `{{` and ending with `}}`. Do not include any introductory text, explanations, or markdown formatting like ```json ... ``` around the final JSON output.
 """
 
+# Built once at import; the prompt doesn't depend on the PDF or page
+GEMINI_PROMPT = get_gemini_prompt()
+
 def render_page_to_image_bytes(page: fitz.Page) -> bytes:
     """Renders a PDF page to PNG image bytes."""
-    pix = page.get_pixmap(dpi=200)  # Increase DPI for better OCR quality
-    img_bytes = io.BytesIO()
-    # Use Pillow to save the pixmap data as PNG
-    if pix.alpha:
-        img = Image.frombytes("RGBA", [pix.width, pix.height], pix.samples)
-    else:
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-    img.save(img_bytes, format="PNG")
-    img_bytes.seek(0)
-    return img_bytes.read()
+    # Increase DPI for better OCR quality; always 3-channel RGB with no alpha, so no extra channel is encoded
+    pix = page.get_pixmap(dpi=200, colorspace=fitz.csRGB, alpha=False)
+    # PyMuPDF encodes the pixmap itself, without copying the samples into a Pillow image first
+    return pix.tobytes("png")
+
+# Fuzzy account-name matches are accepted only above this score (0-100, rapidfuzz token_set_ratio)
+# and only if they beat the runner-up by the margin; anything less certain goes to Gemini
+ACCOUNT_MATCH_MIN_SCORE = 85
+ACCOUNT_MATCH_MIN_MARGIN = 10
+_NAME_SEPARATORS_PATTERN = re.compile(r'[\s_\-.]+')
+
+def _match_account_name(filename: str, allowed_names: List[str]) -> Optional[str]:
+    """
+    Tries to map a filename to an account name without the AI: first an exact whole-word match
+    (ignoring case and separators), then a fuzzy token match that must be confident and unambiguous.
+    Returns None if neither applies.
+    """
+    stem = os.path.splitext(filename)[0]
+    # Whole words only, so e.g. "Cash" doesn't match "cashback_statement.pdf"
+    padded_stem = f" {_NAME_SEPARATORS_PATTERN.sub(' ', stem).strip().lower()} "
+    substring_matches = [name for name in allowed_names
+                         if f" {_NAME_SEPARATORS_PATTERN.sub(' ', name).strip().lower()} " in padded_stem]
+    if len(substring_matches) == 1:
+        return substring_matches[0]
+
+    best_matches = process.extract(stem, allowed_names, scorer=fuzz.token_set_ratio, processor=utils.default_process, limit=2)
+    if best_matches and best_matches[0][1] >= ACCOUNT_MATCH_MIN_SCORE:
+        runner_up_score = best_matches[1][1] if len(best_matches) > 1 else 0
+        if best_matches[0][1] - runner_up_score >= ACCOUNT_MATCH_MIN_MARGIN:
+            return best_matches[0][0]
+    return None
 
 def _get_account_name_via_ai(filename: str, allowed_names: List[str], model: genai.GenerativeModel) -> str:
     """
     Uses Gemini to determine the most likely account name for a given filename
-    from a predefined list.
+    from a predefined list, unless _match_account_name finds a clear match by name first.
 
     Args:
         filename: The base name of the PDF file.
@@ -83,6 +134,12 @@ def _get_account_name_via_ai(filename: str, allowed_names: List[str], model: gen
     if not allowed_names:
         print("  Warning: No ACCOUNT_NAMES provided in config for AI mapping.")
         return default_account
+    # Cheap string matching first; Gemini is only asked when it doesn't find a clear answer
+    matched_name = _match_account_name(filename, allowed_names)
+    if matched_name:
+        print(f"  Matched '{filename}' to '{matched_name}' by name")
+        return matched_name
+
     if not model:
         print("  Error: Gemini model not available for account name mapping.")
         return default_account
@@ -107,13 +164,367 @@ def _get_account_name_via_ai(filename: str, allowed_names: List[str], model: gen
         print(f"  Error during AI account name mapping for '{filename}': {e}")
         return default_account
 
+def _get_page_input(page: fitz.Page, pdf_handling: str) -> Union[str, bytes]:
+    """
+    Returns what is sent to Gemini for a page: its text layer (str) if the page has one that looks
+    like a statement table and pdf_handling allows it, otherwise a PNG rendering (bytes).
+    Born-digital statements skip rendering and image tokens this way, but the text layer doesn't
+    keep column positions, so it's only used when PDF_HANDLING is 'auto' or 'text'.
+    """
+    if pdf_handling != 'vision':
+        text = page.get_text("text", sort=True) # Reading order, so table rows stay on their lines (columns are lost)
+        if pdf_handling == 'text' or (len(text.strip()) > MIN_TEXT_LAYER_CHARS and _AMOUNT_PATTERN.search(text)):
+            return text
+    return render_page_to_image_bytes(page)
+
+def _parse_pages_response(response_text: str, expected_pages: int) -> PageTransactionsList:
+    """Cleans and validates one Gemini response text; raises if it isn't usable for expected_pages pages."""
+    # Clean potential markdown formatting (```json or bare ``` fences) if Gemini didn't follow instructions perfectly
+    response_text = response_text.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+
+    # Parse and validate with Pydantic
+    # Gemini now returns date, description, amount, and transaction_type per the prompt.
+    # We validate against PageTransactionsList, which expects Transaction objects per page.
+    # Pydantic will initialize Transaction objects using the data provided by Gemini,
+    # leaving other fields (like short_description, category) as None initially.
+    parsed_data = PageTransactionsList.model_validate_json(response_text)
+    if expected_pages > 1 and len(parsed_data.pages) != expected_pages:
+        raise ValueError(f"expected {expected_pages} pages in the response, got {len(parsed_data.pages)}")
+    return parsed_data
+
+def _best_candidate(response, expected_pages: int) -> PageTransactionsList:
+    """
+    Picks the most complete usable answer from a multi-candidate response: the candidate that
+    validates and has the most transactions. Raises ValueError if no candidate validates.
+    """
+    best_data, best_count, errors = None, -1, []
+    for candidate in response.candidates:
+        try:
+            candidate_text = "".join(part.text for part in candidate.content.parts)
+            parsed_data = _parse_pages_response(candidate_text, expected_pages)
+        except Exception as e:
+            errors.append(str(e))
+            continue
+        transaction_count = sum(len(page_result.transactions) for page_result in parsed_data.pages)
+        if transaction_count > best_count:
+            best_data, best_count = parsed_data, transaction_count
+    if best_data is None:
+        raise ValueError(f"none of {len(response.candidates)} candidates could be used: {'; '.join(errors)}")
+    return best_data
+
+def _generate_with_retry(model: genai.GenerativeModel, contents, description: str, **kwargs):
+    """
+    Calls model.generate_content, retrying when it fails with a rate-limit or transient server error.
+    Other errors, and the last failure, are raised.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return model.generate_content(contents, **kwargs)
+        except RETRYABLE_GEMINI_ERRORS as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = retry_delay(attempt)
+            print(f"    Gemini request for {description} failed ({type(e).__name__}); retrying in {delay:.1f}s.")
+            time.sleep(delay)
+
+def _extract_page_transactions(model: genai.GenerativeModel, prompt_text: str,
+                               page_images: List[tuple], base_name: str, candidate_count: int = 1) -> List[Transaction]:
+    """
+    Sends a batch of pages, given as (page_num, page_input) pairs from _get_page_input, to Gemini in
+    one request and returns the transactions extracted from them in page order. Rate-limit and server
+    errors are retried with backoff (_generate_with_retry). If a multi-page answer can't be parsed or
+    validated, the pages are retried one request each; a single page that still fails is retried once
+    more asking for HARD_PAGE_CANDIDATES candidates, keeping the best one.
+    Errors are reported and yield an empty list, so one failed page doesn't affect the rest of the PDF.
+    """
+    page_label = ", ".join(str(page_num + 1) for page_num, _ in page_images)
+    response = None
+    try:
+        contents = [prompt_text]
+        for page_num, page_input in page_images:
+            contents.append(f"PAGE {page_num + 1}:")
+            if isinstance(page_input, bytes):
+                contents.append({"mime_type": "image/png", "data": page_input})
+            else:
+                contents.append(page_input) # Text layer, sent as-is
+
+        # Send to Gemini
+        if candidate_count > 1:
+            # Several samples of the same input cost extra output tokens only, not another image upload
+            generation_config = genai.types.GenerationConfig(candidate_count=candidate_count, temperature=0.3)
+            response = _generate_with_retry(model, contents, f"page(s) {page_label} of {base_name}",
+                                            generation_config=generation_config)
+            parsed_data = _best_candidate(response, len(page_images))
+        else:
+            response = _generate_with_retry(model, contents, f"page(s) {page_label} of {base_name}")
+            parsed_data = _parse_pages_response(response.text, len(page_images))
+
+        page_transactions: List[Transaction] = []
+        for page_result in sorted(parsed_data.pages, key=lambda p: p.page):
+            print(f"    Extracted {len(page_result.transactions)} transactions from page {page_result.page}.")
+            page_transactions.extend(page_result.transactions)
+
+        for tx in page_transactions:
+            # Set split value based on description
+            if _ACHU_PATTERN.search(tx.description):
+                tx.is_split = 2
+            # Other fields (source_account, short_description, is_expense) are set later
+
+        return page_transactions
+    except (ValidationError, ValueError) as e: # Unusable answer: JSON decoding, validation, page count or blocked response
+        print(f"    Error extracting transactions from page(s) {page_label} of {base_name}: {e}")
+        if response is not None and candidate_count == 1:
+            try:
+                print(f"    Raw Gemini Response Text:\n{response.text[:500]}...")
+            except Exception:
+                pass # Response has no text (e.g., blocked); nothing more to show
+    except Exception as e: # API errors (after retries) aren't helped by sending more requests
+        print(f"    Error extracting transactions from page(s) {page_label} of {base_name}: {e}")
+        return []
+
+    if len(page_images) > 1:
+        print(f"    Retrying page(s) {page_label} of {base_name} one request per page.")
+        return [tx for page_image in page_images
+                for tx in _extract_page_transactions(model, prompt_text, [page_image], base_name)]
+    if candidate_count == 1 and HARD_PAGE_CANDIDATES > 1:
+        print(f"    Retrying page {page_label} of {base_name} with {HARD_PAGE_CANDIDATES} candidates.")
+        return _extract_page_transactions(model, prompt_text, page_images, base_name, candidate_count=HARD_PAGE_CANDIDATES)
+    return []
+
+# --- Account Name Mapping Cache ---
+
+_DIGITS_PATTERN = re.compile(r'\d+')
+_account_map_caches: Dict[str, Dict[str, str]] = {} # cache file -> {filename pattern: account name}, loaded on first use
+_account_map_lock = threading.Lock() # parse_pdfs runs on several threads at once
+
+def _account_map_key(filename: str) -> str:
+    """Builds the cache key for a filename: digit runs (dates, card digits) collapsed, so monthly statements share one entry."""
+    return _DIGITS_PATTERN.sub('#', filename).lower()
+
+def _load_account_map_cache(cache_file: str) -> Dict[str, str]:
+    """Loads the account name mapping cache from disk. Returns an empty cache if missing or unreadable."""
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, 'r') as f:
+            account_map = json.load(f)
+        print(f"Loaded {len(account_map)} cached account name mappings from {cache_file}")
+        return account_map
+    except (json.JSONDecodeError, IOError) as e:
+        print(f"Warning: Failed to load account name cache '{cache_file}': {e}. Starting with an empty cache.")
+        return {}
+
+def _save_account_map_cache(cache_file: str, account_map: Dict[str, str]) -> None:
+    """Writes the account name mapping cache to disk."""
+    try:
+        tmp_file = f"{cache_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(account_map, f, indent=2)
+        os.replace(tmp_file, cache_file) # Readers never see a half-written file
+    except (IOError, TypeError) as e:
+        print(f"Error saving account name cache '{cache_file}': {e}")
+
+def _get_account_name_cached(filename: str, allowed_names: List[str], model: genai.GenerativeModel, cache_file: str) -> str:
+    """
+    Returns the account name for a filename from the mapping cache, falling back to
+    _get_account_name_via_ai on a miss. Successful AI mappings are added to the cache.
+    """
+    key = _account_map_key(filename)
+    with _account_map_lock:
+        if cache_file not in _account_map_caches:
+            _account_map_caches[cache_file] = _load_account_map_cache(cache_file)
+        cached_name = _account_map_caches[cache_file].get(key)
+    if cached_name in allowed_names: # Ignore entries for accounts no longer configured
+        print(f"  Cached mapping: '{filename}' is '{cached_name}'")
+        return cached_name
+
+    account_name = _get_account_name_via_ai(filename, allowed_names, model)
+    if account_name in allowed_names: # Don't cache the fallback for failed or unmatched calls
+        with _account_map_lock:
+            account_map = _account_map_caches[cache_file]
+            account_map[key] = account_name
+            _save_account_map_cache(cache_file, account_map)
+    return account_name
+
 # --- Core Parsing Function ---
 
+def _process_one_pdf(pdf_info: dict, config: dict, model: genai.GenerativeModel, prompt_text: str) -> List[Transaction]:
+    """
+    Extracts the raw transactions of one PDF for parse_pdfs: opens it (trying the configured
+    passwords), determines its source account and sends its pages to Gemini.
+    Returns an empty list if the PDF can't be processed.
+    """
+    pdf_passwords = config.get('PDF_PASSWORDS', []) # Expecting a list from config
+    page_concurrency = config.get('PDF_PAGE_CONCURRENCY', DEFAULT_PAGE_CONCURRENCY) # Gemini requests in flight at once, per PDF
+    pages_per_request = max(1, config.get('PDF_PAGES_PER_REQUEST', DEFAULT_PAGES_PER_REQUEST)) # Pages per Gemini request
+    pdf_handling = config.get('PDF_HANDLING', 'vision') # 'vision', 'auto' or 'text'; see _get_page_input
+    # Filename -> account mappings from earlier runs are reused when AI result caching is on
+    account_cache_file = config.get('ACCOUNT_MAP_CACHE_FILE', 'account_map_cache.json') if config.get('AI_CACHE_ENABLED', False) else None
+
+    pdf_path = pdf_info['path']
+    pdf_subject = pdf_info.get('subject', '') # Get subject, default to empty string if missing
+    print(f"Processing PDF: {pdf_path} (Subject: '{pdf_subject}')...")
+    base_name = os.path.basename(pdf_path)
+
+    # Determine source_account using AI based on filename and configured account names
+    account_names = config.get('ACCOUNT_NAMES', [])
+    if not isinstance(account_names, list):
+        print(f"  Warning: ACCOUNT_NAMES in config is not a list. Found type: {type(account_names)}. Skipping AI mapping.")
+        account_names = [] # Ensure it's a list to avoid errors
+
+    # --- Combined Rule-based check for HDFC Savings ---
+    # Check 1: Filename pattern
+    filename_matches = _HDFC_SAVINGS_FILENAME_PATTERN.match(base_name) is not None
+    # Check 2: Subject keywords (case-insensitive)
+    subject_lower = pdf_subject.lower()
+    subject_matches = ("hdfc" in subject_lower and "statement" in subject_lower)
+
+    if HDFC_SAVINGS_ACCOUNT_NAME in account_names and filename_matches and subject_matches:
+        print(f"  Combined Rule matched: Identified '{base_name}' as '{HDFC_SAVINGS_ACCOUNT_NAME}' based on filename pattern AND subject keywords ('{pdf_subject}').")
+        account_future = None
+        source_account = HDFC_SAVINGS_ACCOUNT_NAME
+    else:
+        # Fallback to AI mapping if combined rule doesn't match or HDFC Savings isn't in config
+        print(f"  Combined rule not matched for '{base_name}' (Filename match: {filename_matches}, Subject match: {subject_matches}) or '{HDFC_SAVINGS_ACCOUNT_NAME}' not in config. Falling back to AI mapping.")
+        # The mapping call runs in the background while the PDF is opened, rendered and sent to Gemini
+        account_executor = ThreadPoolExecutor(max_workers=1)
+        if account_cache_file:
+            account_future = account_executor.submit(_get_account_name_cached, base_name, account_names, model, account_cache_file)
+        else:
+            account_future = account_executor.submit(_get_account_name_via_ai, base_name, account_names, model)
+        account_executor.shutdown(wait=False) # The thread exits once the mapping call returns
+    # The determined source_account will be assigned to transactions later
+
+    doc = None
+    opened_successfully = False
+    try:
+        # Open (and parse) the file once; passwords are then tried on the same document
+        try:
+            doc = fitz.open(pdf_path)
+        except Exception as e:
+            print(f"Error: Could not open {base_name}: {e}")
+            return [] # Skip to the next PDF
+
+        if not doc.needs_pass:
+            opened_successfully = True
+            print(f"Opened {base_name} without password.")
+        elif pdf_passwords:
+            for password in pdf_passwords:
+                try:
+                    if doc.authenticate(password):
+                        print(f"Successfully authenticated {base_name} with a password.")
+                        opened_successfully = True
+                        break # Exit password loop on success
+                except Exception as e:
+                    print(f"Error trying password for {base_name}: {e}")
+            if not opened_successfully:
+                 print(f"Warning: Could not open {base_name} with any of the provided passwords.")
+        else:
+             print(f"Warning: {base_name} requires a password, but no passwords were provided in config.")
+
+
+        if not doc or not opened_successfully:
+            return [] # Skip to the next PDF
+
+        # Pages are rendered here, one at a time (PyMuPDF documents aren't thread-safe), and every
+        # pages_per_request rendered pages go to Gemini in one request on a worker thread, so the
+        # API round-trips overlap
+        num_pages = len(doc)
+        page_futures = []
+        num_requests = -(-num_pages // pages_per_request)
+        request_workers = max(1, min(page_concurrency, num_requests))
+        # A batch slot is taken before rendering a batch and given back when its request finishes, so
+        # rendering stops one batch ahead of the busy workers instead of holding every page's PNG in memory
+        batch_slots = threading.BoundedSemaphore(request_workers + 1)
+
+        def _submit_batch(batch):
+            page_future = executor.submit(_extract_page_transactions, model, prompt_text, batch, base_name)
+            page_future.add_done_callback(lambda _: batch_slots.release())
+            page_futures.append(page_future)
+
+        with ThreadPoolExecutor(max_workers=request_workers) as executor:
+            page_images = []
+            slot_held = False
+            for page_num, page in enumerate(doc):
+                if not slot_held:
+                    batch_slots.acquire() # Waits while enough rendered batches are already queued
+                    slot_held = True
+                print(f"  Processing page {page_num + 1}/{num_pages}...")
+                try:
+                    page_images.append((page_num, _get_page_input(page, pdf_handling)))
+                except Exception as page_e:
+                    print(f"  Error processing page {page_num + 1} of {base_name}: {page_e}")
+                    continue
+                if len(page_images) == pages_per_request:
+                    _submit_batch(page_images)
+                    page_images = [] # The worker now holds the only reference to the rendered pages
+                    slot_held = False
+            if page_images: # Last, partial batch
+                _submit_batch(page_images)
+            elif slot_held:
+                batch_slots.release() # Slot taken for a batch whose pages all failed to render
+
+        # Collect in page order, whatever order the calls finished in
+        pdf_transactions: List[Transaction] = [] # Type hint uses imported Transaction
+        for page_future in page_futures:
+            pdf_transactions.extend(page_future.result())
+
+        # Add source account to each transaction
+        if account_future is not None:
+            source_account = account_future.result()
+        for tx in pdf_transactions:
+            tx.source_account = source_account
+
+        if not pdf_transactions:
+            print(f"No transactions extracted from {base_name} to add.")
+        return pdf_transactions
+
+    except Exception as e:
+        print(f"Error processing PDF file {base_name}: {e}")
+    finally:
+        if doc:
+            doc.close()
+    return []
+
+
+def _confirm_preview(base_name: str, pdf_transactions: List[Transaction]) -> bool:
+    """
+    Shows the raw transactions extracted from one PDF and asks whether to keep them.
+    Returns True to add them, False to skip the file; 'q' exits the script.
+    """
+    print("-" * 40)
+    print(f"PREVIEW: Raw Transactions extracted from: {base_name}")
+    print("-" * 40)
+    for i, tx in enumerate(pdf_transactions):
+        # Print raw extracted data + source account
+        print(f"  {i+1}. Date: {tx.date}, Desc: {tx.description}, Amount: {tx.amount}, Account: {tx.source_account}")
+    print("-" * 40)
+
+    while True:
+        user_input = input("Press Enter to ADD these raw transactions and continue, 's' to SKIP this file, 'q' to QUIT: ").lower().strip()
+        if user_input == '':
+            print(f"Adding raw transactions from {base_name}...")
+            add_transactions = True
+            break # Proceed to add
+        elif user_input == 's':
+            print(f"Skipping transactions from {base_name}...")
+            add_transactions = False
+            break # Skip adding
+        elif user_input == 'q':
+            print("Quitting script as requested.")
+            sys.exit(0) # Exit gracefully
+        else:
+            print("Invalid input. Please press Enter, 's', or 'q'.")
+    print("-" * 40)
+    return add_transactions
+
+
 def parse_pdfs(pdf_info_list: List[dict], config: dict, credentials, preview_mode: bool = False) -> List[Transaction]: # Type hint uses imported Transaction
     """
     Parses multiple PDF files using screenshots and Gemini Vision API
     to extract raw transaction data (date, description, amount) and adds the
     source_account based on filename and email subject rules. Does NOT determine is_expense or short_description.
+    Up to PDF_CONCURRENCY PDFs are processed at once; results keep the input order.
 
     Args:
         pdf_info_list (list): A list of dictionaries, where each dictionary contains
@@ -121,7 +532,8 @@ def parse_pdfs(pdf_info_list: List[dict], config: dict, credentials, preview_mod
                               Example: [{'path': '/path/to/file.pdf', 'subject': 'Your Statement'}]
         config (dict): The loaded application configuration, including 'PDF_PASSWORDS' and 'ACCOUNT_NAMES'.
         credentials: OAuth 2.0 credentials object for Google API authentication.
-        preview_mode (bool): If True, enables interactive preview after each PDF.
+        preview_mode (bool): If True, enables an interactive preview of each PDF's transactions
+                             once all PDFs have been processed.
 
     Returns:
         list: A list of Pydantic Transaction objects containing raw extracted data
@@ -129,7 +541,6 @@ def parse_pdfs(pdf_info_list: List[dict], config: dict, credentials, preview_mod
               Fields like is_expense, short_description, is_split will be None.
     """
     all_transactions: List[Transaction] = [] # Type hint uses imported Transaction
-    pdf_passwords = config.get('PDF_PASSWORDS', []) # Expecting a list from config
 
     # Note: Gemini API key logic removed. Authentication relies on provided credentials (ADC).
     try:
@@ -142,185 +553,27 @@ def parse_pdfs(pdf_info_list: List[dict], config: dict, credentials, preview_mod
         print(f"Error configuring Gemini client: {e}")
         return []
 
-    # Get the Pydantic model schema as a string to include in the prompt
-    # We pass the full schema, but instruct Gemini to only extract specific fields
-    # Need to generate schema from the imported Transaction model now
-    try:
-        transaction_schema = Transaction.model_json_schema() # Use imported Transaction schema
-        prompt_text = get_gemini_prompt(json.dumps(transaction_schema, indent=2))
-    except Exception as e:
-        print(f"Error generating Transaction schema or prompt: {e}")
-        return [] # Cannot proceed without a valid prompt
-
-    for pdf_info in pdf_info_list:
-        pdf_path = pdf_info['path']
-        pdf_subject = pdf_info.get('subject', '') # Get subject, default to empty string if missing
-        print(f"Processing PDF: {pdf_path} (Subject: '{pdf_subject}')...")
-        base_name = os.path.basename(pdf_path)
-
-        # Determine source_account using AI based on filename and configured account names
-        account_names = config.get('ACCOUNT_NAMES', [])
-        if not isinstance(account_names, list):
-            print(f"  Warning: ACCOUNT_NAMES in config is not a list. Found type: {type(account_names)}. Skipping AI mapping.")
-            account_names = [] # Ensure it's a list to avoid errors
-
-        # --- Rule-based check for HDFC Savings filename pattern ---
-        hdfc_savings_account_name = "HDFC Savings" # From config.py
-        # Pattern: Anything_DDMMYYYY_Anything.pdf (case-sensitive extension)
-        hdfc_pattern = r'^.+_\d{8}_.+\.pdf$'
-
-        # --- Combined Rule-based check for HDFC Savings ---
-        # Check 1: Filename pattern
-        filename_matches = re.match(hdfc_pattern, base_name) is not None
-        # Check 2: Subject keywords (case-insensitive)
-        subject_matches = ("hdfc" in pdf_subject.lower() and "statement" in pdf_subject.lower())
-
-        if hdfc_savings_account_name in account_names and filename_matches and subject_matches:
-            print(f"  Combined Rule matched: Identified '{base_name}' as '{hdfc_savings_account_name}' based on filename pattern AND subject keywords ('{pdf_subject}').")
-            source_account = hdfc_savings_account_name
-        else:
-            # Fallback to AI mapping if combined rule doesn't match or HDFC Savings isn't in config
-            print(f"  Combined rule not matched for '{base_name}' (Filename match: {filename_matches}, Subject match: {subject_matches}) or '{hdfc_savings_account_name}' not in config. Falling back to AI mapping.")
-            source_account = _get_account_name_via_ai(base_name, account_names, model)
-        # The determined source_account will be assigned to transactions later
+    prompt_text = GEMINI_PROMPT # Identical for every PDF and page
 
-        doc = None
-        opened_successfully = False
-        try:
-            # Try opening without password first
-            try:
-                doc = fitz.open(pdf_path)
-                if doc.needs_pass:
-                    doc.close() # Close if password needed but not provided yet
-                    doc = None
-                else:
-                    opened_successfully = True
-                    print(f"Opened {base_name} without password.")
-            except Exception as e:
-                 print(f"Could not open {base_name} without password, will try provided passwords. Error: {e}")
-
-
-            # If not opened, try passwords
-            if not opened_successfully and pdf_passwords:
-                for password in pdf_passwords:
-                    try:
-                        doc = fitz.open(pdf_path)
-                        if doc.authenticate(password):
-                            print(f"Successfully authenticated {base_name} with a password.")
-                            opened_successfully = True
-                            break # Exit password loop on success
-                        else:
-                             doc.close() # Close if auth failed
-                             doc = None
-                    except Exception as e:
-                        print(f"Error trying password for {base_name}: {e}")
-                        if doc: doc.close()
-                        doc = None
-                if not opened_successfully:
-                     print(f"Warning: Could not open {base_name} with any of the provided passwords.")
-
-            elif not opened_successfully and not pdf_passwords:
-                 print(f"Warning: {base_name} requires a password, but no passwords were provided in config.")
-
-
-            if not doc or not opened_successfully:
-                continue # Skip to the next PDF
-
-            pdf_transactions: List[Transaction] = [] # Type hint uses imported Transaction
-            for page_num, page in enumerate(doc):
-                print(f"  Processing page {page_num + 1}/{len(doc)}...")
-                try:
-                    image_bytes = render_page_to_image_bytes(page)
-                    image_part = {"mime_type": "image/png", "data": image_bytes}
-
-                    # Send to Gemini
-                    response = model.generate_content([prompt_text, image_part])
-
-                    # Clean potential markdown formatting if Gemini didn't follow instructions perfectly
-                    response_text = response.text.strip()
-                    if response_text.startswith("```json"):
-                        response_text = response_text[7:]
-                    if response_text.endswith("```"):
-                        response_text = response_text[:-3]
-                    response_text = response_text.strip()
-
-                    # Parse and validate with Pydantic
-                    try:
-                        # Gemini now returns date, description, amount, and transaction_type per the prompt.
-                        # We validate against TransactionList, which expects Transaction objects.
-                        # Pydantic will initialize Transaction objects using the data provided by Gemini,
-                        # leaving other fields (like short_description, category) as None initially.
-                        # Use imported TransactionList here
-                        parsed_data = TransactionList.model_validate_json(response_text)
-                        page_transactions = parsed_data.transactions
-                        print(f"    Extracted {len(page_transactions)} transactions from page {page_num + 1}.")
-
-                        # Add source account to each transaction
-                        for tx in page_transactions:
-                            tx.source_account = source_account
-                            # Set split value based on description
-                            if 'achu' in tx.description.lower():
-                                tx.is_split = 2
-                            # Other fields (short_description, is_expense) remain None
-
-                        pdf_transactions.extend(page_transactions)
-                    # Removed ValidationError import, so cannot catch it specifically. Catching general Exception instead.
-                    # except ValidationError as ve:
-                    #     print(f"    Error validating Gemini response for page {page_num + 1}: {ve}")
-                    #     print(f"    Raw Gemini Response Text:\n{response.text[:500]}...") # Log part of the raw response
-                    except json.JSONDecodeError as je:
-                         print(f"    Error decoding JSON from Gemini response for page {page_num + 1}: {je}")
-                         print(f"    Raw Gemini Response Text:\n{response.text[:500]}...")
-                    except Exception as parse_e: # Catch broader exceptions during parsing/validation
-                         print(f"    Unexpected error parsing/validating response for page {page_num + 1}: {parse_e}")
-                         print(f"    Raw Gemini Response Text:\n{response.text[:500]}...")
-
-
-                except Exception as page_e:
-                    print(f"  Error processing page {page_num + 1} of {base_name}: {page_e}")
-
-            # --- Preview Mode Logic ---
-            add_transactions_to_main_list = True # Default to adding
-            if preview_mode and pdf_transactions:
-                print("-" * 40)
-                print(f"PREVIEW: Raw Transactions extracted from: {base_name}")
-                print("-" * 40)
-                for i, tx in enumerate(pdf_transactions):
-                    # Print raw extracted data + source account
-                    print(f"  {i+1}. Date: {tx.date}, Desc: {tx.description}, Amount: {tx.amount}, Account: {tx.source_account}")
-                print("-" * 40)
-
-                while True:
-                    user_input = input("Press Enter to ADD these raw transactions and continue, 's' to SKIP this file, 'q' to QUIT: ").lower().strip()
-                    if user_input == '':
-                        print(f"Adding raw transactions from {base_name}...")
-                        break # Proceed to add
-                    elif user_input == 's':
-                        print(f"Skipping transactions from {base_name}...")
-                        add_transactions_to_main_list = False
-                        break # Skip adding
-                    elif user_input == 'q':
-                        print("Quitting script as requested.")
-                        sys.exit(0) # Exit gracefully
-                    else:
-                        print("Invalid input. Please press Enter, 's', or 'q'.")
-                print("-" * 40)
-            # --- End Preview Mode Logic ---
-
-            # Add the extracted (raw) transactions to the main list if not skipped
-            if add_transactions_to_main_list:
-                if pdf_transactions:
-                    print(f"Adding {len(pdf_transactions)} raw transactions from {base_name} to the main list.")
-                    all_transactions.extend(pdf_transactions)
-                else:
-                    print(f"No transactions extracted from {base_name} to add.")
-            # If add_transactions_to_main_list is False (due to 's' in preview), this block is skipped.
-
-        except Exception as e:
-            print(f"Error processing PDF file {base_name}: {e}")
-        finally:
-            if doc:
-                doc.close()
+    # PDFs are independent, so several are processed at once. In preview mode the prompts wait until
+    # every PDF has been extracted, so answering them never holds up the Gemini requests.
+    pdf_concurrency = max(1, min(config.get('PDF_CONCURRENCY', DEFAULT_PDF_CONCURRENCY), len(pdf_info_list)))
+    process_pdf = functools.partial(_process_one_pdf, config=config, model=model, prompt_text=prompt_text)
+    if pdf_concurrency == 1:
+        pdf_results = [process_pdf(pdf_info) for pdf_info in pdf_info_list]
+    else:
+        with ThreadPoolExecutor(max_workers=pdf_concurrency) as executor:
+            pdf_results = list(executor.map(process_pdf, pdf_info_list)) # Results in input order
+
+    for pdf_info, pdf_transactions in zip(pdf_info_list, pdf_results):
+        if not pdf_transactions:
+            continue
+        base_name = os.path.basename(pdf_info['path'])
+        # --- Preview Mode Logic ---
+        if preview_mode and not _confirm_preview(base_name, pdf_transactions):
+            continue # Skipped ('s' in preview)
+        print(f"Adding {len(pdf_transactions)} raw transactions from {base_name} to the main list.")
+        all_transactions.extend(pdf_transactions)
 
     print(f"Finished processing PDFs. Total raw transactions extracted: {len(all_transactions)}")
     return all_transactions
@@ -0,0 +1,16 @@
+"""
+Shared backoff policy for the Google API calls (Gmail, Sheets, Gemini).
+Each caller decides which errors are retryable; this module only says how often and how long to wait.
+"""
+
+import random
+
+# Rate-limit and transient server errors are retried with exponential backoff
+MAX_RETRIES = 5
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+def retry_delay(attempt, retry_after=None):
+    """Seconds to wait before retry number `attempt` (0-based), honouring a Retry-After header."""
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return min(2 ** attempt, 32) + random.random()
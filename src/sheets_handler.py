@@ -4,12 +4,20 @@ import gspread
 import gspread.utils # Ensure utils is imported
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.model import JsonModel
+import numpy as np
+import orjson # Fast JSON encoding for the Sheets request bodies
 import pandas as pd
 import datetime
 import logging
 import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
 from typing import List, Optional
 from models import Category # Added import
+from retries import MAX_RETRIES, RETRYABLE_STATUSES, retry_delay # Shared backoff policy
 # Assuming Transaction model is defined in pdf_parser
 try:
     from pdf_parser import Transaction
@@ -20,6 +28,10 @@ except ImportError:
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Transaction fields the sheets are built from
+TRANSACTION_COLUMNS = ['date', 'is_expense', 'category', 'short_description', 'description', 'amount', 'is_split', 'source_account', 'transaction_type']
 
 # Define scopes required for Google Sheets and Drive APIs
 SCOPES = [
@@ -27,6 +39,67 @@ SCOPES = [
     'https://www.googleapis.com/auth/drive'
 ]
 
+# Subrequests sent per spreadsheets().batchUpdate call when applying freezes, formulas and validation
+BATCH_UPDATE_MAX_REQUESTS = 500
+# Largest JSON body sent in one write request; bigger writes are split so one oversized request can't fail them all
+MAX_BATCH_BYTES = 1_800_000
+
+def _split_rows_by_size(rows, max_bytes):
+    """Splits rows into consecutive blocks whose JSON encoding is roughly at most max_bytes each."""
+    encoded_size = len(orjson.dumps(rows))
+    if encoded_size <= max_bytes:
+        return [rows]
+    rows_per_block = max(1, len(rows) * max_bytes // encoded_size) # From the average encoded row size
+    return [rows[i:i + rows_per_block] for i in range(0, len(rows), rows_per_block)]
+
+def _pack_by_size(items, max_bytes, max_items=None):
+    """Groups consecutive items so each group's JSON encoding stays under max_bytes (and under max_items items)."""
+    groups, group, group_bytes = [], [], 0
+    for item in items:
+        item_bytes = len(orjson.dumps(item))
+        if group and (group_bytes + item_bytes > max_bytes or (max_items and len(group) >= max_items)):
+            groups.append(group)
+            group, group_bytes = [], 0
+        group.append(item) # An item bigger than max_bytes still gets a group of its own
+        group_bytes += item_bytes
+    if group:
+        groups.append(group)
+    return groups
+
+# Rate-limit (write quota) and transient server errors on the sheet writes are retried with exponential backoff (see retries.py)
+def _call_with_retry(call, description):
+    """
+    Calls `call()` (e.g. a googleapiclient request's execute, or a gspread batch_update), retrying
+    when it fails with a rate-limit or transient server error. Other errors, and the last failure, are raised.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return call()
+        except (HttpError, gspread.exceptions.APIError) as error:
+            if isinstance(error, HttpError):
+                status, retry_after = error.resp.status, error.resp.get('retry-after')
+            else:
+                status, retry_after = error.response.status_code, error.response.headers.get('Retry-After')
+            if status not in RETRYABLE_STATUSES or attempt == MAX_RETRIES:
+                raise
+            delay = retry_delay(attempt, retry_after)
+            logger.warning(f"{description} returned {status}; retrying in {delay:.1f}s.")
+            time.sleep(delay)
+
+# Formats parse_date_flexible accepts, in the order they're tried
+DATE_FORMATS = ['%d/%m/%Y', '%d-%b-%y', '%d/%m/%Y %H:%M:%S'] # Added datetime format
+# Recognises the usual shapes of DATE_FORMATS in one fullmatch, so the common cases skip the strptime cascade.
+# ASCII digits only, and four-digit years from 1000 on, which strftime('%Y') writes back unchanged;
+# anything else (trailing newline, other scripts' digits, year 0099) takes the strptime path as before.
+_DATE_DISPATCH_PATTERN = re.compile(
+    r'(?P<dmy>(?P<day>\d{2})/(?P<month>\d{2})/(?P<year>[1-9]\d{3}))(?: (?:[01]\d|2[0-3]):[0-5]\d:[0-5]\d)?'
+    r'|(?P<short_day>\d{1,2})-(?P<month_abbr>[A-Za-z]{3})-(?P<short_year>\d{2})',
+    re.ASCII,
+)
+# Month abbreviations as strptime's %b reads them (case-insensitively)
+_MONTH_NUMBERS = {abbr: number for number, abbr in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], start=1)}
+
 def parse_date_flexible(date_input):
     """
     Parses a date string from multiple formats ('%d/%m/%Y', '%d-%b-%y')
@@ -34,29 +107,63 @@ def parse_date_flexible(date_input):
     Returns an empty string if parsing fails or input is invalid.
     """
     if not isinstance(date_input, str) or not date_input:
-        # logging.debug(f"Invalid date input type or empty: {date_input}") # Optional debug log
+        # logger.debug(f"Invalid date input type or empty: {date_input}") # Optional debug log
         return '' # Handle None, empty strings, or non-string types
 
-    formats_to_try = ['%d/%m/%Y', '%d-%b-%y', '%d/%m/%Y %H:%M:%S'] # Added datetime format
-    parsed_date = None
-
-    for fmt in formats_to_try:
+    match = _DATE_DISPATCH_PATTERN.fullmatch(date_input)
+    if match:
         try:
-            # Attempt to parse the date string with the current format
-            parsed_date = datetime.datetime.strptime(date_input, fmt)
-            # If parsing is successful, break the loop
-            break
+            if match.group('dmy'):
+                # Already DD/MM/YYYY; only check that it's a real date
+                datetime.date(int(match.group('year')), int(match.group('month')), int(match.group('day')))
+                return match.group('dmy')
+            # D-Mon-YY, assembled from the groups; %y puts 69-99 in the 1900s and 00-68 in the 2000s
+            month = _MONTH_NUMBERS.get(match.group('month_abbr').lower())
+            if month:
+                short_year = int(match.group('short_year'))
+                year = short_year + (1900 if short_year >= 69 else 2000)
+                day = int(match.group('short_day'))
+                datetime.date(year, month, day)
+                return f"{day:02d}/{month:02d}/{year}"
         except ValueError:
-            # If parsing fails, continue to the next format
-            continue
+            pass # E.g. 31/02/2024; no other format can match either, but keep the warning below
 
-    if parsed_date:
-        # If a date was successfully parsed, format it to DD/MM/YYYY
-        return parsed_date.strftime('%d/%m/%Y')
     else:
-        # If no format matched, log a warning and return an empty string
-        logging.warning(f"Could not parse date string '{date_input}' using formats {formats_to_try}. Writing empty string.")
-        return ''
+        # Less common spellings (e.g. single-digit day or month) still go through each format
+        for fmt in DATE_FORMATS:
+            try:
+                # Attempt to parse the date string with the current format
+                # If a date was successfully parsed, format it to DD/MM/YYYY
+                return datetime.datetime.strptime(date_input, fmt).strftime('%d/%m/%Y')
+            except ValueError:
+                # If parsing fails, continue to the next format
+                continue
+
+    # If no format matched, log a warning and return an empty string
+    logger.warning("Could not parse date string '%s' using formats %s. Writing empty string.", date_input, DATE_FORMATS)
+    return ''
+
+def format_date_column(dates: pd.Series) -> pd.Series:
+    """
+    Column version of parse_date_flexible: parses each of DATE_FORMATS over the whole column at once
+    (instead of calling parse_date_flexible per row) and returns 'DD/MM/YYYY' strings,
+    with an empty string wherever no format matched.
+    Must give the same result as parse_date_flexible for every value, since resumed runs
+    (main._normalize_checkpoint_date) go through parse_date_flexible; change both together.
+    One known gap: years outside pandas' Timestamp range (1677-2262) come out empty here.
+    """
+    text = dates.where(dates.map(type) == str) # Non-strings can't be parsed, as in parse_date_flexible
+    parsed = pd.to_datetime(text, format=DATE_FORMATS[0], errors='coerce')
+    for fmt in DATE_FORMATS[1:]:
+        missing = parsed.isna() & text.notna()
+        if not missing.any():
+            break
+        parsed = parsed.fillna(pd.to_datetime(text[missing], format=fmt, errors='coerce'))
+
+    unparsed_count = int((parsed.isna() & text.fillna('').astype(bool)).sum())
+    if unparsed_count:
+        logger.warning("Could not parse %d date strings using formats %s. Writing empty strings.", unparsed_count, DATE_FORMATS)
+    return parsed.dt.strftime('%d/%m/%Y').fillna('')
 
 def _get_drive_service(creds):
     """Builds and returns a Google Drive API service client."""
@@ -64,53 +171,91 @@ def _get_drive_service(creds):
         service = build('drive', 'v3', credentials=creds)
         return service
     except HttpError as error:
-        logging.error(f"An error occurred building Drive service: {error}")
+        logger.error(f"An error occurred building Drive service: {error}")
         raise
     except Exception as e:
-        logging.error(f"An unexpected error occurred building Drive service: {e}")
+        logger.error(f"An unexpected error occurred building Drive service: {e}")
         raise
 
+class _OrjsonModel(JsonModel):
+    """JsonModel that encodes request bodies with orjson; the values write carries every row of the month."""
+    def serialize(self, body_value):
+        if isinstance(body_value, dict) and "data" not in body_value and self._data_wrapper:
+            body_value = {"data": body_value}
+        return orjson.dumps(body_value).decode('utf-8')
+
+# gspread client and API services already built in this process, keyed by id(credentials). The
+# credentials object is kept in the entry, which keeps its id from being reused by another object.
+_SERVICE_CACHE = {}
+
+def _get_google_clients(credentials):
+    """
+    Returns (gc, drive_service, sheets_service) for the credentials, building them only the first
+    time a given credentials object is seen; build() has to load and parse each API's discovery document.
+    """
+    cached = _SERVICE_CACHE.get(id(credentials))
+    if cached is not None and cached[0] is credentials:
+        return cached[1:]
+    gc = gspread.authorize(credentials)
+    drive_service = _get_drive_service(credentials)
+    sheets_service = build('sheets', 'v4', credentials=credentials, model=_OrjsonModel())
+    _SERVICE_CACHE[id(credentials)] = (credentials, gc, drive_service, sheets_service)
+    return gc, drive_service, sheets_service
+
+# Drive IDs already looked up in this process, keyed by (parent folder ID, name, kind), where kind
+# is 'file' or 'folder'. Only found or created IDs are kept, so a miss is always re-checked.
+_DRIVE_ID_CACHE = {}
+
 def _find_file_in_folder(service, folder_id, file_name):
     """Finds a file by name within a specific Google Drive folder."""
+    cache_key = (folder_id, file_name, 'file')
+    if cache_key in _DRIVE_ID_CACHE:
+        logger.info(f"Using cached ID for file '{file_name}': {_DRIVE_ID_CACHE[cache_key]}")
+        return _DRIVE_ID_CACHE[cache_key]
     try:
         query = f"name='{file_name}' and '{folder_id}' in parents and trashed=false"
         response = service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
         files = response.get('files', [])
         if files:
-            logging.info(f"Found existing file '{file_name}' with ID: {files[0]['id']}")
+            logger.info(f"Found existing file '{file_name}' with ID: {files[0]['id']}")
+            _DRIVE_ID_CACHE[cache_key] = files[0]['id']
             return files[0]['id']
         else:
-            logging.info(f"File '{file_name}' not found in folder ID '{folder_id}'.")
+            logger.info(f"File '{file_name}' not found in folder ID '{folder_id}'.")
             return None
     except HttpError as error:
-        logging.error(f"An error occurred searching for file '{file_name}': {error}")
+        logger.error(f"An error occurred searching for file '{file_name}': {error}")
         # Don't raise here, allow creation flow
         return None
     except Exception as e:
-        logging.error(f"An unexpected error occurred searching for file '{file_name}': {e}")
+        logger.error(f"An unexpected error occurred searching for file '{file_name}': {e}")
         return None
 
 
 # Removed _copy_template function as we are creating sheets programmatically
-def _create_blank_spreadsheet(gc, sheet_name):
-    """Creates a new blank Google Spreadsheet."""
+def _create_blank_spreadsheet(gc, sheet_name, folder_id=None):
+    """Creates a new blank Google Spreadsheet, directly inside folder_id if given."""
     try:
-        logging.info(f"Creating a new blank spreadsheet named '{sheet_name}'")
-        spreadsheet = gc.create(sheet_name)
+        logger.info(f"Creating a new blank spreadsheet named '{sheet_name}'")
+        spreadsheet = gc.create(sheet_name, folder_id=folder_id) # One Drive files.create with the folder as parent
         # Share with the user or keep private based on service account?
         # For now, it's owned by the service account. User needs to add sharing if needed.
-        logging.info(f"Blank spreadsheet created with ID: {spreadsheet.id}")
+        logger.info(f"Blank spreadsheet created with ID: {spreadsheet.id}")
         return spreadsheet
     except gspread.exceptions.APIError as error:
-        logging.error(f"An error occurred creating blank sheet '{sheet_name}': {error}")
+        logger.error(f"An error occurred creating blank sheet '{sheet_name}': {error}")
         raise
     except Exception as e:
-        logging.error(f"An unexpected error occurred creating blank sheet '{sheet_name}': {e}")
+        logger.error(f"An unexpected error occurred creating blank sheet '{sheet_name}': {e}")
         raise
 
 
 def _find_or_create_folder(service, parent_folder_id, folder_name):
     """Finds a folder by name within a parent folder, or creates it if not found."""
+    cache_key = (parent_folder_id, folder_name, 'folder')
+    if cache_key in _DRIVE_ID_CACHE:
+        logger.info(f"Using cached ID for year folder '{folder_name}': {_DRIVE_ID_CACHE[cache_key]}")
+        return _DRIVE_ID_CACHE[cache_key]
     folder_id = None
     try:
         # Search for the folder
@@ -125,10 +270,10 @@ def _find_or_create_folder(service, parent_folder_id, folder_name):
 
         if folders:
             folder_id = folders[0]['id']
-            logging.info(f"Found existing year folder '{folder_name}' with ID: {folder_id}")
+            logger.info(f"Found existing year folder '{folder_name}' with ID: {folder_id}")
         else:
             # Create the folder if not found
-            logging.info(f"Year folder '{folder_name}' not found in parent '{parent_folder_id}'. Creating...")
+            logger.info(f"Year folder '{folder_name}' not found in parent '{parent_folder_id}'. Creating...")
             file_metadata = {
                 'name': folder_name,
                 'mimeType': 'application/vnd.google-apps.folder',
@@ -137,20 +282,127 @@ def _find_or_create_folder(service, parent_folder_id, folder_name):
             created_folder = service.files().create(body=file_metadata, fields='id').execute()
             folder_id = created_folder.get('id')
             if folder_id:
-                logging.info(f"Created year folder '{folder_name}' with ID: {folder_id}")
+                logger.info(f"Created year folder '{folder_name}' with ID: {folder_id}")
             else:
-                logging.error(f"Failed to create year folder '{folder_name}' - no ID returned.")
+                logger.error(f"Failed to create year folder '{folder_name}' - no ID returned.")
                 # folder_id remains None
 
     except HttpError as error:
-        logging.error(f"An error occurred finding/creating folder '{folder_name}' in '{parent_folder_id}': {error}")
+        logger.error(f"An error occurred finding/creating folder '{folder_name}' in '{parent_folder_id}': {error}")
         # folder_id remains None
     except Exception as e:
-        logging.error(f"An unexpected error occurred finding/creating folder '{folder_name}': {e}")
+        logger.error(f"An unexpected error occurred finding/creating folder '{folder_name}': {e}")
         # folder_id remains None
 
+    if folder_id:
+        _DRIVE_ID_CACHE[cache_key] = folder_id
     return folder_id
 
+def _find_folder_and_file(service, parent_folder_id, folder_name, file_name):
+    """
+    Finds the folder folder_name in parent_folder_id (creating it if needed) and the file file_name
+    inside it. Both lookups go out in one Drive HTTP batch request: the file is listed by name with
+    its parents and matched against the folder locally, since its folder ID isn't known yet.
+
+    Returns:
+        tuple: (folder_id, file_id); folder_id is None if the folder couldn't be found or created,
+               file_id is None if there's no such file in it.
+    """
+    folder_key = (parent_folder_id, folder_name, 'folder')
+    if folder_key in _DRIVE_ID_CACHE:
+        folder_id = _find_or_create_folder(service, parent_folder_id, folder_name) # Cached, no request
+        return folder_id, _find_file_in_folder(service, folder_id, file_name)
+
+    results = {}
+    def _on_response(request_id, response, exception):
+        # Errors are reported here; a lookup missing from results falls back to its own request below
+        if exception is None:
+            results[request_id] = response.get('files', [])
+        else:
+            logger.error(f"An error occurred in the batched Drive lookup for the {request_id}: {exception}")
+
+    folder_query = (f"mimeType='application/vnd.google-apps.folder' and "
+                    f"name='{folder_name}' and "
+                    f"'{parent_folder_id}' in parents and "
+                    f"trashed=false")
+    file_query = f"name='{file_name}' and trashed=false"
+    try:
+        batch = service.new_batch_http_request(callback=_on_response)
+        batch.add(service.files().list(q=folder_query, spaces='drive', fields='files(id, name)'), request_id='folder')
+        batch.add(service.files().list(q=file_query, spaces='drive', fields='files(id, name, parents)'), request_id='file')
+        batch.execute()
+    except Exception as e:
+        logger.error(f"An unexpected error occurred in the batched Drive lookup: {e}")
+
+    folders = results.get('folder')
+    if not folders:
+        # Not found (it's created there) or the lookup failed
+        folder_id = _find_or_create_folder(service, parent_folder_id, folder_name)
+        if not folder_id or folders is not None:
+            return folder_id, None # A new folder has no files in it yet
+        return folder_id, _find_file_in_folder(service, folder_id, file_name)
+
+    folder_id = folders[0]['id']
+    logger.info(f"Found existing year folder '{folder_name}' with ID: {folder_id}")
+    _DRIVE_ID_CACHE[folder_key] = folder_id
+    if 'file' not in results:
+        return folder_id, _find_file_in_folder(service, folder_id, file_name)
+
+    for file_info in results['file']:
+        if folder_id in file_info.get('parents', []):
+            logger.info(f"Found existing file '{file_name}' with ID: {file_info['id']}")
+            _DRIVE_ID_CACHE[(folder_id, file_name, 'file')] = file_info['id']
+            return folder_id, file_info['id']
+    logger.info(f"File '{file_name}' not found in folder ID '{folder_id}'.")
+    return folder_id, None
+
+def _open_or_create_month_spreadsheet(gc, drive_service, main_budget_folder_id, year_str, sheet_name):
+    """
+    Finds or creates the year subfolder, then opens the month's spreadsheet in it, creating a blank
+    one if it doesn't exist yet. Returns the gspread Spreadsheet, or None if either step failed.
+    """
+    # --- Find or Create Year Subfolder ---
+    logger.info(f"Checking for year subfolder '{year_str}' in main budget folder '{main_budget_folder_id}'...")
+    # The sheet is looked up in the same Drive request as the folder
+    year_folder_id, sheet_id = _find_folder_and_file(drive_service, main_budget_folder_id, year_str, sheet_name)
+
+    if not year_folder_id:
+        logger.error(f"Could not find or create the year subfolder '{year_str}'. Cannot proceed.")
+        return None # Critical failure if we can't get the target folder
+
+    logger.info(f"Using year subfolder ID: {year_folder_id}")
+
+    # --- Find Existing Sheet or Copy Template/Create New within Year Folder ---
+    spreadsheet = None
+
+    if sheet_id:
+        try:
+            spreadsheet = gc.open_by_key(sheet_id)
+            logger.info(f"Opened existing spreadsheet '{sheet_name}' (ID: {sheet_id}) in folder '{year_folder_id}'")
+        except gspread.exceptions.SpreadsheetNotFound:
+            logger.warning(f"Found sheet ID {sheet_id} via Drive API but gspread couldn't open it. Attempting copy/create.")
+            _DRIVE_ID_CACHE.pop((year_folder_id, sheet_name, 'file'), None) # Stale; look it up again next time
+            sheet_id = None # Reset ID so we try to create below
+        except gspread.exceptions.APIError as e:
+            logger.error(f"API error opening existing sheet ID {sheet_id}: {e}")
+            return None # Cannot proceed
+        except Exception as e:
+            logger.error(f"Unexpected error opening existing sheet ID {sheet_id}: {e}")
+            return None # Cannot proceed
+
+    if not spreadsheet:
+        # If sheet wasn't found, create a new blank one
+        logger.info(f"Spreadsheet '{sheet_name}' not found. Creating a new blank spreadsheet.")
+        try:
+            # Create the blank sheet straight in the target YEAR folder, so there's nothing to move afterwards
+            spreadsheet = _create_blank_spreadsheet(gc, sheet_name, folder_id=year_folder_id)
+            logger.info(f"Created new blank sheet '{sheet_name}' (ID: {spreadsheet.id}) in year folder ID '{year_folder_id}'")
+            _DRIVE_ID_CACHE[(year_folder_id, sheet_name, 'file')] = spreadsheet.id
+        except Exception as e:
+            logger.error(f"Failed to create blank spreadsheet '{sheet_name}': {e}")
+            return None
+    return spreadsheet
+
 # Removed _add_required_sheets function, sheet management handled in main function
 def update_google_sheet(all_transactions: List[Transaction], config: dict, credentials) -> Optional[str]:
     """
@@ -173,7 +425,7 @@ def update_google_sheet(all_transactions: List[Transaction], config: dict, crede
         ValueError: If required configuration keys are missing.
         Exception: For errors during API interaction or processing.
     """
-    logging.info("Starting Google Sheet update process...")
+    logger.info("Starting Google Sheet update process...")
 
     main_budget_folder_id = config.get('GOOGLE_DRIVE_BUDGET_FOLDER_ID')
     # template_id = config.get('GOOGLE_SHEETS_TEMPLATE_ID') # Removed template dependency
@@ -183,17 +435,14 @@ def update_google_sheet(all_transactions: List[Transaction], config: dict, crede
 
     # --- Authentication ---
     try:
-        # Use the passed OAuth credentials
-        gc = gspread.authorize(credentials)
-        # Build Drive and Sheets API services
-        drive_service = _get_drive_service(credentials)
-        sheets_service = build('sheets', 'v4', credentials=credentials)
-        logging.info("Google Drive and Sheets API authentication successful.")
+        # Use the passed OAuth credentials to get the gspread client and the Drive and Sheets API services
+        gc, drive_service, sheets_service = _get_google_clients(credentials)
+        logger.info("Google Drive and Sheets API authentication successful.")
     except FileNotFoundError as e:
-        logging.error(f"Credentials file error: {e}")
+        logger.error(f"Credentials file error: {e}")
         raise # Propagate critical error
     except Exception as e:
-        logging.error(f"Failed to authenticate with Google APIs: {e}")
+        logger.error(f"Failed to authenticate with Google APIs: {e}")
         return None # Or raise depending on desired main script behavior
 
     # --- Determine Target Year, Month, and Sheet Name ---
@@ -206,82 +455,33 @@ def update_google_sheet(all_transactions: List[Transaction], config: dict, crede
     month_num_str = last_day_of_previous_month.strftime("%m") # Get month number (01, 02, ...)
     # Use the required naming convention: Accounts-YYYY-MonthName
     sheet_name = f"Accounts-{year_str}-{month_name}"
-    logging.info(f"Target sheet name: '{sheet_name}' for year {year_str}, month {month_name}")
+    logger.info(f"Target sheet name: '{sheet_name}' for year {year_str}, month {month_name}")
 
-    # --- Find or Create Year Subfolder ---
-    logging.info(f"Checking for year subfolder '{year_str}' in main budget folder '{main_budget_folder_id}'...")
-    year_folder_id = _find_or_create_folder(drive_service, main_budget_folder_id, year_str)
-
-    if not year_folder_id:
-        logging.error(f"Could not find or create the year subfolder '{year_str}'. Cannot proceed.")
-        return None # Critical failure if we can't get the target folder
-
-    logging.info(f"Using year subfolder ID: {year_folder_id}")
-
-    # --- Find Existing Sheet or Copy Template/Create New within Year Folder ---
-    spreadsheet = None
-    sheet_id = _find_file_in_folder(drive_service, year_folder_id, sheet_name)
-
-    if sheet_id:
-        try:
-            spreadsheet = gc.open_by_key(sheet_id)
-            logging.info(f"Opened existing spreadsheet '{sheet_name}' (ID: {sheet_id}) in folder '{year_folder_id}'")
-        except gspread.exceptions.SpreadsheetNotFound:
-            logging.warning(f"Found sheet ID {sheet_id} via Drive API but gspread couldn't open it. Attempting copy/create.")
-            sheet_id = None # Reset ID so we try to create below
-        except gspread.exceptions.APIError as e:
-            logging.error(f"API error opening existing sheet ID {sheet_id}: {e}")
-            return None # Cannot proceed
-        except Exception as e:
-            logging.error(f"Unexpected error opening existing sheet ID {sheet_id}: {e}")
-            return None # Cannot proceed
-
-    if not spreadsheet:
-        # If sheet wasn't found, create a new blank one
-        logging.info(f"Spreadsheet '{sheet_name}' not found. Creating a new blank spreadsheet.")
-        try:
-            # Create the blank sheet (initially in root or default location)
-            spreadsheet = _create_blank_spreadsheet(gc, sheet_name)
-            # Move the newly created blank sheet to the target YEAR folder
-            # Ensure 'root' is removed if it was created there by default
-            file_info = drive_service.files().get(fileId=spreadsheet.id, fields='parents').execute()
-            previous_parents = ",".join(file_info.get('parents'))
-            drive_service.files().update(fileId=spreadsheet.id,
-                                         addParents=year_folder_id,
-                                         removeParents=previous_parents, # Remove from previous location(s)
-                                         fields='id, parents').execute()
-            logging.info(f"Moved new blank sheet '{sheet_name}' (ID: {spreadsheet.id}) to year folder ID '{year_folder_id}'")
-        except Exception as e:
-            logging.error(f"Failed to create or move blank spreadsheet '{sheet_name}': {e}")
-            # If creation failed, spreadsheet is None, so return None
-            # If move failed, we might still have the sheet but not in the right place. Return None for now.
-            if spreadsheet: # Cleanup if sheet was created but move failed
-                try:
-                    logging.info(f"Attempting to delete partially created sheet {spreadsheet.id}")
-                    drive_service.files().delete(fileId=spreadsheet.id).execute()
-                except Exception as delete_e:
-                    logging.error(f"Failed to delete partially created sheet {spreadsheet.id}: {delete_e}")
-            return None
-    if not spreadsheet:
-         logging.error("Failed to obtain a spreadsheet instance (existing, copied, or new).")
-         return None
+    # --- Find or Open the Month's Spreadsheet (in the background) ---
+    # The Drive/Sheets lookups are I/O-bound and independent of the data preparation below, so they run
+    # on a worker thread in the meantime. Only that thread uses gc and drive_service until it's done.
+    spreadsheet_executor = ThreadPoolExecutor(max_workers=1)
+    spreadsheet_future = spreadsheet_executor.submit(_open_or_create_month_spreadsheet, gc, drive_service,
+                                                     main_budget_folder_id, year_str, sheet_name)
+    spreadsheet_executor.shutdown(wait=False) # The thread exits once the lookup returns
 
     # --- Define Target Sheet Structure ---
     # Use all_transactions to get the full list of accounts
-    all_account_names = sorted(list(set(tx.source_account or 'Unknown' for tx in all_transactions if tx.source_account)))
-    logging.info(f"Identified account sheets needed from transactions: {all_account_names}")
+    all_account_names = sorted({tx.source_account for tx in all_transactions if tx.source_account}) # Non-empty names only
+    logger.info("Identified account sheets needed from transactions: %s", all_account_names)
 
     # Define the standard sheets and the dynamically generated ones
     standard_sheets = ['Cash', 'Achu']
     required_sheets = ['Final Recon', 'Reporting']
     # Ensure dynamic names are valid sheet names (gspread might handle some cases)
-    account_sheets = [name for name in all_account_names if name] # Filter out empty names
+    account_sheets = all_account_names # Empty names were already left out above
 
     # Combine standard, required, and account sheets, ensuring required ones are present and avoiding duplicates
     base_sheets = list(dict.fromkeys(standard_sheets + required_sheets)) # Preserves order, removes duplicates
-    target_sheet_names = base_sheets + [name for name in account_sheets if name not in base_sheets] # Add account sheets not already present
+    base_sheet_set = set(base_sheets) # Constant-time membership checks for the account names
+    target_sheet_names = base_sheets + [name for name in account_sheets if name not in base_sheet_set] # Add account sheets not already present
 
-    logging.info(f"Target sheets for workbook '{sheet_name}': {target_sheet_names}")
+    logger.info("Target sheets for workbook '%s': %s", sheet_name, target_sheet_names)
 
     # Filter transactions for populating sheets (exclude investments/insurance - assuming this is done before calling)
     # For now, assume all_transactions contains the data to be populated.
@@ -292,13 +492,13 @@ def update_google_sheet(all_transactions: List[Transaction], config: dict, crede
     unique_categories = []
 
     if not transactions_to_populate:
-        logging.warning("No transactions provided to populate sheets.")
+        logger.warning("No transactions provided to populate sheets.")
         # We might still want to create the structure
         # return spreadsheet.url # Let it continue to create structure
     try:
-        # Convert Pydantic objects to dicts for DataFrame creation
-        transaction_dicts = [tx.model_dump() for tx in transactions_to_populate]
-        df_transactions = pd.DataFrame(transaction_dicts)
+        # Read the needed fields straight off the Pydantic objects (no model_dump() dict per transaction)
+        get_transaction_fields = attrgetter(*TRANSACTION_COLUMNS)
+        df_transactions = pd.DataFrame([get_transaction_fields(tx) for tx in transactions_to_populate], columns=TRANSACTION_COLUMNS)
         # Ensure required columns exist based on Pydantic model fields and target sheet structure
         # Target columns: Txn Date, is Expense, Category, Short desc, Description, Cost, Is Split
         # Map from Transaction model: date, ?, category, short_desc, description, amount, ?
@@ -308,15 +508,15 @@ def update_google_sheet(all_transactions: List[Transaction], config: dict, crede
             if col not in df_transactions.columns:
                 # Amount and transaction_type are critical, others can be None
                 if col == 'amount':
-                    logging.error("Critical: 'amount' column missing in DataFrame from Transaction model.")
+                    logger.error("Critical: 'amount' column missing in DataFrame from Transaction model.")
                     # Decide error handling: return None or raise? For now, log and add None.
                     df_transactions[col] = None
                 elif col == 'transaction_type':
-                     logging.error("Critical: 'transaction_type' column missing in DataFrame from Transaction model. Cannot determine amount sign.")
+                     logger.error("Critical: 'transaction_type' column missing in DataFrame from Transaction model. Cannot determine amount sign.")
                      # Decide error handling: return None or raise? For now, log and add None.
                      df_transactions[col] = None # Or 'unknown'?
                 else:
-                    logging.warning(f"Column '{col}' missing in DataFrame from Transaction model. Adding with None.")
+                    logger.warning(f"Column '{col}' missing in DataFrame from Transaction model. Adding with None.")
                     df_transactions[col] = None
 
         # Ensure 'amount' is numeric before sign change
@@ -324,22 +524,23 @@ def update_google_sheet(all_transactions: List[Transaction], config: dict, crede
 
         # Apply sign based on transaction_type (Debit = negative, Credit = positive)
         # Use abs() to ensure we handle cases where amount might already have a sign incorrectly
-        df_transactions['amount'] = df_transactions.apply(
-            lambda row: -abs(row['amount']) if pd.notna(row['amount']) and row['transaction_type'] == 'credit' # Credit is negative
-            else abs(row['amount']) if pd.notna(row['amount']) and row['transaction_type'] == 'debit' # Debit is positive
-            else row['amount'], # Keep as is (e.g., NaN or if type is unknown/missing)
-            axis=1
+        # Vectorized over the columns; NaN amounts and unknown/missing types keep the amount as is
+        amount_abs = df_transactions['amount'].abs()
+        transaction_type = df_transactions['transaction_type'].astype('category') # Compared as integer codes
+        df_transactions['amount'] = np.where(
+            transaction_type.eq('credit'), -amount_abs, # Credit is negative
+            np.where(transaction_type.eq('debit'), amount_abs, df_transactions['amount']) # Debit is positive
         )
-        logging.info("Applied amount sign based on transaction_type (debit: negative, credit: positive).")
+        logger.info("Applied amount sign based on transaction_type (debit: negative, credit: positive).")
 
 
         # Add placeholder columns if they don't exist - these need actual logic later
         # TODO: Review if 'is_expense' logic should be derived from transaction_type
         if 'is_expense' not in df_transactions.columns:
-             logging.warning("Column 'is_expense' not in Transaction model. Adding placeholder value 1.")
+             logger.warning("Column 'is_expense' not in Transaction model. Adding placeholder value 1.")
              df_transactions['is_expense'] = 1 # Placeholder - needs logic based on transaction_type?
         if 'is_split' not in df_transactions.columns:
-             logging.warning("Column 'is_split' not in Transaction model. Adding placeholder value 0.")
+             logger.warning("Column 'is_split' not in Transaction model. Adding placeholder value 0.")
              df_transactions['is_split'] = 0 # Placeholder
 
         # Select and order columns for writing to Account/Cash/Achu sheets
@@ -359,11 +560,11 @@ def update_google_sheet(all_transactions: List[Transaction], config: dict, crede
         # Convert date column to string 'YYYY-MM-DD'
         # Apply flexible date parsing and format to DD/MM/YYYY
         if 'date' in df_to_write.columns:
-            logging.info("Applying flexible date parsing to 'date' column...")
-            df_to_write['date'] = df_to_write['date'].apply(parse_date_flexible)
-            logging.info("Finished applying flexible date parsing.")
+            logger.info("Applying flexible date parsing to 'date' column...")
+            df_to_write['date'] = format_date_column(df_to_write['date'])
+            logger.info("Finished applying flexible date parsing.")
         else:
-             logging.warning("Column 'date' not found in DataFrame. Cannot apply date parsing.")
+             logger.warning("Column 'date' not found in DataFrame. Cannot apply date parsing.")
              df_to_write['date'] = '' # Ensure column exists if it was missing
 
         # Rename columns to match sheet headers for clarity (optional, but good practice)
@@ -372,10 +573,14 @@ def update_google_sheet(all_transactions: List[Transaction], config: dict, crede
         if 'category' in df_to_write.columns:
              df_to_write['category'] = df_to_write['category'].apply(lambda x: x.value if isinstance(x, Category) else x)
 
-        # Replace NaN/None with empty strings for gspread compatibility in other columns
-        df_to_write = df_to_write.fillna('') # Avoid inplace=True
+        # Replace NaN/None with empty strings for gspread compatibility, only in the columns that have any:
+        # complete columns (usually amount and is_split) are left as they are and keep their numeric dtype
+        columns_with_missing = df_to_write.columns[df_to_write.isna().any()]
+        if len(columns_with_missing):
+            df_to_write[columns_with_missing] = df_to_write[columns_with_missing].fillna('')
 
-        grouped_data = df_to_write.groupby('source_account')
+        # Grouping on a categorical key works on integer codes instead of hashing each row's string
+        grouped_data = df_to_write.groupby(df_to_write['source_account'].astype('category'), observed=True)
 
         # Extract unique categories for data validation AFTER df_to_write is prepared
         if 'category' in df_to_write.columns:
@@ -387,109 +592,100 @@ def update_google_sheet(all_transactions: List[Transaction], config: dict, crede
         # else: unique_categories remains [] as initialized earlier
 
     except Exception as e:
-        logging.error(f"Error processing transaction data with pandas: {e}")
+        logger.error(f"Error processing transaction data with pandas: {e}")
         return None # Cannot proceed without data
 
-    # --- Manage Sheets (Create/Delete) ---
-    logging.info(f"Synchronizing sheets in workbook '{spreadsheet.title}'...")
-    try:
-        existing_sheets = {ws.title: ws for ws in spreadsheet.worksheets()}
-        existing_sheet_names = set(existing_sheets.keys())
-        target_sheet_names_set = set(target_sheet_names)
-
-        # Delete sheets that exist but are not in the target list
-        sheets_to_delete = existing_sheet_names - target_sheet_names_set
-        # Don't delete the very last sheet if it's the only one left and needs deletion
-        can_delete = len(existing_sheet_names) > 1 or not sheets_to_delete
-        if sheets_to_delete and can_delete:
-            for sheet_name in sheets_to_delete:
-                 # Avoid deleting the default 'Sheet1' if it's the only one left and not targeted
-                 if len(existing_sheet_names) == 1 and sheet_name == 'Sheet1':
-                     logging.warning("Skipping deletion of 'Sheet1' as it's the only sheet left.")
-                     continue
-                 try:
-                     logging.info(f"Deleting existing sheet not in target list: '{sheet_name}'")
-                     spreadsheet.del_worksheet(existing_sheets[sheet_name])
-                     existing_sheet_names.remove(sheet_name) # Update current state
-                 except Exception as e:
-                     logging.error(f"Error deleting sheet '{sheet_name}': {e}")
-
-        # Add sheets that are in the target list but don't exist
-        sheets_to_add = target_sheet_names_set - existing_sheet_names
-        for sheet_name in target_sheet_names: # Iterate in desired order
-            if sheet_name in sheets_to_add:
-                try:
-                    logging.info(f"Adding missing target sheet: '{sheet_name}'")
-                    # Handle case where 'Sheet1' exists but needs renaming
-                    if 'Sheet1' in existing_sheet_names and len(existing_sheet_names) == 1:
-                         logging.info(f"Renaming existing 'Sheet1' to '{sheet_name}'")
-                         ws = existing_sheets['Sheet1']
-                         ws.update_title(sheet_name)
-                         existing_sheets[sheet_name] = ws # Update dict
-                         del existing_sheets['Sheet1']
-                         existing_sheet_names.remove('Sheet1')
-                         existing_sheet_names.add(sheet_name)
-                    else:
-                        spreadsheet.add_worksheet(title=sheet_name, rows="100", cols="20") # Adjust size later
-                        existing_sheet_names.add(sheet_name) # Update current state
-                except Exception as e:
-                    logging.error(f"Error adding sheet '{sheet_name}': {e}")
-                    # Decide if we should continue or raise
-
-        # Reorder sheets to match target_sheet_names order (best effort)
-        try:
-             # Get current worksheets after adds/deletes
-             current_worksheets = spreadsheet.worksheets()
-             current_titles_ordered = [ws.title for ws in current_worksheets]
-             target_order_map = {name: i for i, name in enumerate(target_sheet_names)}
-
-             # Create list of worksheet objects in the desired order
-             ordered_worksheets = sorted(current_worksheets, key=lambda ws: target_order_map.get(ws.title, 999))
-
-             # Prepare reordering requests (requires batch update)
-             requests = []
-             for i, ws in enumerate(ordered_worksheets):
-                 requests.append({
-                     "updateSheetProperties": {
-                         "properties": {
-                             "sheetId": ws.id,
-                             "index": i
-                         },
-                         "fields": "index"
-                     }
-                 })
-             if requests:
-                 logging.info("Reordering sheets...")
-                 spreadsheet.batch_update({"requests": requests})
-
-        except Exception as e:
-            logging.warning(f"Could not reorder sheets: {e}")
-
-
-    except gspread.exceptions.APIError as e:
-        logging.error(f"API error managing sheets for {spreadsheet.id}: {e}")
-        return None # Cannot proceed if we can't manage sheets
-    except Exception as e:
-        logging.error(f"Unexpected error managing sheets for {spreadsheet.id}: {e}")
-        return None
+    spreadsheet = spreadsheet_future.result()
+    if not spreadsheet:
+         logger.error("Failed to obtain a spreadsheet instance (existing, copied, or new).")
+         return None
 
-    # --- Get Fresh Sheet IDs AFTER Synchronization ---
+    # --- Manage Sheets (Create/Delete/Reorder) ---
+    # All changes go out in one spreadsheets().batchUpdate. Its requests are applied in order, so
+    # walking target_sheet_names and putting each sheet at index i (moving an existing one, or adding
+    # it there) leaves them in target order; the remaining, unwanted sheets are deleted last, once
+    # the target sheets exist, so the workbook is never left without a sheet. Existing sheets that are
+    # about to be repopulated have their old data (rows 2 onwards, A-I) cleared in the same request.
+    logger.info(f"Synchronizing sheets in workbook '{spreadsheet.title}'...")
     sheet_id_map = {}
+    sheets_with_data = set(df_to_write['source_account'])
     try:
-        logging.info(f"Fetching updated sheet metadata for spreadsheet ID: {spreadsheet.id}")
-        sheet_metadata = sheets_service.spreadsheets().get(spreadsheetId=spreadsheet.id, fields='sheets(properties(sheetId,title))').execute()
-        for sheet_prop in sheet_metadata.get('sheets', []):
-            properties = sheet_prop.get('properties', {})
+        # Existing sheet titles -> sheetIds, from one metadata request trimmed to just those two fields
+        sheets_metadata = _call_with_retry(sheets_service.spreadsheets().get(
+            spreadsheetId=spreadsheet.id,
+            fields="sheets.properties(sheetId,title)"
+        ).execute, "Sheet metadata fetch")
+        existing_sheets = {sheet['properties']['title']: sheet['properties']['sheetId']
+                           for sheet in sheets_metadata.get('sheets', [])}
+        target_sheet_names_set = set(target_sheet_names)
+        sheets_to_delete = [name for name in existing_sheets if name not in target_sheet_names_set]
+        sheets_to_add = [name for name in target_sheet_names if name not in existing_sheets]
+
+        # A new workbook only has the default 'Sheet1': rename it to the first missing sheet instead of replacing it
+        sheet_to_rename = None
+        if list(existing_sheets) == ['Sheet1'] and sheets_to_delete and sheets_to_add:
+            sheet_to_rename = sheets_to_add[0]
+            sheets_to_delete = []
+
+        requests = []
+        for i, sheet_name in enumerate(target_sheet_names):
+            if sheet_name == sheet_to_rename:
+                logger.info(f"Renaming existing 'Sheet1' to '{sheet_name}'")
+                existing_id = existing_sheets['Sheet1']
+                sheet_id_map[sheet_name] = existing_id
+                requests.append({
+                    "updateSheetProperties": {
+                        "properties": {"sheetId": existing_id, "title": sheet_name, "index": i},
+                        "fields": "title,index"
+                    }
+                })
+                if sheet_name in sheets_with_data:
+                    requests.append(_clear_data_rows_request(existing_id))
+            elif sheet_name in existing_sheets:
+                existing_id = existing_sheets[sheet_name]
+                sheet_id_map[sheet_name] = existing_id
+                requests.append({
+                    "updateSheetProperties": {
+                        "properties": {"sheetId": existing_id, "index": i},
+                        "fields": "index"
+                    }
+                })
+                if sheet_name in sheets_with_data:
+                    requests.append(_clear_data_rows_request(existing_id))
+            else:
+                logger.info(f"Adding missing target sheet: '{sheet_name}'")
+                requests.append({
+                    "addSheet": {
+                        "properties": {
+                            "title": sheet_name,
+                            "index": i,
+                            "gridProperties": {"rowCount": 100, "columnCount": 20} # Adjust size later
+                        }
+                    }
+                })
+        for sheet_name in sheets_to_delete:
+            logger.info(f"Deleting existing sheet not in target list: '{sheet_name}'")
+            requests.append({"deleteSheet": {"sheetId": existing_sheets[sheet_name]}})
+
+        response = _call_with_retry(sheets_service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet.id,
+            body={"requests": requests}
+        ).execute, "Sheet synchronization")
+
+        # IDs of the added sheets come back in the replies, so no follow-up metadata fetch is needed
+        for reply in response.get('replies', []):
+            properties = reply.get('addSheet', {}).get('properties', {})
             title = properties.get('title')
             sheet_id = properties.get('sheetId')
             if title and sheet_id is not None:
                 sheet_id_map[title] = sheet_id
-        logging.info(f"Successfully fetched updated sheet IDs: {list(sheet_id_map.keys())}")
-    except HttpError as error:
-        logging.error(f"API error fetching updated sheet metadata: {error}")
-        return None # Cannot proceed without sheet IDs
+        logger.info("Synchronized sheets; sheet IDs: %s", list(sheet_id_map))
+
+    except (gspread.exceptions.APIError, HttpError) as e:
+        logger.error(f"API error managing sheets for {spreadsheet.id}: {e}")
+        return None # Cannot proceed if we can't manage sheets
     except Exception as e:
-        logging.error(f"Unexpected error fetching updated sheet metadata: {e}")
+        logger.error(f"Unexpected error managing sheets for {spreadsheet.id}: {e}")
         return None
 
     # --- Define Headers ---
@@ -500,272 +696,264 @@ def update_google_sheet(all_transactions: List[Transaction], config: dict, crede
         "Final Recon": ["Source", "Category", "Appu Expense", "Achu Expense", "Description", "Actual Amount", "", "Category Heading", "Appu", "Achu", "Actual amount"] # No change needed here
     }
 
-    # --- Populate Headers ---
-    logging.info("Populating headers for all target sheets...")
+    # --- Prepare Headers ---
+    # Headers, clears and data for every sheet are collected here and sent together below,
+    # instead of one round trip per sheet and operation
+    logger.info("Preparing headers for all target sheets...")
+    value_ranges = [] # ValueRange dicts for a single values().batchUpdate
+    pending_requests = [] # Freeze, formula and validation subrequests, sent in one batchUpdate at the end
     for sheet_name in target_sheet_names:
-        try:
-            worksheet = spreadsheet.worksheet(sheet_name)
-            sheet_type = "Account" # Default
-            if sheet_name == "Cash": sheet_type = "Cash"
-            elif sheet_name == "Achu": sheet_type = "Achu"
-            elif sheet_name == "Final Recon": sheet_type = "Final Recon"
-
-            current_headers = headers.get(sheet_type)
-            if current_headers:
-                logging.debug(f"Setting headers for '{sheet_name}' ({sheet_type}): {current_headers}")
-                worksheet.update('A1', [current_headers], value_input_option='USER_ENTERED')
-                # Optional: Freeze header row
-                worksheet.freeze(rows=1)
-            else:
-                logging.warning(f"No defined headers for sheet type derived from name '{sheet_name}'. Skipping header population.")
-
-        except gspread.exceptions.WorksheetNotFound:
-            logging.warning(f"Sheet '{sheet_name}' not found during header population. Skipping.")
-        except Exception as e:
-            logging.error(f"Error populating headers for sheet '{sheet_name}': {e}")
+        sheet_id = sheet_id_map.get(sheet_name)
+        if sheet_id is None:
+            logger.warning(f"Sheet '{sheet_name}' not found during header population. Skipping.")
+            continue
+        sheet_type = "Account" # Default
+        if sheet_name == "Cash": sheet_type = "Cash"
+        elif sheet_name == "Achu": sheet_type = "Achu"
+        elif sheet_name == "Final Recon": sheet_type = "Final Recon"
+
+        current_headers = headers.get(sheet_type)
+        if current_headers:
+            logger.debug("Setting headers for '%s' (%s): %s", sheet_name, sheet_type, current_headers)
+            value_ranges.append({"range": gspread.utils.absolute_range_name(sheet_name, "A1"), "values": [current_headers]})
+            # Optional: Freeze header row
+            pending_requests.append({
+                "updateSheetProperties": {
+                    "properties": {"sheetId": sheet_id, "gridProperties": {"frozenRowCount": 1}},
+                    "fields": "gridProperties.frozenRowCount"
+                }
+            })
+        else:
+            logger.warning(f"No defined headers for sheet type derived from name '{sheet_name}'. Skipping header population.")
 
-    # --- Populate Data (Account/Cash/Achu Sheets) ---
-    logging.info("Populating data for Account/Cash/Achu sheets...")
+    # --- Prepare Data (Account/Cash/Achu Sheets) ---
+    logger.info("Preparing data for Account/Cash/Achu sheets...")
     account_sheet_names = set(account_sheets + ['Cash', 'Achu']) # Sheets to populate data into
     populated_rows_count = {} # Keep track of rows for formula application
 
     for account_name, group_df in grouped_data:
         target_sheet_name = account_name
         if not target_sheet_name or target_sheet_name == 'Unknown':
-            logging.warning(f"Skipping {len(group_df)} transactions with missing or 'Unknown' source_account.")
+            logger.warning(f"Skipping {len(group_df)} transactions with missing or 'Unknown' source_account.")
             continue
 
         if target_sheet_name not in account_sheet_names:
-             logging.warning(f"Account '{target_sheet_name}' from data is not in the target sheet list. Skipping population.")
+             logger.warning(f"Account '{target_sheet_name}' from data is not in the target sheet list. Skipping population.")
              continue
 
-        logging.info(f"Populating data for sheet: '{target_sheet_name}'")
-        try:
-            worksheet = spreadsheet.worksheet(target_sheet_name)
-
-            sheet_id = sheet_id_map.get(target_sheet_name)
+        if sheet_id_map.get(target_sheet_name) is None:
+            logger.error(f"Could not find sheetId for sheet '{target_sheet_name}'. Skipping deletion and update.")
+            continue
 
-            if sheet_id is None:
-                logging.error(f"Could not find sheetId for sheet '{target_sheet_name}'. Skipping deletion and update.")
-                continue
+        # Prepare data for writing (list of lists)
+        # Use output_columns_data defined earlier
+        # Each column converts to Python scalars in its own dtype (no object-array copy of the frame),
+        # then zip transposes them into row tuples, which serialize to JSON arrays like lists do
+        data_to_write = list(zip(*(group_df[col].tolist() for col in output_columns_data)))
+
+        if data_to_write:
+            num_rows = len(data_to_write)
+            num_cols = len(output_columns_data)
+            # Usually one range from A2; very large sheets are split into consecutive row blocks
+            block_start_row = 2 # 1-based, data starts at row 2
+            for block in _split_rows_by_size(data_to_write, MAX_BATCH_BYTES):
+                end_cell = gspread.utils.rowcol_to_a1(block_start_row + len(block) - 1, num_cols)
+                update_range = gspread.utils.absolute_range_name(target_sheet_name, f"A{block_start_row}:{end_cell}")
+                logger.info(f"Queueing {len(block)} rows for range {update_range}")
+                value_ranges.append({"range": update_range, "majorDimension": "ROWS", "values": block})
+                block_start_row += len(block)
+            populated_rows_count[target_sheet_name] = num_rows
+        else:
+            logger.info(f"No data to write for account '{target_sheet_name}'")
+            populated_rows_count[target_sheet_name] = 0
 
-            # --- Clear existing data (Rows 2 onwards) using values().clear() ---
-            # Clear data (A-G) and formula columns (H-I)
-            clear_range = f'{target_sheet_name}!A2:I'
-            logging.info(f"Clearing existing data in range: {clear_range}")
-            try:
-                # Use sheets_service (built from credentials) to clear values
-                sheets_service.spreadsheets().values().clear(
+    # --- Write Headers and Data ---
+    if value_ranges:
+        value_batches = _pack_by_size(value_ranges, MAX_BATCH_BYTES) # One request unless the data is very large
+        logger.info(f"Writing headers and data ({len(value_ranges)} ranges) in {len(value_batches)} request(s)...")
+        try:
+            total_updated_rows = 0
+            for batch_number, value_batch in enumerate(value_batches, start=1):
+                # Don't echo the written values back, and of the per-range results only return the total
+                response = _call_with_retry(sheets_service.spreadsheets().values().batchUpdate(
                     spreadsheetId=spreadsheet.id,
-                    range=clear_range,
-                    body={} # Empty body for clear operation
-                ).execute()
-                logging.info(f"Successfully cleared data in '{target_sheet_name}'.")
-            except HttpError as error:
-                logging.error(f"API error clearing data in sheet '{target_sheet_name}': {error}. Proceeding with data write attempt.")
-                # Keeping original behavior: log error and continue
-
-            # Prepare data for writing (list of lists)
-            # Use output_columns_data defined earlier
-            data_to_write = group_df[output_columns_data].values.tolist()
-
-            if data_to_write:
-                num_rows = len(data_to_write)
-                num_cols = len(output_columns_data)
-                end_cell = gspread.utils.rowcol_to_a1(num_rows + 1, num_cols) # +1 because it's 1-based index and starts at row 2
-                update_range = f"A2:{end_cell}"
-
-                logging.info(f"Writing {num_rows} rows to range {update_range} in sheet '{target_sheet_name}'")
-                worksheet.update(update_range, data_to_write, value_input_option='USER_ENTERED')
-                populated_rows_count[target_sheet_name] = num_rows
-            else:
-                logging.info(f"No data to write for account '{target_sheet_name}'")
-                populated_rows_count[target_sheet_name] = 0
-
-        except gspread.exceptions.WorksheetNotFound:
-            logging.warning(f"Worksheet '{target_sheet_name}' not found during data population. Skipping.")
-        except gspread.exceptions.APIError as error:
-            logging.error(f"API error updating sheet '{target_sheet_name}': {error}")
-            # Continue with other sheets?
+                    body={"valueInputOption": "USER_ENTERED", "data": value_batch, "includeValuesInResponse": False},
+                    fields="totalUpdatedRows"
+                ).execute, f"Headers and data write {batch_number}/{len(value_batches)}")
+                total_updated_rows += response.get('totalUpdatedRows', 0)
+            logger.info(f"Successfully wrote headers and data ({total_updated_rows} rows).")
+        except HttpError as error:
+            logger.error(f"API error writing headers and data: {error}")
+            populated_rows_count = {} # The data is incomplete, so no formulas or validation to apply
         except Exception as e:
-            logging.error(f"Unexpected error updating sheet '{target_sheet_name}': {e}")
-            # Continue with other sheets?
+            logger.error(f"Unexpected error writing headers and data: {e}")
+            populated_rows_count = {}
 
-    # --- Apply Formulas (Account/Cash/Achu Sheets) ---
-    logging.info("Applying row-wise formulas for Appu/Achu columns...")
+    # --- Prepare Formulas (Account/Cash/Achu Sheets) ---
+    logger.info("Preparing ARRAYFORMULAs for Appu/Achu columns...")
     for sheet_name, num_rows in populated_rows_count.items():
         if sheet_name in account_sheet_names and num_rows > 0:
-            try:
-                worksheet = spreadsheet.worksheet(sheet_name)
-                is_achu_sheet = (sheet_name == "Achu")
-                _apply_row_formulas(worksheet, start_row=2, end_row=num_rows + 1, is_achu_sheet=is_achu_sheet)
-            except gspread.exceptions.WorksheetNotFound:
-                 logging.warning(f"Sheet '{sheet_name}' not found during formula application. Skipping.")
-            except Exception as e:
-                 logging.error(f"Error applying row formulas to sheet '{sheet_name}': {e}")
+            is_achu_sheet = (sheet_name == "Achu")
+            _add_row_formula_requests(pending_requests, sheet_id_map[sheet_name], sheet_name,
+                                      start_row=2, end_row=num_rows + 1, is_achu_sheet=is_achu_sheet)
 
     # --- Apply Formulas (Final Recon Sheet) --- (DISABLED) ---
-    # logging.info("Applying aggregation formulas for Final Recon sheet...")
+    # logger.info("Applying aggregation formulas for Final Recon sheet...")
     # try:
     #     final_recon_sheet = spreadsheet.worksheet("Final Recon")
     #     # Get the names of sheets to include in the query (excluding Final Recon itself)
     #     source_sheet_names = [name for name in target_sheet_names if name != "Final Recon"]
-    #     _apply_final_recon_formulas(final_recon_sheet, source_sheet_names)
+    #     _apply_final_recon_formulas(final_recon_sheet, source_sheet_names, populated_rows_count)
     # except gspread.exceptions.WorksheetNotFound:
-    #     logging.error("Sheet 'Final Recon' not found. Cannot apply aggregation formulas.")
+    #     logger.error("Sheet 'Final Recon' not found. Cannot apply aggregation formulas.")
     # except Exception as e:
     #     # Log the specific error from _apply_final_recon_formulas
-    #     logging.error(f"Error applying Final Recon formulas: {e}")
+    #     logger.error(f"Error applying Final Recon formulas: {e}")
     # --- End Disabled Final Recon Formulas ---
-    # --- Apply Data Validation ---
-    logging.info("Applying data validation rules...")
+    # --- Prepare Data Validation ---
+    logger.info("Preparing data validation rules...")
     # Get category values directly from the Enum for validation rule setting
     category_values_for_validation = sorted([cat.value for cat in Category if cat != Category.UNCATEGORIZED]) # Exclude UNKNOWN if needed
 
     # Log the unique categories found in the *data* (populated earlier)
-    logging.info(f"Found {len(unique_categories)} unique categories in data: {unique_categories}") # Use populated unique_categories
+    logger.info("Found %d unique categories in data: %s", len(unique_categories), unique_categories) # Use populated unique_categories
 
     split_values = ['0', '1', '2'] # As strings for list validation
 
+    # The rules are the same on every sheet, so each is built once; only the ranges differ
+    category_rule = _data_validation_rule(
+        'ONE_OF_LIST', category_values_for_validation, # Use Enum values for the rule
+        input_message="Select a category",
+        strict=True # Or False to allow other values with warning
+    )
+    is_expense_rule = _data_validation_rule(
+        'ONE_OF_LIST', ['0', '1'],
+        input_message="Enter 0 (Income/Transfer) or 1 (Expense)",
+        strict=True
+    )
+    is_split_rule = _data_validation_rule(
+        'ONE_OF_LIST', split_values,
+        input_message="Select 0 (No), 1 (Split 50/50), or 2 (Achu Only)",
+        strict=True
+    )
+
     for sheet_name in account_sheet_names: # Apply to Cash, Achu, and dynamic account sheets
         num_rows = populated_rows_count.get(sheet_name, 0)
         if num_rows > 0: # Only apply if data exists
+            sheet_id = sheet_id_map[sheet_name]
+            end_row_index = num_rows + 1 # Apply down to the last populated row
+
+            # Apply Category validation (Column C = 3) using Enum values
+            if category_values_for_validation:
+                 _add_data_validation_request(
+                     pending_requests, sheet_id, sheet_name,
+                     start_row=2, end_row=end_row_index,
+                     start_col=3, end_col=3, # Column C
+                     rule=category_rule
+                 )
+            else:
+                logger.warning(f"No Enum categories found to apply validation in sheet '{sheet_name}'.")
+            # Apply is_expense validation (Column B = 2) - List (0/1)
+            _add_data_validation_request(
+                pending_requests, sheet_id, sheet_name,
+                start_row=2, end_row=end_row_index,
+                start_col=2, end_col=2, # Column B
+                rule=is_expense_rule
+            )
+
+            # Apply Is Split validation (Column G = 7)
+            _add_data_validation_request(
+                pending_requests, sheet_id, sheet_name,
+                start_row=2, end_row=end_row_index,
+                start_col=7, end_col=7, # Column G
+                rule=is_split_rule
+            )
+
+    # --- Apply Freezes, Formulas and Validation ---
+    if pending_requests:
+        logger.info(f"Applying {len(pending_requests)} freeze/formula/validation requests...")
+        chunk_start = 0
+        for chunk in _pack_by_size(pending_requests, MAX_BATCH_BYTES, BATCH_UPDATE_MAX_REQUESTS):
             try:
-                worksheet = spreadsheet.worksheet(sheet_name)
-                end_row_index = num_rows + 1 # Apply down to the last populated row
-
-                # Apply Category validation (Column C = 3) using Enum values
-                if category_values_for_validation:
-                     _apply_data_validation(
-                         worksheet=worksheet,
-                         start_row=2, end_row=end_row_index,
-                         start_col=3, end_col=3, # Column C
-                         condition_type='ONE_OF_LIST',
-                         condition_values=category_values_for_validation, # Use Enum values for the rule
-                         input_message="Select a category",
-                         strict=True # Or False to allow other values with warning
-                     )
-                else:
-                    logging.warning(f"No Enum categories found to apply validation in sheet '{sheet_name}'.")
-                # Apply is_expense validation (Column B = 2) - List (0/1)
-                _apply_data_validation(
-                    worksheet=worksheet,
-                    start_row=2, end_row=end_row_index,
-                    start_col=2, end_col=2, # Column B
-                    condition_type='ONE_OF_LIST',
-                    condition_values=['0', '1'],
-                    input_message="Enter 0 (Income/Transfer) or 1 (Expense)",
-                    strict=True
-                )
-
-                # Apply Is Split validation (Column G = 7)
-                _apply_data_validation(
-                    worksheet=worksheet,
-                    start_row=2, end_row=end_row_index,
-                    start_col=7, end_col=7, # Column G
-                    condition_type='ONE_OF_LIST',
-                    condition_values=split_values,
-                    input_message="Select 0 (No), 1 (Split 50/50), or 2 (Achu Only)",
-                    strict=True
-                )
-
-            except gspread.exceptions.WorksheetNotFound:
-                 logging.warning(f"Sheet '{sheet_name}' not found during data validation application. Skipping.")
+                _call_with_retry(sheets_service.spreadsheets().batchUpdate(
+                    spreadsheetId=spreadsheet.id,
+                    body={"requests": chunk}
+                ).execute, f"Applying requests {chunk_start + 1}-{chunk_start + len(chunk)}")
+            except HttpError as error:
+                logger.error(f"API error applying requests {chunk_start + 1}-{chunk_start + len(chunk)}: {error}")
             except Exception as e:
-                 logging.error(f"Error applying data validation to sheet '{sheet_name}': {e}")
+                logger.error(f"Unexpected error applying requests {chunk_start + 1}-{chunk_start + len(chunk)}: {e}")
+            chunk_start += len(chunk)
+        logger.info("Finished applying freezes, formulas and validation.")
 
     # Note: 'Cash' and 'Achu' sheets are now handled like other account sheets regarding data population.
     # If they need specific placeholder data when no transactions exist, that logic could be added here.
     # For now, they will be blank if no transactions map to them.
     # --- Final Recon Sheet Formulas (Implementation needed) ---
     # The 'Final Recon' sheet structure is created, but formulas need to be applied.
-    # logging.warning("'Final Recon' sheet formulas are not yet implemented.") # Removed, implementation exists
-    logging.info(f"Google Sheet update process finished successfully for '{spreadsheet.title}'.") # Use spreadsheet.title
+    # logger.warning("'Final Recon' sheet formulas are not yet implemented.") # Removed, implementation exists
+    logger.info(f"Google Sheet update process finished successfully for '{spreadsheet.title}'.") # Use spreadsheet.title
     return spreadsheet.url
 
 
 # --- Helper Functions for Formulas and Validation ---
 
-def _apply_row_formulas(worksheet: gspread.Worksheet, start_row: int, end_row: int, is_achu_sheet: bool):
-    """Applies Appu/Achu formulas row by row using batch update."""
-    logging.info(f"Applying row formulas to '{worksheet.title}' from row {start_row} to {end_row}")
-    requests = []
+def _clear_data_rows_request(sheet_id: int) -> dict:
+    """updateCells request clearing the values and formulas of data (A-G) and formula columns (H-I) from row 2 down."""
+    return {
+        "updateCells": {
+            # No endRowIndex: the range runs to the bottom of the sheet
+            "range": {"sheetId": sheet_id, "startRowIndex": 1, "startColumnIndex": 0, "endColumnIndex": 9},
+            "fields": "userEnteredValue" # No rows given, so the values are cleared; formatting is kept
+        }
+    }
+
+def _add_row_formula_requests(pending_requests: List[dict], sheet_id: int, sheet_title: str, start_row: int, end_row: int, is_achu_sheet: bool):
+    """
+    Queues updateCells requests for the Appu/Achu columns onto pending_requests: one ARRAYFORMULA
+    per column in the first data row, covering start_row to end_row, instead of a formula per row.
+    """
+    logger.info(f"Preparing Appu/Achu formulas for '{sheet_title}' from row {start_row} to {end_row}")
+
+    # Column ranges the formulas work over, e.g. G2:G40
+    b, f, g = (f"{col}{start_row}:{col}{end_row}" for col in "BFG")
 
-    # Define formula templates based on sheet type
     # Column F: Cost, Column G: Is Split
     if is_achu_sheet:
         # Achu Sheet Specific Formulas
-        appu_formula_template = '=IF(G{row}=0, F{row}, IF(G{row}=1, F{row}/2, IF(G{row}=2, 0, 0)))' # Explicitly handle 0 first
-        achu_formula_template = '=IF(G{row}=0, 0, IF(G{row}=1, F{row}/2, IF(G{row}=2, F{row}, 0)))' # Explicitly handle 0 first
+        appu_formula = f'=ARRAYFORMULA(IF({g}=0, {f}, IF({g}=1, {f}/2, IF({g}=2, 0, 0))))' # Explicitly handle 0 first
+        achu_formula = f'=ARRAYFORMULA(IF({g}=0, 0, IF({g}=1, {f}/2, IF({g}=2, {f}, 0))))' # Explicitly handle 0 first
     else:
         # Standard Account/Cash Formulas (Same as Achu in this case based on workflow_requirements.md?)
         # Double-checking requirements: Lines 82-87 show identical formulas.
-        appu_formula_template = '=ROUND(IF(G{row}<>0, B{row}*F{row}/G{row}, 0))' # Appu: New formula based on user input
-        achu_formula_template = '=ROUND(IF(G{row}<>1, IF(G{row}<>0, B{row}*F{row}/G{row}, B{row}*F{row}) , 0))' # Achu: New formula based on user input
-
-    # Prepare requests in the format needed for batch_update
-    # List of dicts like {'range': 'A1', 'values': [['=FORMULA']]}
-    formula_requests = []
-    for row in range(start_row, end_row + 1):
-        # Appu Formula (Column H = 8)
-        formula_requests.append({
-            "range": gspread.utils.absolute_range_name(worksheet.title, f"H{row}"),
-            "values": [[appu_formula_template.format(row=row)]]
-        })
-        # Achu Formula (Column I = 9)
-        formula_requests.append({
-            "range": gspread.utils.absolute_range_name(worksheet.title, f"I{row}"),
-            "values": [[achu_formula_template.format(row=row)]]
-        })
-
-    if formula_requests:
-        # Construct the batch_update body
-        batch_update_requests = []
-        for req in formula_requests:
-            range_a1 = req["range"]
-            # --- Start GridRange Fix ---
-            try:
-                # Assuming single cell range like "Sheet1!H2" or just "H2"
-                # gspread.utils.absolute_range_name ensures sheet name is present
-                cell_a1 = range_a1.split('!')[-1] # Get "H2" part
-                start_row_idx, start_col_idx = gspread.utils.a1_to_rowcol(cell_a1)
-                grid_range = {
-                    'sheetId': worksheet.id,
-                    'startRowIndex': start_row_idx - 1, # 0-based
-                    'endRowIndex': start_row_idx,       # Exclusive end row
-                    'startColumnIndex': start_col_idx - 1, # 0-based
-                    'endColumnIndex': start_col_idx        # Exclusive end col
-                }
-            except (gspread.exceptions.InvalidInputValue, ValueError) as e:
-                logging.error(f"Could not convert range '{range_a1}' to grid range: {e}. Skipping this request.")
-                continue # Skip this request if range is invalid
-            # --- End GridRange Fix ---
-
-            batch_update_requests.append({
-                "updateCells": {
-                    # Ensure 'values' structure matches API: list of rows, each row is list of cells
-                    "rows": [{"values": [{"userEnteredValue": {"formulaValue": cell_value}} for cell_value in row_vals]} for row_vals in req["values"]],
-                    "fields": "userEnteredValue.formulaValue", # More specific field mask
-                    "range": grid_range
-                }
-            })
-
-        body_correct = {"requests": batch_update_requests}
-
-        try:
-            # Use the correctly structured body
-            worksheet.spreadsheet.batch_update(body_correct)
-            logging.info(f"Successfully applied {len(formula_requests)} row formulas to '{worksheet.title}'.")
-        except gspread.exceptions.APIError as e:
-            logging.error(f"API error applying row formulas to '{worksheet.title}': {e}")
-            raise # Re-raise to be caught by the caller
-        except Exception as e:
-            logging.error(f"Unexpected error applying row formulas to '{worksheet.title}': {e}")
-            raise # Re-raise
+        appu_formula = f'=ARRAYFORMULA(ROUND(IF({g}<>0, {b}*{f}/{g}, 0)))' # Appu: New formula based on user input
+        achu_formula = f'=ARRAYFORMULA(ROUND(IF({g}<>1, IF({g}<>0, {b}*{f}/{g}, {b}*{f}) , 0)))' # Achu: New formula based on user input
+
+    # Appu Formula (Column H = 8) and Achu Formula (Column I = 9) side by side in one request;
+    # each fills its column down to end_row
+    pending_requests.append({
+        "updateCells": {
+            "rows": [{"values": [{"userEnteredValue": {"formulaValue": appu_formula}},
+                                 {"userEnteredValue": {"formulaValue": achu_formula}}]}],
+            "fields": "userEnteredValue.formulaValue", # More specific field mask
+            "range": {
+                'sheetId': sheet_id,
+                'startRowIndex': start_row - 1, # 0-based
+                'endRowIndex': start_row,       # Exclusive end row
+                'startColumnIndex': 7, # Column H, 0-based
+                'endColumnIndex': 9    # Through column I (exclusive end col)
+            }
+        }
+    })
 
 
-def _build_final_recon_query(source_sheet_names: List[str]) -> str:
-    """Builds the QUERY or FILTER array formula for Final Recon columns A-F."""
+def _build_final_recon_query(source_sheet_names: List[str], row_counts: dict) -> str:
+    """
+    Builds the QUERY or FILTER array formula for Final Recon columns A-F.
+    row_counts maps sheet names to their number of data rows; ranges stop at the last one,
+    and sheets without data rows are left out.
+    """
+    source_sheet_names = [name for name in source_sheet_names if row_counts.get(name, 0) > 0]
     if not source_sheet_names:
         return '={"Source","Category","Appu Expense","Achu Expense","Description","Actual Amount";ARRAYFORMULA(IF(ROW(A2:A)=2,"No source sheets found",))}' # Return header + error message
 
@@ -781,16 +969,18 @@ def _build_final_recon_query(source_sheet_names: List[str]) -> str:
     query_parts = []
     for name in source_sheet_names:
         escaped_name = escape_sheet_name(name)
-        # Range assumes data starts from row 2 and goes down to row 1000 (adjust if needed)
+        source_label = name.replace("'", "''")
+        # Data starts from row 2 and goes down to the sheet's last data row; closed ranges keep
+        # Sheets from scanning every empty row of the tab on each recalculation
+        last_row = row_counts[name] + 1
         # Col C: Category, Col H: Appu Exp, Col I: Achu Exp, Col E: Description, Col F: Actual Amount
         # Using FILTER and stacking with semicolons for robustness across different data sizes
         # ARRAYFORMULA adds the sheet name to each row
-        # Ensure range references are correct (e.g., C2:C, H2:H etc. for open-ended)
+        c, h, i, e, f = (f"{escaped_name}!{col}2:{col}{last_row}" for col in "CHIEF")
         query_parts.append(
-            f'FILTER({{ARRAYFORMULA(IF(LEN({escaped_name}!C2:C),"{name.replace("'", "''")}",)), ' # Add escaped sheet name
-            f'{escaped_name}!C2:C, {escaped_name}!H2:H, {escaped_name}!I2:I, '
-            f'{escaped_name}!E2:E, {escaped_name}!F2:F}}, '
-            f'LEN({escaped_name}!C2:C)>0)' # Filter out rows where Category is blank using LEN
+            f'FILTER({{ARRAYFORMULA(IF(LEN({c}),"{source_label}",)), ' # Add escaped sheet name
+            f'{c}, {h}, {i}, {e}, {f}}}, '
+            f'LEN({c})>0)' # Filter out rows where Category is blank using LEN
         )
 
     # Combine all FILTER parts into a single array literal
@@ -810,160 +1000,130 @@ def _build_final_recon_query(source_sheet_names: List[str]) -> str:
     # Alternative using just stacked FILTERs (might be simpler if QUERY has issues)
     # final_formula = f'=IFERROR({combined_filters}, "No data found")'
 
-    logging.debug(f"Constructed Final Recon Query: {final_formula}")
+    logger.debug("Constructed Final Recon Query: %s", final_formula)
     return final_formula
 
 
-def _apply_final_recon_formulas(worksheet: gspread.Worksheet, source_sheet_names: List[str]):
+def _apply_final_recon_formulas(worksheet: gspread.Worksheet, source_sheet_names: List[str], row_counts: dict):
     """Applies aggregation formulas to the Final Recon sheet."""
-    logging.info(f"Applying aggregation formulas to '{worksheet.title}'")
-
-    # --- Clear existing formula ranges ---
-    # Clear A2:F (aggregated data), H2:K (summary)
-    clear_ranges = ['A2:F1000', 'H2:K1000'] # Clear large ranges
-    try:
-        worksheet.batch_clear(clear_ranges)
-        logging.info(f"Cleared previous formula ranges in '{worksheet.title}': {clear_ranges}")
-    except Exception as e:
-        logging.warning(f"Could not clear ranges in '{worksheet.title}': {e}")
-
+    logger.info(f"Applying aggregation formulas to '{worksheet.title}'")
 
     # --- Formulas ---
     # Formula for Columns A-F (Aggregated Data)
-    agg_formula = _build_final_recon_query(source_sheet_names)
-
-    # Formula for Column H (Unique Categories) - assumes aggregated data starts in B2
-    cat_heading_formula = '=IFERROR(UNIQUE(FILTER(B2:B, B2:B<>"")), "")'
-
-    # Formulas for Columns I, J, K (SUMIFS based on Category Heading in H) - assumes summary starts in H2
-    # I (Appu): Sum Col C (Appu Expense) where Col B (Category) matches H2
-    appu_sum_formula = '=IF(H2<>"", SUMIFS(C2:C, B2:B, H2), "")'
-    # J (Achu): Sum Col D (Achu Expense) where Col B (Category) matches H2
-    achu_sum_formula = '=IF(H2<>"", SUMIFS(D2:D, B2:B, H2), "")'
-    # K (Actual Amount): Sum Col F (Actual Amount) where Col B (Category) matches H2
-    # OR simply sum I2 and J2? Requirements line 80 says "Sum of Col F per category". Let's use SUMIFS on F.
-    # actual_sum_formula = '=IF(H2<>"", SUMIFS(F2:F, B2:B, H2), "")'
-    # Simpler: Sum the calculated Appu/Achu sums for that category
-    actual_sum_formula = '=IF(H2<>"", SUM(I2:J2), "")'
+    agg_formula = _build_final_recon_query(source_sheet_names, row_counts)
+
+    # Formula for Columns H-K (per-category summary) - assumes aggregated data starts in A2
+    # One grouped QUERY instead of UNIQUE categories in H plus SUMIFS per category in I/J/K:
+    # H: Category, I: Sum of Col C (Appu Expense), J: Sum of Col D (Achu Expense),
+    # K: Actual Amount as the sum of the Appu/Achu sums for that category
+    # Empty labels keep QUERY from adding a header row; row 1 already holds the headers
+    summary_formula = (
+        '=IFERROR(QUERY(A2:F, "SELECT B, SUM(C), SUM(D), SUM(C)+SUM(D) WHERE B IS NOT NULL GROUP BY B '
+        'LABEL B \'\', SUM(C) \'\', SUM(D) \'\', SUM(C)+SUM(D) \'\'", 0), "")'
+    )
 
 
     # --- Apply Formulas using Batch Update ---
-    requests = [
-        # Aggregation Formula in A2
-        {"range": gspread.utils.absolute_range_name(worksheet.title, "A2"), "values": [[agg_formula]]},
-        # Category Heading Formula in H2
-        {"range": gspread.utils.absolute_range_name(worksheet.title, "H2"), "values": [[cat_heading_formula]]},
-        # Appu Sum Formula in I2 (will auto-expand if H expands)
-        {"range": gspread.utils.absolute_range_name(worksheet.title, "I2"), "values": [[appu_sum_formula]]},
-        # Achu Sum Formula in J2
-        {"range": gspread.utils.absolute_range_name(worksheet.title, "J2"), "values": [[achu_sum_formula]]},
-        # Actual Sum Formula in K2
-        {"range": gspread.utils.absolute_range_name(worksheet.title, "K2"), "values": [[actual_sum_formula]]},
-    ]
-
-    # Apply ARRAYFORMULA wrapper for SUMIFS if needed for older sheets versions, but modern Sheets usually expands SUMIFS.
-    # If I2:K2 don't auto-expand, wrap them like: =ARRAYFORMULA(IF(H2:H<>"", SUMIFS(...), ""))
+    # Previous results in A2:F (aggregated data) and H2:K (summary) are cleared first, in the
+    # same request; then one updateCells each for the aggregation formula in A2 and the summary in H2
+    def formula_cells(*formulas):
+        return [{"values": [{"userEnteredValue": {"formulaValue": formula}} for formula in formulas]}]
 
-    # Correct body structure for batch_update with formulas
-    batch_update_requests = []
-    for req in requests:
-        range_a1 = req["range"]
-        # --- Start GridRange Fix ---
-        try:
-            # Assuming single cell range like "Final Recon!A2" or just "A2"
-            cell_a1 = range_a1.split('!')[-1] # Get "A2" part
-            start_row_idx, start_col_idx = gspread.utils.a1_to_rowcol(cell_a1)
-            grid_range = {
-                'sheetId': worksheet.id,
-                'startRowIndex': start_row_idx - 1, # 0-based
-                'endRowIndex': start_row_idx,       # Exclusive end row
-                'startColumnIndex': start_col_idx - 1, # 0-based
-                'endColumnIndex': start_col_idx        # Exclusive end col
+    batch_update_requests = [
+        {
+            "updateCells": {
+                # No endRowIndex: down to the bottom of the sheet, whatever its size
+                "range": {'sheetId': worksheet.id, 'startRowIndex': 1,
+                          'startColumnIndex': start_col, 'endColumnIndex': end_col},
+                "fields": "userEnteredValue" # No rows given, so the values are cleared
             }
-        except (gspread.exceptions.InvalidInputValue, ValueError) as e:
-            logging.error(f"Could not convert range '{range_a1}' to grid range: {e}. Skipping this request.")
-            continue # Skip this request if range is invalid
-        # --- End GridRange Fix ---
-
-        batch_update_requests.append({
+        }
+        for start_col, end_col in ((0, 6), (7, 11)) # Columns A-F, H-K
+    ] + [
+        {
             "updateCells": {
-                "rows": [{"values": [{"userEnteredValue": {"formulaValue": cell_value}} for cell_value in row_vals]} for row_vals in req["values"]],
+                "rows": formula_cells(agg_formula),
                 "fields": "userEnteredValue.formulaValue", # Use specific field mask
-                "range": grid_range
+                "range": {'sheetId': worksheet.id, 'startRowIndex': 1, 'endRowIndex': 2, # Row 2 (0-based, exclusive end)
+                          'startColumnIndex': 0, 'endColumnIndex': 1} # Column A
+            }
+        },
+        {
+            "updateCells": {
+                "rows": formula_cells(summary_formula),
+                "fields": "userEnteredValue.formulaValue",
+                "range": {'sheetId': worksheet.id, 'startRowIndex': 1, 'endRowIndex': 2,
+                          'startColumnIndex': 7, 'endColumnIndex': 8} # Column H; the result fills H-K
             }
-        })
+        },
+    ]
 
     body_correct = {"requests": batch_update_requests}
 
     try:
         # Use the correctly structured body
-        worksheet.spreadsheet.batch_update(body_correct)
-        logging.info(f"Successfully applied aggregation formulas to '{worksheet.title}'.")
+        _call_with_retry(lambda: worksheet.spreadsheet.batch_update(body_correct), "Final Recon formulas")
+        logger.info(f"Successfully applied aggregation formulas to '{worksheet.title}'.")
     except gspread.exceptions.APIError as e:
-        logging.error(f"API error applying aggregation formulas to '{worksheet.title}': {e}")
+        logger.error(f"API error applying aggregation formulas to '{worksheet.title}': {e}")
         raise # Re-raise
     except Exception as e:
-        logging.error(f"Unexpected error applying aggregation formulas to '{worksheet.title}': {e}")
+        logger.error(f"Unexpected error applying aggregation formulas to '{worksheet.title}': {e}")
         raise # Re-raise
 
 
 # --- Data Validation Helper ---
-def _apply_data_validation(worksheet: gspread.Worksheet, start_row: int, end_row: int, start_col: int, end_col: int, condition_type: str, condition_values: List, input_message: str = None, strict: bool = True):
+def _data_validation_rule(condition_type: str, condition_values: List, input_message: str = None, strict: bool = True) -> dict:
     """
-    Applies data validation rules to a specified cell range using batch update.
+    Builds a DataValidationRule for setDataValidation requests. The rule doesn't depend on the
+    range, so one rule can be shared by the requests for every sheet.
 
     Args:
-        worksheet: The gspread Worksheet object.
-        start_row: The starting row index (1-based).
-        end_row: The ending row index (1-based).
-        start_col: The starting column index (1-based).
-        end_col: The ending column index (1-based).
         condition_type: The type of validation (e.g., 'ONE_OF_LIST', 'NUMBER_GREATER').
         condition_values: A list of values for the condition (e.g., list of strings for ONE_OF_LIST).
         input_message: Optional message shown when cell is selected.
         strict: If True, invalid data is rejected. If False, allows invalid data with a warning.
     """
-    range_desc = f"R{start_row}C{start_col}:R{end_row}C{end_col}"
-    logging.info(f"Applying data validation to '{worksheet.title}' range {range_desc} "
-                 f"(Type: {condition_type}, Strict: {strict})")
-
-    try:
-        # Prepare condition values for the API request
-        api_condition_values = [{'userEnteredValue': str(v)} for v in condition_values]
-
-        # Build the request body for batchUpdate
-        # GridRange construction here was already correct.
-        requests = [{
-            'setDataValidation': {
-                'range': {
-                    'sheetId': worksheet.id,
-                    'startRowIndex': start_row - 1, # API uses 0-based index
-                    'endRowIndex': end_row,         # Sheets API end index is inclusive for rows/cols, but GridRange is exclusive
-                    'startColumnIndex': start_col - 1,
-                    'endColumnIndex': end_col
-                },
-                'rule': {
-                    'condition': {
-                        'type': condition_type,
-                        'values': api_condition_values
-                    },
-                    'inputMessage': input_message or f"Select from list", # Keep message concise
-                    'showCustomUi': True, # Show dropdown arrow for lists
-                    'strict': strict
-                }
-            }
-        }]
-        worksheet.spreadsheet.batch_update({'requests': requests})
+    return {
+        'condition': {
+            'type': condition_type,
+            'values': [{'userEnteredValue': str(v)} for v in condition_values] # Condition values for the API request
+        },
+        'inputMessage': input_message or f"Select from list", # Keep message concise
+        'showCustomUi': True, # Show dropdown arrow for lists
+        'strict': strict
+    }
 
-        logging.debug(f"Successfully applied data validation to range {range_desc} in '{worksheet.title}'.")
+def _add_data_validation_request(pending_requests: List[dict], sheet_id: int, sheet_title: str, start_row: int, end_row: int, start_col: int, end_col: int, rule: dict):
+    """
+    Queues a setDataValidation request for a specified cell range onto pending_requests.
 
-    except gspread.exceptions.APIError as e:
-        # Check for specific errors, e.g., invalid range or condition type
-        logging.error(f"API error applying data validation to {range_desc} in '{worksheet.title}': {e}")
-        # Don't raise here, allow other validations/steps to proceed
-    except Exception as e:
-        logging.error(f"Unexpected error applying data validation to {range_desc} in '{worksheet.title}': {e}")
-        # Don't raise here
+    Args:
+        pending_requests: The batchUpdate subrequests being collected for the spreadsheet.
+        sheet_id: The sheetId of the target sheet.
+        sheet_title: The title of the target sheet (for logging).
+        start_row: The starting row index (1-based).
+        end_row: The ending row index (1-based).
+        start_col: The starting column index (1-based).
+        end_col: The ending column index (1-based).
+        rule: The rule from _data_validation_rule; only referenced, not copied.
+    """
+    logger.debug("Preparing data validation for '%s' range R%dC%d:R%dC%d (Type: %s, Strict: %s)",
+                 sheet_title, start_row, start_col, end_row, end_col, rule['condition']['type'], rule['strict'])
+
+    # GridRange construction here was already correct.
+    pending_requests.append({
+        'setDataValidation': {
+            'range': {
+                'sheetId': sheet_id,
+                'startRowIndex': start_row - 1, # API uses 0-based index
+                'endRowIndex': end_row,         # Sheets API end index is inclusive for rows/cols, but GridRange is exclusive
+                'startColumnIndex': start_col - 1,
+                'endColumnIndex': end_col
+            },
+            'rule': rule
+        }
+    })
 
 # Example usage (Commented out - requires Transaction objects and valid config for testing)
 # if __name__ == '__main__':